@@ -0,0 +1,308 @@
+"""
+Approximate nearest-neighbour search over a fixed-length embedding of the six descriptors.
+
+Each image becomes one float32 vector made of blocks:
+    histogram          768  sqrt of the L1-normalised b/g/r histograms (Euclidean ~ Bhattacharyya)
+    dominant_colors      3  mean of the dominant colors
+    gabor_descriptors    8
+    hu_moments           7
+    texture_energy       4
+    circularity          1
+The relevance-feedback weights change between queries, so the index is built on the unweighted
+vectors and every block is scaled by its feature weight at query time. A backend retrieves a
+candidate pool, and the candidates are re-ranked exactly with the same weighted distance as
+DescriptorIndex.search (i.e. compute_similarity_score).
+
+A build is published as one immutable ANNState (rows, embeddings, backend state), so a search
+always pairs structures of the same build. Builds start in the background when the descriptor
+index is refreshed; searches keep using the previous build until the new one is published.
+"""
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+from collections import namedtuple
+
+import numpy as np
+
+from descriptor_index import HISTOGRAM_BINS, take_rows, top_k_indices
+from metrics import stage
+from similarity import HISTOGRAM_CHANNELS, weights_vector
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ANN_INDEX_FILE = os.path.join(BASE_DIR, 'ann_index.npz')
+
+EMBEDDING_BLOCKS = (
+    ("histogram", len(HISTOGRAM_CHANNELS) * HISTOGRAM_BINS),
+    ("dominant_colors", 3),
+    ("gabor_descriptors", 8),
+    ("hu_moments", 7),
+    ("texture_energy", 4),
+    ("circularity", 1),
+)
+
+
+def _sqrt_normalized(hists):
+    hists = np.asarray(hists, dtype=np.float64)
+    sums = hists.sum(axis=-1, keepdims=True)
+    return np.sqrt(np.divide(hists, sums, out=np.zeros_like(hists), where=sums > 0))
+
+
+def embed_index_data(data):
+    """(N, D) float32 embedding of every row of an IndexData."""
+    counts = np.maximum(data.dominant_counts, 1)[:, None]
+    return np.hstack([
+        # ||sqrt(p) - sqrt(q)|| = sqrt(2) * Bhattacharyya distance for normalised histograms
+        _sqrt_normalized(data.histograms).reshape(len(data.keys), -1) / np.sqrt(2),
+        data.dominant_colors.sum(axis=1) / counts,
+        data.gabor,
+        data.hu_moments,
+        data.texture_energy,
+        data.circularity[:, None],
+    ]).astype(np.float32)
+
+
+def embed_query(query_descriptors):
+    """(D,) float32 embedding of a query descriptor dict."""
+    hist = np.array([query_descriptors["histogram"][color] for color in HISTOGRAM_CHANNELS])
+    colors = np.asarray(query_descriptors["dominant_colors"], dtype=np.float64).reshape(-1, 3)
+    return np.concatenate([
+        _sqrt_normalized(hist).ravel() / np.sqrt(2),
+        colors.mean(axis=0) if len(colors) else np.zeros(3),
+        np.ravel(query_descriptors["gabor_descriptors"]),
+        np.ravel(query_descriptors["hu_moments"]),
+        np.ravel(query_descriptors["texture_energy"]),
+        np.ravel(query_descriptors["circularity"]),
+    ]).astype(np.float32)
+
+
+def block_scale(weights):
+    """Per-dimension scale that applies each feature weight to its block of the embedding."""
+    return np.repeat(weights_vector(weights), [size for _, size in EMBEDDING_BLOCKS]).astype(np.float32)
+
+
+def _scaled_sq_distances(vectors, query, scale):
+    return np.square((vectors - query) * scale).sum(axis=1)
+
+
+# One published build: the IndexData it covers, its embeddings and the backend's structures (a dict of arrays)
+ANNState = namedtuple('ANNState', ['data', 'embeddings', 'backend_state'])
+
+
+class BruteForceBackend:
+    """Scans every embedding; useful as a baseline and for small collections."""
+    name = 'brute'
+
+    def build(self, embeddings):
+        return {}
+
+    def candidates(self, state, embeddings, query, scale, n_candidates):
+        distances = _scaled_sq_distances(embeddings, query, scale)
+        return top_k_indices(distances, n_candidates)
+
+    def load_state(self, saved):
+        return {}
+
+
+class IVFBackend:
+    name = 'ivf'
+
+    def __init__(self, n_lists=None, n_probe=8):
+        """
+        Inverted-file index: k-means coarse quantizer, one list of rows per centroid
+
+        :param n_lists: Number of coarse clusters (defaults to sqrt(N))
+        :param n_probe: Number of closest lists scanned per query
+        """
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+
+    def build(self, embeddings):
+        n_lists = min(self.n_lists or max(1, int(np.sqrt(len(embeddings)))), len(embeddings))
+        from sklearn.cluster import MiniBatchKMeans
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=0, n_init=3, batch_size=4096).fit(embeddings)
+        labels = kmeans.labels_
+        list_rows = np.argsort(labels, kind='stable')
+        return {
+            'centroids': kmeans.cluster_centers_.astype(np.float32),
+            'list_rows': list_rows,
+            'list_offsets': np.searchsorted(labels[list_rows], np.arange(n_lists + 1)),
+            'n_probe': np.array(self.n_probe),
+        }
+
+    def candidates(self, state, embeddings, query, scale, n_candidates):
+        # Lists are ranked with the query's weights, so the probe follows the current feature weighting
+        list_rows, list_offsets = state['list_rows'], state['list_offsets']
+        centroid_distances = _scaled_sq_distances(state['centroids'], query, scale)
+        probe = top_k_indices(centroid_distances, int(state['n_probe']))
+        rows = np.concatenate([list_rows[list_offsets[c]:list_offsets[c + 1]] for c in probe])
+        distances = _scaled_sq_distances(embeddings[rows], query, scale)
+        return rows[top_k_indices(distances, n_candidates)]
+
+    def load_state(self, saved):
+        return {name: saved[name] for name in ('centroids', 'list_rows', 'list_offsets', 'n_probe')}
+
+
+ANN_BACKENDS = {
+    BruteForceBackend.name: BruteForceBackend,
+    IVFBackend.name: IVFBackend,
+}
+
+
+class ANNIndex:
+    def __init__(self, descriptor_index, backend='ivf', path=ANN_INDEX_FILE, candidate_factor=20, **backend_options):
+        """
+        Candidate retrieval on the embedding, then exact re-ranking on the descriptor index
+
+        :param descriptor_index: DescriptorIndex providing the exact descriptors
+        :param backend: Name of an entry in ANN_BACKENDS
+        :param path: .npz file the index is persisted to (None to keep it in memory only)
+        :param candidate_factor: Candidates re-ranked exactly per requested result
+        """
+        self.descriptor_index = descriptor_index
+        self.backend = ANN_BACKENDS[backend](**backend_options)
+        self.path = path
+        self.candidate_factor = candidate_factor
+        self._state = None
+        self._build_lock = threading.Lock()
+        # Rebuild as soon as the descriptor index is reloaded rather than on the next query
+        # (turned off in a pre-fork master, whose workers build after forking: see app.after_fork)
+        self.rebuild_on_refresh = True
+        descriptor_index.refresh_listeners.append(self.rebuild_async)
+        # A build thread does not survive fork(): a child must not inherit its lock in the held state
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_build_lock)
+
+    def _row_keys(self, data):
+        return np.array([f"{category}/{image_name}" for category, image_name in data.keys])
+
+    def ensure_current(self):
+        """
+        Rebuild (or load from disk) when the descriptor index has changed since the last build.
+        Only one build runs at a time; the result is published in a single assignment.
+
+        :return: The current ANNState
+        """
+        with self._build_lock:
+            data = self.descriptor_index.data
+            state = self._state
+            if state is not None and state.data is data:
+                return state
+            state = self._load(data)
+            if state is None:
+                state = self._build(data)
+                self._save(state)
+            self._state = state
+            return state
+
+    def rebuild_async(self, data=None):
+        """Start ensure_current() in a daemon thread (registered as a refresh listener of the descriptor index)."""
+        if not self.rebuild_on_refresh:
+            return
+        threading.Thread(target=self.ensure_current, name='ann-build', daemon=True).start()
+
+    def wait_for_build(self):
+        """Block until a running build has been published."""
+        with self._build_lock:
+            pass
+
+    def _reset_build_lock(self):
+        self._build_lock = threading.Lock()
+
+    def _build(self, data):
+        embeddings = embed_index_data(data)
+        backend_state = self.backend.build(embeddings) if len(embeddings) else {}
+        logger.info("Built %s ANN index over %d images", self.backend.name, len(data.keys))
+        return ANNState(data, embeddings, backend_state)
+
+    def _save(self, state):
+        if not self.path or not len(state.embeddings):
+            return
+        # Written next to the target and renamed into place, so a worker loading it never reads a partial file
+        fd, staging = tempfile.mkstemp(prefix=f".{os.path.basename(self.path)}-", suffix='.npz',
+                                       dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, backend=np.array(self.backend.name), keys=self._row_keys(state.data),
+                         embeddings=state.embeddings, **state.backend_state)
+            os.chmod(staging, 0o644)
+            os.replace(staging, self.path)
+        except BaseException:
+            if os.path.exists(staging):
+                os.remove(staging)
+            raise
+
+    def _load(self, data):
+        """The persisted index as an ANNState if it was built for exactly these rows, else None."""
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with np.load(self.path) as saved:
+                if str(saved['backend']) != self.backend.name or not np.array_equal(saved['keys'], self._row_keys(data)):
+                    return None
+                state = ANNState(data, saved['embeddings'], self.backend.load_state(saved))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            logger.warning("Ignoring unreadable ANN index %s: %s", self.path, e)
+            return None
+        logger.info("Loaded %s ANN index over %d images from %s", self.backend.name, len(data.keys), self.path)
+        return state
+
+    def current_state(self):
+        """
+        The state to search: the latest published build, even if a rebuild for newer data is running;
+        builds synchronously only when nothing is published yet or no rebuild was started.
+        """
+        state = self._state
+        if state is None or (state.data is not self.descriptor_index.data and not self._build_lock.locked()):
+            state = self.ensure_current()
+        return state
+
+    def search(self, query_descriptors, weights, top_k=10):
+        """
+        Same interface and result format as DescriptorIndex.search
+
+        :param query_descriptors: Descriptors of the query image
+        :param weights: Dictionary of feature weights
+        :param top_k: Number of results to return
+        :return: List of {'category', 'image_name', 'similarity_score'} sorted by score
+        """
+        state = self.current_state()
+        data = state.data
+        if not len(data.keys):
+            return []
+        with stage('ann_candidates'):
+            rows = self.backend.candidates(state.backend_state, state.embeddings, embed_query(query_descriptors),
+                                           block_scale(weights), max(top_k * self.candidate_factor, top_k))
+            candidates = take_rows(data, rows)
+        distances = self.descriptor_index.feature_distances(query_descriptors, candidates)
+        with stage('sort'):
+            scores = distances @ weights_vector(weights)
+            return [{
+                'category': candidates.keys[i][0],
+                'image_name': candidates.keys[i][1],
+                'similarity_score': float(scores[i]),
+            } for i in top_k_indices(scores, top_k)]
+
+    def search_many(self, queries, weights, top_k=10):
+        """One search per query; candidate pools differ per query so there is nothing to batch."""
+        return [self.search(query, weights, top_k) for query in queries]
+
+
+def recall_at_k(ann_index, queries, weights, top_k=10):
+    """
+    Fraction of the exhaustive top_k that the ANN search also returns, averaged over queries
+
+    :param ann_index: ANNIndex to evaluate
+    :param queries: Iterable of query descriptor dicts
+    :param weights: Dictionary of feature weights
+    """
+    recalls = []
+    for query in queries:
+        exact = {(r['category'], r['image_name']) for r in ann_index.descriptor_index.search(query, weights, top_k)}
+        approx = {(r['category'], r['image_name']) for r in ann_index.search(query, weights, top_k)}
+        recalls.append(len(exact & approx) / max(len(exact), 1))
+    return float(np.mean(recalls)) if recalls else 1.0
+
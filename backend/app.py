@@ -1,52 +1,55 @@
-from flask import Flask, request, jsonify, send_from_directory,url_for
-from werkzeug.utils import secure_filename
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context, g
 from flask_cors import CORS
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
-from pymongo import MongoClient
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 import time
-import traceback
-from datetime import datetime, timedelta
 import os
 import json
 import numpy as np
-from PIL import Image
 import cv2
 import logging
-from sklearn.cluster import KMeans
-from scipy.spatial import distance
-from collections import Counter
-import os
-from bson.json_util import dumps
-# Set up basic logging configuration
-logging.basicConfig(level=logging.DEBUG)
+import importlib
+import threading
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+# scikit-learn, google-auth and pymongo are imported where they are first needed (see create_app),
+# so importing this module stays fast; `python -X importtime` budget: benchmarks/startup_time.py.
+# OpenCV stays a module import: on top of NumPy it adds ~12 ms, and every descriptor module uses it
+# Set up basic logging configuration; LOG_LEVEL=DEBUG also logs every descriptor vector and score
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 
 from relevance_feedback import RelevanceFeedbackManager
-from similarity import compute_similarity_score
-from image_utils import (
-    calculate_color_histogram, 
-    find_dominant_colors, 
-    calculate_gabor_descriptors, 
-    calculate_hu_moments, 
-    calculate_texture_energy, 
-    calculate_circularity
-)
+from descriptor_index import DescriptorIndex, StreamingSearch
+from ann_index import ANNIndex
+from sharded_search import ShardedSearch
+from cascade_search import CascadeSearch
+from similarity import FEATURES
+import image_utils
+from image_utils import extract_descriptors
+from query_cache import content_hash, descriptor_cache, result_cache
+from job_queue import JobQueue, QueueFull
+from query_store import QueryStore
+from upload_store import UploadStore
+import metrics
+from metrics import stage
+from artifact_cache import (ArtifactCache, DATASET_FOLDER, THUMBNAIL_FOLDER, THUMBNAIL_SIZES, artifact_key,
+                            is_artifact_key, source_hash, thumbnail)
 app = Flask(__name__)
 
 # Enable CORS for all routes
 CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
 
-# MongoDB connection
-client = MongoClient("mongodb://127.0.0.1:27017/")
-db = client['ImageMatch']
-users_collection = db.users
-descriptors_collection = db['image_descriptors2']
-similarity_collection = db['similarity']
+# MongoDB connection, created by create_app(); every command is counted so each request can log its round-trips
+MONGO_URI = os.environ.get('MONGO_URI', "mongodb://127.0.0.1:27017/")
+mongo_round_trips = None
+client = None
+db = None
+users_collection = None
+descriptors_collection = None
+similarity_collection = None
 
 # Google Client ID
 CLIENT_ID = "287952495373-lvnnfspk2m46akv9nshqo473eco2oe6i.apps.googleusercontent.com"
-print(f"Google CLIENT_ID: {CLIENT_ID}")
 
 # Get the absolute path to the 'processed' folder
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -58,16 +61,241 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # Configure the upload folder
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Uploads are ranked from memory; SAVE_UPLOADS=0 skips keeping a copy (the visualizations then have no file to show).
+# Saved copies are pruned to UPLOAD_MAX_FILES / UPLOAD_MAX_MB / UPLOAD_MAX_AGE_DAYS (0 disables a limit).
+# They are written in the background (at most UPLOAD_MAX_PENDING queued), so routes reading one wait for its write
+SAVE_UPLOADS = int(os.environ.get('SAVE_UPLOADS', 1))
+upload_store = UploadStore(
+    UPLOAD_FOLDER,
+    max_bytes=int(float(os.environ.get('UPLOAD_MAX_MB', 1024)) * 1024 * 1024) or None,
+    max_files=int(os.environ.get('UPLOAD_MAX_FILES', 1000)) or None,
+    max_age=float(os.environ.get('UPLOAD_MAX_AGE_DAYS', 0)) * 86400 or None,
+    max_pending=int(os.environ.get('UPLOAD_MAX_PENDING', 32)),
+)
+
+
+def wait_for_upload(image_path):
+    """Wait for the background write of an upload, for a filePath (processed/<name>) sent back by the client."""
+    if os.path.dirname(os.path.abspath(image_path)) == os.path.abspath(UPLOAD_FOLDER):
+        upload_store.wait(os.path.basename(image_path))
 # Ensure the processed folder exists
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
 # Relevance Feedback Manager
 feedback_manager = RelevanceFeedbackManager()
 
+# 'exact' scans every image; 'ann' retrieves candidates from an IVF index (ann_index.npz) and re-ranks them exactly;
+# 'stream' scores the collection batch by batch on every query and keeps no descriptor matrices in memory;
+# 'sharded' scores SEARCH_SHARDS slices of the memory-mapped descriptor store in parallel worker processes;
+# 'cascade' ranks every image on cheap features plus lower bounds and scores only a candidate pool exactly
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'exact')
+USE_INDEX = SEARCH_BACKEND != 'stream'
+
+# In-memory descriptor matrices, loaded in the background after startup and refreshed when the collection changes.
+# Memory-mapped from the binary descriptor store, so every worker process shares one copy
+DESCRIPTOR_STORE_DIR = os.environ.get('DESCRIPTOR_STORE_DIR', os.path.join(BASE_DIR, "descriptor_store"))
+INDEX_RETRY_SECONDS = 30
+descriptor_index = None
+searcher = None
+# Until index_ready is set, queries scan the collection with stream_fallback instead of waiting for the index
+stream_fallback = None
+index_ready = threading.Event()
+_index_loader = None
+_init_lock = threading.Lock()
+
+# Per-query state (descriptors and last results) keyed by the query_id returned from /save-image.
+# Queries are written through to QUERY_SPILL_DIR, so feedback rounds find them after eviction, a restart or in another worker
+QUERY_SPILL_DIR = os.environ.get('QUERY_SPILL_DIR', os.path.join(BASE_DIR, "query_spill"))
+# Their distance matrices (8 bytes x 6 features per indexed image) are kept up to QUERY_DISTANCES_MB in total
+query_store = QueryStore(maxsize=int(os.environ.get('QUERY_STORE_SIZE', 256)), spill_dir=QUERY_SPILL_DIR or None,
+                         max_distance_bytes=int(float(os.environ.get('QUERY_DISTANCES_MB', 256)) * 1024 * 1024))
+
+def make_searcher():
+    if SEARCH_BACKEND == 'ann':
+        return ANNIndex(descriptor_index)
+    if SEARCH_BACKEND == 'stream':
+        return stream_fallback
+    if SEARCH_BACKEND == 'sharded':
+        return ShardedSearch(descriptor_index, shards=int(os.environ.get('SEARCH_SHARDS', 0)) or None)
+    if SEARCH_BACKEND == 'cascade':
+        return CascadeSearch(descriptor_index, candidate_factor=int(os.environ.get('CASCADE_CANDIDATES', 10)),
+                             audit_rate=float(os.environ.get('CASCADE_AUDIT_RATE', 0)))
+    return descriptor_index
+
+def connect_mongo(uri=MONGO_URI):
+    """Create the MongoDB client and collections (MongoClient connects lazily)."""
+    global mongo_round_trips, client, db, users_collection, descriptors_collection, similarity_collection
+    from pymongo import MongoClient
+    from mongo_metrics import RoundTripCounter
+
+    mongo_round_trips = RoundTripCounter()
+    client = MongoClient(uri, event_listeners=[mongo_round_trips])
+    db = client['ImageMatch']
+    users_collection = db.users
+    descriptors_collection = db['image_descriptors2']
+    similarity_collection = db['similarity']
+
+def init_mongo(uri=MONGO_URI):
+    """Connect to MongoDB and create the descriptor index and searcher."""
+    global descriptor_index, searcher, stream_fallback
+    connect_mongo(uri)
+    descriptor_index = DescriptorIndex(descriptors_collection, store_dir=DESCRIPTOR_STORE_DIR or None)
+    stream_fallback = StreamingSearch(descriptors_collection)
+    searcher = make_searcher()
+    if isinstance(searcher, CascadeSearch):
+        # Certified queries are provably exhaustive; disagreements are counted among the audited others
+        metrics.registry.register_callback('imagematch_cascade_queries_total', "Cascade searches", metric_type='counter',
+                                           label_name='outcome', func=lambda: {
+                                               key: value for key, value in searcher.stats().items()
+                                               if key in ('queries', 'certified', 'audited', 'disagreements')})
+
+def load_search_index(retry_seconds=None):
+    """
+    Create the (category, image_name) collection index and load the descriptor index, then set
+    index_ready. With retry_seconds, a failed load (e.g. MongoDB not up yet) is retried until it succeeds.
+    """
+    while True:
+        try:
+            # Feedback lookups that miss the index query by (category, image_name)
+            descriptors_collection.create_index([('category', 1), ('image_name', 1)])
+            if USE_INDEX:
+                descriptor_index.refresh()
+            index_ready.set()
+            return True
+        except Exception as e:
+            if retry_seconds is None:
+                logging.warning("Descriptor index not loaded, queries scan the collection meanwhile: %s", e)
+                return False
+            logging.warning("Descriptor index not loaded, retrying in %ss: %s", retry_seconds, e)
+            time.sleep(retry_seconds)
+
+def create_app(load_index=True, background=True, prefork=False):
+    """
+    Application factory: connect to MongoDB and start loading the descriptor index. Importing the module
+    only defines the routes, so a worker is ready to serve as soon as this returns; while the index loads
+    in a background thread, searches scan the collection (stream_search) instead of waiting.
+
+    :param load_index: Load the descriptor index (and create the collection index) at all
+    :param background: Load it in a daemon thread (retrying until MongoDB answers) rather than before returning
+    :param prefork: Loading in a pre-fork master (wsgi.py): no ANN build thread is started, each worker
+                    builds after forking (after_fork), since locks and OpenMP pools do not survive fork()
+    """
+    global _index_loader
+    with _init_lock:
+        if descriptors_collection is None:
+            init_mongo()
+        if prefork and isinstance(searcher, ANNIndex):
+            searcher.rebuild_on_refresh = False
+        if load_index and _index_loader is None:
+            if background:
+                _index_loader = threading.Thread(target=load_search_index, args=(INDEX_RETRY_SECONDS,),
+                                                 name='index-loader', daemon=True)
+                _index_loader.start()
+            else:
+                _index_loader = threading.current_thread()
+                load_search_index()
+    return app
+
+def after_fork():
+    """
+    Run in each pre-forked worker (see gunicorn.conf.py). MongoClient is not fork-safe, so the worker
+    opens its own connection; the descriptor index loaded by the parent is kept and shared copy-on-write.
+    If the parent could not load it, the worker keeps trying in the background.
+    """
+    global _index_loader
+    connect_mongo()
+    descriptor_index.collection = descriptors_collection
+    stream_fallback.collection = descriptors_collection
+    if isinstance(searcher, ANNIndex):
+        searcher.rebuild_on_refresh = True
+        searcher.rebuild_async()
+    if not index_ready.is_set():
+        _index_loader = threading.Thread(target=load_search_index, args=(INDEX_RETRY_SECONDS,),
+                                         name='index-loader', daemon=True)
+        _index_loader.start()
+
+def before_fork():
+    """
+    Run in a pre-fork master before each worker is forked: its MongoDB connections must not be shared with
+    the children (closed, reopened if ever used again), and a running ANN build is waited for, since a thread
+    caught mid-build would leave its locks held forever in the child.
+    """
+    if client is not None:
+        client.close()
+    if isinstance(searcher, ANNIndex):
+        searcher.wait_for_build()
+
+# Seconds the last warm_up() took in this process (None until it ran)
+warm_up_seconds = None
+
+def warm_up(query=True):
+    """
+    Do the one-off work of a first request ahead of it: build the Gabor filter bank, import scikit-learn
+    and, with query, run one search for a small synthetic image (KMeans, index scoring, refresh_if_stale).
+    The pre-fork parent warms up without the query: OpenMP thread pools started before fork() can hang
+    the workers, so each worker runs the query itself after forking.
+
+    :return: Seconds spent
+    """
+    global warm_up_seconds
+    start = time.perf_counter()
+    for sigma, theta in image_utils.gabor_bank():
+        image_utils.gabor_kernel(sigma, theta)
+    # Imported lazily by dominant_colors; in the parent it is then shared by every worker
+    importlib.import_module('sklearn.cluster')
+    if query:
+        image = np.random.default_rng(0).integers(0, 256, size=(64, 64, 3), dtype=np.uint8)
+        try:
+            find_similar_images(extract_descriptors(image), top_k=1)
+        except Exception as e:
+            logging.warning("Warm-up query failed: %s", e)
+    warm_up_seconds = time.perf_counter() - start
+    logging.info("Warm-up took %.2fs", warm_up_seconds)
+    return warm_up_seconds
+
+def worker_shutdown():
+    """Let the background work of an exiting worker finish: queued upload saves, the shard worker pool."""
+    upload_store.flush()
+    if isinstance(searcher, ShardedSearch):
+        searcher.close()
+
+def active_searcher():
+    """The configured searcher, or the collection scan while the descriptor index is still loading."""
+    if USE_INDEX and not index_ready.is_set():
+        return stream_fallback
+    return searcher
+
 # Helper Functions
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@app.before_request
+def ensure_initialized():
+    # `flask --app app run` or a WSGI server importing app:app never calls create_app(): do it on the first request
+    if descriptors_collection is None:
+        create_app()
+
+# Per-stage timings of every request go to /metrics; SERVER_TIMING=1 also returns them as a Server-Timing header
+SERVER_TIMING = int(os.environ.get('SERVER_TIMING', 0))
+
+@app.before_request
+def reset_round_trips():
+    if mongo_round_trips is not None:
+        mongo_round_trips.reset()
+    g.request_start = time.perf_counter()
+    metrics.begin_request()
+
+@app.after_request
+def log_round_trips(response):
+    if mongo_round_trips is not None and mongo_round_trips.count:
+        logging.info(f"{request.method} {request.path}: {mongo_round_trips.count} MongoDB round-trips")
+    timings = metrics.end_request()
+    metrics.request_seconds.observe(time.perf_counter() - g.get('request_start', time.perf_counter()),
+                                    request.endpoint or 'unmatched', response.status_code)
+    if SERVER_TIMING and timings:
+        response.headers['Server-Timing'] = metrics.server_timing_header(timings)
+    return response
+
 @app.after_request
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
@@ -78,6 +306,9 @@ def add_cors_headers(response):
 # Authentication Routes
 @app.route('/api/auth/google', methods=['POST'])
 def google_auth():
+    from google.oauth2 import id_token
+    from google.auth.transport import requests as google_requests
+
     token = request.json.get('token')
     try:
         id_info = id_token.verify_oauth2_token(token, google_requests.Request(), CLIENT_ID)
@@ -122,6 +353,7 @@ def forgot_password():
 @app.route("/processed/<filename>")
 def serve_processed_image(filename):
     try:
+        upload_store.wait(filename)
         return send_from_directory(PROCESSED_FOLDER, filename)
     except Exception as e:
         return jsonify({"error": str(e)}), 404
@@ -131,72 +363,94 @@ def get_images():
     if request.method == 'OPTIONS':
         return '', 200
     try:
-        files = os.listdir(PROCESSED_FOLDER)
+        files = [name for name in os.listdir(PROCESSED_FOLDER) if not name.startswith('.')]
         return jsonify({"images": files}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # function for finding similar images and feedback
-def find_similar_images(query_descriptors, top_k=10, weights=None):
-    # If no specific weights provided, use default
+def find_similar_images(query_descriptors, top_k=10, weights=None, query_hash=None, query_id=None):
+    # If no specific weights provided, use one immutable snapshot of the current weights for the whole pass
+    weights_snapshot = None
     if weights is None:
-        weights = feedback_manager.current_weights
-    print(f"Using weights: {weights}")
-    
-    # Fetch all descriptors from MongoDB
-    all_descriptors = list(descriptors_collection.find())
-    print(f"Total descriptors found in DB: {len(all_descriptors)}")
-    
-    similarities = []
-
-    for doc in all_descriptors:
-        try:
-            # Ensure all descriptors exist, use empty list as fallback
-            descriptors = {
-                "histogram": doc.get('histogram', []),
-                "dominant_colors": doc.get('dominant_colors', []),
-                "gabor_descriptors": doc.get('gabor_descriptors', []),
-                "hu_moments": doc.get('hu_moments', []),
-                "texture_energy": doc.get('texture_energy', []),
-                "circularity": doc.get('circularity', []),
-            }
-
-            # Log missing descriptors
-            for key, value in descriptors.items():
-                if not value:
-                    print(f"Missing or empty descriptor for {doc.get('image_name')}: {key}")
-
-            # Check if any descriptor is empty
-            if all(len(desc) == 0 for desc in descriptors.values()):
-                print(f"Skipping {doc.get('image_name')} - No descriptors found")
-                continue
-
-
-            similarity_score = compute_similarity_score(
-                query_descriptors,
-                descriptors,
-                weights
-            )
-            print(f"Similarity score for {doc.get('image_name')}: {similarity_score}")
-            
-            similarities.append({
-                'category': doc['category'],
-                'image_name': doc['image_name'],
-                'similarity_score': similarity_score
-            })
-        except Exception as e:
-            print(f"Error processing descriptor for {doc.get('image_name')}: {e}")
-
-    # Sort by similarity score (lower score means more similar)
-    similarities = sorted(similarities, key=lambda x: x['similarity_score'])[:top_k]
-    print(f"Top {top_k} similar images: {similarities}")
+        weights_snapshot = feedback_manager.weights_store.snapshot()
+        weights = weights_snapshot.weights
+    logging.debug("Using weights: %s", dict(weights))
+
+    # Score against the in-memory descriptor matrices, reloading them if the collection changed
+    index_loaded = USE_INDEX and index_ready.is_set()
+    if index_loaded:
+        descriptor_index.refresh_if_stale()
+        logging.debug("Total descriptors in index: %d", len(descriptor_index))
+
+    # Ranked results can be reused only for the same image, weights version and index version
+    cache_key = None
+    if query_hash and weights_snapshot and index_loaded:
+        result_cache.ensure_generation((descriptor_index.version, weights_snapshot.version))
+        cache_key = (query_hash, weights_snapshot.version, top_k)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logging.debug("Result cache hit for %s", query_hash)
+            return [dict(sim) for sim in cached]
+
+    similarities = None
+    if query_id is not None and searcher is descriptor_index and index_loaded:
+        # Exhaustive search of a stored query: keep its distance matrix for the feedback rounds
+        similarities = rank_stored_query(query_id, weights, top_k)
+    if similarities is None:
+        similarities = active_searcher().search(query_descriptors, weights, top_k)
+    logging.debug("Top %d similar images: %s", top_k, similarities)
+
+    resolve_image_paths(similarities)
+
+    if cache_key:
+        result_cache.set(cache_key, [dict(sim) for sim in similarities])
+    return similarities
 
+def resolve_image_paths(similarities):
     # Resolve local file paths for each similar image
     for sim in similarities:
         sim['image_path'] = f"/static/dataset/{sim['category']}/{sim['image_name']}"
-        print(f"Resolved image path: {sim['image_path']}")
-        
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        for sim in similarities:
+            logging.debug("Resolved image path: %s", sim['image_path'])
     return similarities
+
+def query_descriptors_error(query_descriptors):
+    """Why a query cannot be searched with these descriptors, or None; shared by single, async and batch search."""
+    if not any(query_descriptors.values()):
+        return 'Error: Descriptors are empty'
+    return None
+
+def rank_stored_query(query_id, weights, top_k=10):
+    """
+    Rank a stored query from its (N, 6) per-feature distance matrix, computed once per index
+    version and kept in the query store (within its byte budget, recomputed when dropped), so
+    re-weighting costs one dot product and a top-k.
+    Returns None if the query is unknown or the descriptor index is still loading.
+    """
+    query = query_store.get(query_id)
+    if query is None or not index_ready.is_set():
+        return None
+    descriptor_index.refresh_if_stale()
+    # Version before data: a refresh in between only makes the cached matrix look stale
+    version = descriptor_index.version
+    data = descriptor_index.data
+    distances = query_store.get_distances(query_id, version)
+    if distances is None or len(distances) != len(data.keys):
+        distances = descriptor_index.feature_distances(query['descriptors'], data)
+        query_store.set_distances(query_id, version, distances)
+    return descriptor_index.rank(distances, weights, top_k, data)
+
+def get_query_descriptors(data):
+    """Hash the encoded image bytes and return (hash, descriptors), extracting only on a cache miss."""
+    query_hash = content_hash(data)
+    query_descriptors = descriptor_cache.get(query_hash)
+    if query_descriptors is None:
+        query_descriptors = extract_descriptors(data)
+        descriptor_cache.set(query_hash, query_descriptors)
+    return query_hash, query_descriptors
+
 @app.route('/save-image', methods=['POST'])
 def save_image():
     try:
@@ -212,139 +466,364 @@ def save_image():
             print("No selected file")
             return jsonify({'message': 'No selected file'}), 400
 
-        # Save the file to the backend/processed folder
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-        print(f"Saving file to {filepath}")
-        file.save(filepath)
-
-        # Clear previous global query_descriptors to avoid data pollution
-        global query_descriptors
-        query_descriptors = {}  # Clear previous descriptors
-
-        # Compute descriptors for the uploaded image
-        query_descriptors = {
-            "histogram": calculate_color_histogram(filepath),
-            "dominant_colors": find_dominant_colors(filepath),
-            "gabor_descriptors": calculate_gabor_descriptors(filepath),
-            "hu_moments": calculate_hu_moments(filepath),
-            "texture_energy": calculate_texture_energy(filepath),
-            "circularity": calculate_circularity(filepath)
-        }
-        print(f"Computed descriptors: {query_descriptors}")
+        # Read the upload into memory: extraction decodes these bytes directly (cv2.imdecode)
+        upload_start = time.perf_counter()
+        with stage('upload'):
+            data = file.read()
+        upload_seconds = time.perf_counter() - upload_start
+
+        # The copy in the backend/processed folder (for display) is written in the background
+        file_path = None
+        if SAVE_UPLOADS:
+            saved_name, _ = upload_store.save(file.filename, data)
+            file_path = f"processed/{saved_name}"
+
+        # Async mode: hand extraction and ranking to the job queue and return a job id right away
+        if request.args.get('async', ASYNC_UPLOADS, type=int):
+            try:
+                job = submit_upload_job(data, file_path, upload_seconds)
+            except QueueFull as e:
+                print(f"Upload rejected, job queue full: {e}")
+                return jsonify({'message': 'Server busy, try again later'}), 503, {'Retry-After': '5'}
+            return jsonify({
+                'message': 'Image uploaded, processing',
+                'filePath': file_path,
+                'job_id': job.id,
+                'status_url': f"/jobs/{job.id}",
+                'events_url': f"/jobs/{job.id}/events"
+            }), 202
+
+        # Compute descriptors for the uploaded image (or reuse them if the same image was uploaded before)
+        try:
+            query_hash, query_descriptors = get_query_descriptors(data)
+        except ValueError as e:
+            # Not a decodable image: rejected with the same message as in a batch
+            return jsonify({'message': str(e)}), 400
+        logging.debug("Computed descriptors: %s", query_descriptors)
 
-        # Check if descriptors are empty
-        if not any(query_descriptors.values()):
-            return jsonify({'message': 'Error: Descriptors are empty'}), 400
-        
+        error = query_descriptors_error(query_descriptors)
+        if error:
+            return jsonify({'message': error}), 400
+
+        # Keep this query's state for the feedback rounds that follow
+        query_id = query_store.create(query_descriptors, query_hash=query_hash)
 
         # Find similar images based on the descriptors
-        similar_images = find_similar_images(query_descriptors)
+        similar_images = find_similar_images(query_descriptors, query_hash=query_hash, query_id=query_id)
+        query_store.update(query_id, results=similar_images)
 
-        return jsonify({
-            'message': 'Image uploaded successfully',
-            'filePath': f"processed/{file.filename}",
-            'similar_images': similar_images
-        })
+        with stage('serialize'):
+            return jsonify({
+                'message': 'Image uploaded successfully',
+                'filePath': file_path,
+                'query_id': query_id,
+                'similar_images': similar_images
+            })
     except Exception as e:
         print(f"Error saving image: {e}")
         return jsonify({'message': 'Error saving image'}), 500
+
+# Async uploads: extraction runs in the process pool, ranking in the job queue's finishing threads
+ASYNC_UPLOADS = int(os.environ.get('ASYNC_UPLOADS', 0))
+job_queue = JobQueue(lambda: get_extraction_pool(), max_pending=int(os.environ.get('JOB_QUEUE_MAX_PENDING', 32)))
+
+def submit_upload_job(data, file_path, upload_seconds=0.0):
+    query_hash = content_hash(data)
+    cached = descriptor_cache.get(query_hash)
+
+    def finish(query_descriptors, job):
+        error = query_descriptors_error(query_descriptors)
+        if error:
+            raise ValueError(error)
+        descriptor_cache.set(query_hash, query_descriptors)
+        query_id = query_store.create(query_descriptors, query_hash=query_hash)
+        with job.stage('rank'):
+            similar_images = find_similar_images(query_descriptors, query_hash=query_hash, query_id=query_id)
+        query_store.update(query_id, results=similar_images)
+        return {
+            'message': 'Image uploaded successfully',
+            'filePath': file_path,
+            'query_id': query_id,
+            'similar_images': similar_images
+        }
+
+    if cached is not None:
+        job = job_queue.submit('extract', None, cached, finish)
+    else:
+        job = job_queue.submit('extract', extract_descriptors, (data,), finish)
+    job.timings['upload'] = round(upload_seconds, 4)
+    return job
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'message': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'message': 'Unknown job'}), 404
+    return Response(job.events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+# Batch search: many query images per request
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+BATCH_MAX_FILES = 1000
+BATCH_MAX_FILE_SIZE = 50 * 1024 * 1024
+# Uncompressed bytes of all images in a batch together (archives included)
+BATCH_MAX_TOTAL_SIZE = int(float(os.environ.get('BATCH_MAX_TOTAL_MB', 512)) * 1024 * 1024)
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+def get_extraction_pool():
+    """
+    Process pool for descriptor extraction, created on first use (spawned, so it is safe under threaded servers).
+    One process per core, each limited to one OpenCV/BLAS/OpenMP thread like the ingestion workers.
+    """
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            from ingest import _init_worker
+            mp_context = multiprocessing.get_context('spawn')
+            _extraction_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=mp_context,
+                                                   **job_queue.pool_options(mp_context, initializer=_init_worker))
+    return _extraction_pool
+
+def read_limited(stream, name, remaining):
+    """
+    Read one image, counting the bytes actually read: a zip member's declared size can lie,
+    so reading stops one byte past the per-file limit or the batch's remaining budget.
+    """
+    limit = min(BATCH_MAX_FILE_SIZE, remaining)
+    data = stream.read(limit + 1)
+    if len(data) > BATCH_MAX_FILE_SIZE:
+        raise ValueError(f"{name} is larger than {BATCH_MAX_FILE_SIZE} bytes")
+    if len(data) > limit:
+        raise ValueError(f"Batch is larger than {BATCH_MAX_TOTAL_SIZE} bytes uncompressed")
+    return data
+
+def read_batch_files(files):
+    """(filename, bytes) for every uploaded image, expanding .zip archives, within the batch size limits."""
+    images = []
+    total = 0
+    for file in files:
+        if file.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as archive:
+                members = [member for member in archive.infolist()
+                           if not member.is_dir() and member.filename.lower().endswith(IMAGE_EXTENSIONS)]
+                if len(images) + len(members) > BATCH_MAX_FILES:
+                    raise ValueError(f"At most {BATCH_MAX_FILES} images per batch")
+                # Declared sizes reject an oversized archive before anything is decompressed
+                if total + sum(member.file_size for member in members) > BATCH_MAX_TOTAL_SIZE:
+                    raise ValueError(f"Batch is larger than {BATCH_MAX_TOTAL_SIZE} bytes uncompressed")
+                for member in members:
+                    with archive.open(member) as stream:
+                        data = read_limited(stream, member.filename, BATCH_MAX_TOTAL_SIZE - total)
+                    total += len(data)
+                    images.append((member.filename, data))
+        elif file.filename:
+            data = read_limited(file.stream, file.filename, BATCH_MAX_TOTAL_SIZE - total)
+            total += len(data)
+            images.append((file.filename, data))
+        if len(images) > BATCH_MAX_FILES:
+            raise ValueError(f"At most {BATCH_MAX_FILES} images per batch")
+    return images
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    """
+    Score many query images in one request. Accepts several 'files' (images and/or .zip archives)
+    and streams one NDJSON line per query as soon as its results are ready.
+    """
+    try:
+        images = read_batch_files(request.files.getlist('files'))
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'message': str(e)}), 400
+    if not images:
+        return jsonify({'message': 'No images in the request'}), 400
+    top_k = request.args.get('top_k', 10, type=int)
+
+    # One weights snapshot and one index generation for the whole batch
+    weights = feedback_manager.weights_store.snapshot().weights
+    batch_searcher = active_searcher()
+    if USE_INDEX and batch_searcher is not stream_fallback:
+        descriptor_index.refresh_if_stale()
+
+    def score(ready):
+        searchable = []
+        for name, descriptors in ready:
+            error = query_descriptors_error(descriptors)
+            if error:
+                yield json.dumps({'filename': name, 'error': error}) + "\n"
+            else:
+                searchable.append((name, descriptors))
+        if not searchable:
+            return
+        results = batch_searcher.search_many([descriptors for _, descriptors in searchable], weights, top_k)
+        for (name, _), similar_images in zip(searchable, results):
+            yield json.dumps({'filename': name, 'similar_images': resolve_image_paths(similar_images)}) + "\n"
+
+    def generate():
+        cached, pending = [], {}
+        for name, data in images:
+            query_hash = content_hash(data)
+            descriptors = descriptor_cache.get(query_hash)
+            if descriptors is not None:
+                cached.append((name, descriptors))
+            else:
+                pending[get_extraction_pool().submit(extract_descriptors, data)] = (name, query_hash)
+        if cached:
+            yield from score(cached)
+
+        # Every extraction that has finished by the time we look is scored together
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            ready = []
+            for future in done:
+                name, query_hash = pending.pop(future)
+                try:
+                    descriptors = future.result()
+                except Exception as e:
+                    yield json.dumps({'filename': name, 'error': str(e)}) + "\n"
+                    continue
+                descriptor_cache.set(query_hash, descriptors)
+                ready.append((name, descriptors))
+            if ready:
+                yield from score(ready)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Prometheus metrics: stage/request histograms plus cache, index, query store and job queue state
+metrics.registry.register_callback('imagematch_index_images', "Images in the descriptor index", lambda: len(descriptor_index))
+metrics.registry.register_callback('imagematch_index_version', "Descriptor index generation", lambda: descriptor_index.version)
+metrics.registry.register_callback('imagematch_cache_hits_total', "Cache hits", metric_type='counter', label_name='cache',
+                                   func=lambda: {'descriptor': descriptor_cache.hits, 'result': result_cache.hits})
+metrics.registry.register_callback('imagematch_cache_misses_total', "Cache misses", metric_type='counter', label_name='cache',
+                                   func=lambda: {'descriptor': descriptor_cache.misses, 'result': result_cache.misses})
+metrics.registry.register_callback('imagematch_query_store_size', "Queries held in memory", lambda: len(query_store))
+metrics.registry.register_callback('imagematch_jobs_pending', "Queued or running upload jobs",
+                                   lambda: job_queue.stats()['pending'])
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render_latest(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the process answers requests, whatever the state of MongoDB or the index
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: 503 until this worker searches the descriptor index rather than scanning the collection
+    ready = index_ready.is_set() or not USE_INDEX
+    return jsonify({
+        "status": "ready" if ready else "loading",
+        "pid": os.getpid(),
+        "search_backend": SEARCH_BACKEND,
+        "index_size": len(descriptor_index) if descriptor_index is not None else 0,
+        "index_version": descriptor_index.version if descriptor_index is not None else 0,
+        "store_version": descriptor_index.store_version if descriptor_index is not None else None,
+        "warm_up_seconds": warm_up_seconds,
+    }), 200 if ready else 503
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "descriptor_cache": descriptor_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "query_store": query_store.stats(),
+        "uploads": upload_store.stats(),
+        "artifacts": {name: cache.stats() for name, cache in (('values', derived_values), ('gabor', gabor_cache),
+                                                               ('hu_moments', humoments_cache),
+                                                               ('thumbnails', thumbnail_cache))}
+    })
 @app.route('/backend/processed/<filename>')
 def serve_uploaded_image(filename):
+    upload_store.wait(filename)
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+def resolve_feedback_query(feedback_data):
+    """(query_id, stored query or None, descriptors) for a feedback request; descriptors is None if there are none."""
+    # Prefer the stored state of the query this feedback is about
+    query_id = feedback_data.get('query_id')
+    query = query_store.get(query_id) if query_id else None
+    if query is not None:
+        logging.debug("Using stored descriptors of query %s", query_id)
+        return query_id, query, query['descriptors']
+    if feedback_data.get('query_descriptors') and len(feedback_data['query_descriptors']) > 0:
+        logging.debug("Using query_descriptors from feedback data")
+        return query_id, None, feedback_data['query_descriptors']
+    return query_id, None, None
+
+def unknown_query_response(query_id):
+    logging.error(f"Unknown or expired query: {query_id}")
+    return jsonify({
+        "status": "error",
+        "message": "Unknown or expired query, upload the image again"
+    }), 404 if query_id else 400
+
+def enrich_feedback_items(feedback_items):
+    # Enrich feedback items with descriptors: read from the index, one batched query for the rest
+    keys = [(item.get('category'), item.get('image_name')) for item in feedback_items]
+    found = descriptor_index.lookup(keys)
+    for item, key in zip(feedback_items, keys):
+        if key in found:
+            item['descriptors'] = found[key]
+            logging.debug("Enriched item with descriptors: %s", item['image_name'])
+        else:
+            logging.warning(f"No matching document found for item: {item}")
+    return feedback_items
+
+def rank_feedback_query(query_id, query, query_descriptors, weights, top_k=10):
+    # Stored queries are re-weighted from their distance matrix; client-sent descriptors need a full search
+    if query is not None and USE_INDEX:
+        matches = rank_stored_query(query_id, weights, top_k)
+        if matches is not None:
+            return resolve_image_paths(matches)
+    return find_similar_images(query_descriptors=query_descriptors, top_k=top_k, weights=weights)
+
 @app.route('/submit_feedback', methods=['POST'])
 def submit_feedback():
     # Parse incoming feedback data
     feedback_data = request.json
-    logging.debug(f"Received feedback data: {feedback_data}")
+    logging.debug("Received feedback data: %s", feedback_data)
     
-    # Check if query_descriptors are already available in the feedback data
-    if feedback_data.get('query_descriptors') and len(feedback_data['query_descriptors']) > 0:
-        query_descriptors = feedback_data['query_descriptors']
-        logging.debug("Using query_descriptors from feedback data")
-    else:
-        # If no query_descriptors, attempt to find the original uploaded image
-        uploaded_files = os.listdir(app.config['UPLOAD_FOLDER'])
-        image_files = [f for f in uploaded_files if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp'))]
-        
-        if not image_files:
-            logging.error("No uploaded image found in the processed folder")
-            return jsonify({
-                "status": "error", 
-                "message": "No original image found"
-            }), 400
-        
-        # Use the most recently added image file
-        latest_image = max([os.path.join(app.config['UPLOAD_FOLDER'], f) for f in image_files], key=os.path.getctime)
-        
-        try:
-            # Recalculate descriptors
-            query_descriptors = {
-                "histogram": calculate_color_histogram(latest_image),
-                "dominant_colors": find_dominant_colors(latest_image),
-                "gabor_descriptors": calculate_gabor_descriptors(latest_image),
-                "hu_moments": calculate_hu_moments(latest_image),
-                "texture_energy": calculate_texture_energy(latest_image),
-                "circularity": calculate_circularity(latest_image)
-            }
-            logging.debug(f"Recalculated query_descriptors: {query_descriptors}")
-        except Exception as e:
-            logging.error(f"Error calculating descriptors: {e}")
-            return jsonify({
-                "status": "error", 
-                "message": f"Error processing image: {str(e)}"
-            }), 500
-
-    # Rest of the existing submit_feedback logic remains the same
-    # Enrich feedback items with descriptors from the database
-    for item in feedback_data.get('feedback_items', []):
-        logging.debug(f"Processing feedback item: {item}")
-        
-        # Find the matching document in the database
-        doc = descriptors_collection.find_one({
-            'image_name': item.get('image_name'),
-            'category': item.get('category')
-        })
-        
-        if doc:
-            # Populate descriptors from the database document
-            item['descriptors'] = {
-                "histogram": doc.get('histogram', []),
-                "dominant_colors": doc.get('dominant_colors', []),
-                "gabor_descriptors": doc.get('gabor_descriptors', []),
-                "hu_moments": doc.get('hu_moments', []),
-                "texture_energy": doc.get('texture_energy', []),
-                "circularity": doc.get('circularity', [])
-            }
-            logging.debug(f"Enriched item with descriptors: {item['descriptors']}")
-        else:
-            logging.warning(f"No matching document found for item: {item}")
+    query_id, query, query_descriptors = resolve_feedback_query(feedback_data)
+    if query_descriptors is None:
+        return unknown_query_response(query_id)
+
+    feedback_items = enrich_feedback_items(feedback_data.get('feedback_items', []))
     
     # Process feedback and get updated weights
     try:
         logging.debug("Updating weights based on feedback...")
         new_weights = feedback_manager.update_weights(
             query_descriptors=query_descriptors,
-            feedback_data=feedback_data.get('feedback_items', [])
+            feedback_data=feedback_items,
+            query_id=query_id
         )
-        logging.debug(f"Updated weights: {new_weights}")
+        logging.debug("Updated weights: %s", new_weights)
         
-        # Find similar images with the new weights
+        # Re-rank with the new weights
         logging.debug("Finding similar images based on updated weights...")
-        matches = find_similar_images(
-            query_descriptors=query_descriptors,
-            weights=new_weights
-        )
-        logging.debug(f"Found similar images: {matches}")
+        matches = rank_feedback_query(query_id, query, query_descriptors, new_weights)
+        logging.debug("Found similar images: %s", matches)
+        if query is not None:
+            query_store.update(query_id, results=matches)
         
-        # Persist the new weights
+        # The round is already in the feedback log; fold the log into its snapshot when it is due
         feedback_manager.save_feedback_history()
         logging.debug("Feedback history saved.")
         
-        return jsonify({
-            "status": "success", 
-            "new_weights": new_weights,
-            "similar_images": matches
-        })
+        with stage('serialize'):
+            return jsonify({
+                "status": "success", 
+                "new_weights": new_weights,
+                "query_id": query_id if query is not None else None,
+                "similar_images": matches
+            })
     
     except Exception as e:
         logging.error(f"Error processing feedback: {e}")
@@ -353,6 +832,77 @@ def submit_feedback():
             "message": str(e)
         }), 500
 
+@app.route('/feedback/preview', methods=['POST'])
+def preview_feedback():
+    """
+    Ranking of a query under candidate weights, without saving them. The body takes either
+    'weights' (features not given keep their current weight) or 'feedback_items', which
+    are turned into the weights submit_feedback would apply.
+    """
+    feedback_data = request.json or {}
+    query_id, query, query_descriptors = resolve_feedback_query(feedback_data)
+    if query_descriptors is None:
+        return unknown_query_response(query_id)
+
+    try:
+        if feedback_data.get('weights'):
+            unknown = set(feedback_data['weights']) - set(FEATURES)
+            if unknown:
+                return jsonify({"status": "error", "message": f"Unknown features: {sorted(unknown)}"}), 400
+            weights = feedback_manager.current_weights
+            weights.update({feature: float(value) for feature, value in feedback_data['weights'].items()})
+        else:
+            feedback_items = enrich_feedback_items(feedback_data.get('feedback_items', []))
+            weights = feedback_manager.propose_weights(query_descriptors, feedback_items)
+
+        matches = rank_feedback_query(query_id, query, query_descriptors, weights,
+                                      top_k=int(feedback_data.get('top_k', 10)))
+        with stage('serialize'):
+            return jsonify({
+                "status": "success",
+                "weights": weights,
+                "query_id": query_id if query is not None else None,
+                "similar_images": matches
+            })
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+# Derived artifacts of the visualization endpoints, content-addressed by (source hash, operation, parameters):
+# repeated calls on the same image reuse the file/value instead of recomputing it. Each directory is size-bounded
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get('ARTIFACT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# Artifact URLs contain their key, so a response never changes and browsers may keep it for a year
+ARTIFACT_MAX_AGE = 365 * 24 * 3600
+derived_values = ArtifactCache(os.path.join(os.getcwd(), "derived_values"), max_bytes=ARTIFACT_CACHE_MAX_BYTES)
+
+def artifact_response(payload, key):
+    # POST responses are not cached by browsers; the ETag lets the frontend tell unchanged results apart
+    response = jsonify(payload)
+    response.set_etag(key)
+    return response
+
+def serve_artifact(folder, filename):
+    # Cache files are named prefix + key + extension; the key doubles as a strong ETag
+    key = os.path.splitext(filename)[0].rsplit('_', 1)[-1]
+    if not is_artifact_key(key):
+        # Not content-addressed (e.g. written before the cache): its content may change, so always revalidate
+        response = send_from_directory(folder, filename, max_age=0)
+        response.cache_control.no_cache = True
+        return response
+    response = send_from_directory(folder, filename, etag=key, max_age=ARTIFACT_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def rgb_histogram(image_path):
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError("Failed to load image")
+    return {
+        'red': cv2.calcHist([image], [2], None, [256], [0, 256]).flatten().tolist(),
+        'green': cv2.calcHist([image], [1], None, [256], [0, 256]).flatten().tolist(),
+        'blue': cv2.calcHist([image], [0], None, [256], [0, 256]).flatten().tolist(),
+    }
 
 # function for histogramm display
 @app.route('/calculate-histogram', methods=['POST'])
@@ -360,40 +910,50 @@ def calculate_histogram():
     try:
         data = request.get_json()
         image_filename = data.get('image')
-        print(image_filename)
         if not image_filename:
             return jsonify({"error": "Image filename not provided"}), 400
         
         # Load the image
         image_path = os.path.join(image_filename)
+        wait_for_upload(image_path)
         if not os.path.exists(image_path):
             return jsonify({"error": "Image not found"}), 404
-        
-        print(image_path)
 
-        image = cv2.imread(image_path)
-        if image is None:
-            return jsonify({"error": "Failed to load image"}), 500
-
-        # Calculate histograms for R, G, B channels
-        histogram = {
-            'red': cv2.calcHist([image], [2], None, [256], [0, 256]).flatten().tolist(),
-            'green': cv2.calcHist([image], [1], None, [256], [0, 256]).flatten().tolist(),
-            'blue': cv2.calcHist([image], [0], None, [256], [0, 256]).flatten().tolist(),
-        }
+        # Calculate histograms for R, G, B channels (once per image content)
+        key = artifact_key(source_hash(image_path), 'histogram', {'bins': 256})
+        histogram = derived_values.get_or_create_json(key, lambda: rgb_histogram(image_path))
 
         # Construct the image URL
         image_url = f"http://localhost:5001/{image_filename}"
 
-        return jsonify({
+        return artifact_response({
             "histogram": histogram,
             "image_url": image_url
-        })
+        }, key)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def kmeans_dominant_colors(image_path, n_clusters=5, size=150):
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError("Failed to load image")
+
+    # Resize the image to speed up processing
+    resized_image = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+
+    # Reshape the image to a 2D array of pixels
+    pixels = resized_image.reshape(-1, 3)
+
+    # Apply K-means clustering to find dominant colors
+    from sklearn.cluster import KMeans
+    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+    kmeans.fit(pixels)
+
+    # Get the cluster centers (dominant colors)
+    return kmeans.cluster_centers_.astype(int).tolist()
+
 @app.route('/calculate-dominant-colors', methods=['POST'])
 def calculate_dominant_colors():
     try:
@@ -405,28 +965,14 @@ def calculate_dominant_colors():
 
         # Use the provided image path directly without appending IMAGE_DIR
         image_path = os.path.join(image_filename)
+        wait_for_upload(image_path)
         if not os.path.exists(image_path):
             return jsonify({"error": f"Image not found at path: {image_path}"}), 404
 
-        # Load the image
-        image = cv2.imread(image_path)
-        if image is None:
-            return jsonify({"error": "Failed to load image"}), 500
+        key = artifact_key(source_hash(image_path), 'dominant_colors', {'k': 5, 'size': 150, 'random_state': 42})
+        dominant_colors = derived_values.get_or_create_json(key, lambda: kmeans_dominant_colors(image_path))
 
-        # Resize the image to speed up processing (optional)
-        resized_image = cv2.resize(image, (150, 150), interpolation=cv2.INTER_AREA)
-
-        # Reshape the image to a 2D array of pixels
-        pixels = resized_image.reshape(-1, 3)
-
-        # Apply K-means clustering to find dominant colors
-        kmeans = KMeans(n_clusters=5, random_state=42)
-        kmeans.fit(pixels)
-
-        # Get the cluster centers (dominant colors)
-        dominant_colors = kmeans.cluster_centers_.astype(int).tolist()
-
-        return jsonify({"dominant_colors": dominant_colors})
+        return artifact_response({"dominant_colors": dominant_colors}, key)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -434,7 +980,21 @@ def calculate_dominant_colors():
 
 # Directory to save processed images
 GABOR_OUTPUT_FOLDER = os.path.join(os.getcwd(), "gabor_processed")
-os.makedirs(GABOR_OUTPUT_FOLDER, exist_ok=True)
+gabor_cache = ArtifactCache(GABOR_OUTPUT_FOLDER, max_bytes=ARTIFACT_CACHE_MAX_BYTES, prefix='gabor_')
+GABOR_VISUALIZATION = {'ksize': 21, 'sigma': 8.0, 'theta': np.pi / 4, 'lambd': 10.0, 'gamma': 0.5}
+
+def write_gabor_image(image_path, destination):
+    # Load the image in grayscale
+    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Failed to load image")
+
+    # Apply Gabor filter
+    p = GABOR_VISUALIZATION
+    kernel = cv2.getGaborKernel((p['ksize'], p['ksize']), p['sigma'], p['theta'], p['lambd'], p['gamma'], 0,
+                                ktype=cv2.CV_32F)
+    gabor_filtered = cv2.filter2D(image, cv2.CV_8UC3, kernel)
+    cv2.imwrite(destination, gabor_filtered)
 
 @app.route('/calculate-gabor', methods=['POST'])
 def calculate_gabor():
@@ -447,24 +1007,18 @@ def calculate_gabor():
 
         # Use the provided image path directly
         image_path = os.path.join(image_filename)
+        wait_for_upload(image_path)
         if not os.path.exists(image_path):
             return jsonify({"error": f"Image not found at path: {image_path}"}), 404
 
-        # Load the image in grayscale
-        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-        if image is None:
-            return jsonify({"error": "Failed to load image"}), 500
-
-        # Apply Gabor filter
-        kernel = cv2.getGaborKernel((21, 21), 8.0, np.pi / 4, 10.0, 0.5, 0, ktype=cv2.CV_32F)
-        gabor_filtered = cv2.filter2D(image, cv2.CV_8UC3, kernel)
-
-        # Save the Gabor-filtered image
-        gabor_filename = os.path.join(GABOR_OUTPUT_FOLDER, f"gabor_{os.path.basename(image_filename)}")
-        cv2.imwrite(gabor_filename, gabor_filtered)
+        # Filter and save the image only if this content was not filtered before
+        key = artifact_key(source_hash(image_path), 'gabor', GABOR_VISUALIZATION)
+        extension = os.path.splitext(image_filename)[1].lower() or '.png'
+        gabor_filename = gabor_cache.get_or_create(key, extension,
+                                                   lambda destination: write_gabor_image(image_path, destination))
 
         # Return the URL of the filtered image
-        gabor_image_url = f"http://localhost:5001/gabor/{os.path.basename(gabor_filename)}"
+        gabor_image_url = f"http://localhost:5001/gabor/{gabor_filename}"
         return jsonify({"gabor_image_url": gabor_image_url})
 
     except Exception as e:
@@ -475,19 +1029,21 @@ def calculate_gabor():
 @app.route('/gabor/<path:filename>', methods=['GET'])
 def serve_gabor_image(filename):
     try:
-        return send_from_directory(GABOR_OUTPUT_FOLDER, filename)
+        return serve_artifact(GABOR_OUTPUT_FOLDER, filename)
     except Exception as e:
         return jsonify({"error": str(e)}), 404
 
 
 # Directory to save processed images
 HUMOMENTS_OUTPUT_FOLDER = os.path.join(os.getcwd(), "humoments_processed")
-os.makedirs(HUMOMENTS_OUTPUT_FOLDER, exist_ok=True)
+humoments_cache = ArtifactCache(HUMOMENTS_OUTPUT_FOLDER, max_bytes=ARTIFACT_CACHE_MAX_BYTES, prefix='hu_moments_')
 
 def calculate_hu_momentss(image_path):
     """Calculate Hu Moments for an image and return an image with visualized moments."""
     # Load the image
     img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError("Failed to load image")
 
     # Apply binary thresholding to the image (for better moment calculation)
     _, binary_img = cv2.threshold(img, 127, 255, cv2.THRESH_BINARY)
@@ -513,20 +1069,28 @@ def calculate_hu():
 
         # Use the provided image path directly
         image_path = os.path.join(image_filename)
+        wait_for_upload(image_path)
         if not os.path.exists(image_path):
             return jsonify({"error": f"Image not found at path: {image_path}"}), 404
 
-        # Compute Hu Moments and the image with moments visualized
-        huMoments, img_with_moments = calculate_hu_momentss(image_path)
+        # The moments and their visualization share one key; a miss on either computes both at most once
+        key = artifact_key(source_hash(image_path), 'hu_moments', {'threshold': 127})
+        computed = {}
+
+        def compute():
+            if not computed:
+                computed['hu_moments'], computed['image'] = calculate_hu_momentss(image_path)
+            return computed
 
-        # Save the visualized image for display
-        humoments_image_filename = os.path.join(HUMOMENTS_OUTPUT_FOLDER, f"hu_moments_{os.path.basename(image_filename)}")
-        cv2.imwrite(humoments_image_filename, img_with_moments)
+        hu_moments = derived_values.get_or_create_json(key, lambda: compute()['hu_moments'].tolist())
+        extension = os.path.splitext(image_filename)[1].lower() or '.png'
+        humoments_image_filename = humoments_cache.get_or_create(
+            key, extension, lambda destination: cv2.imwrite(destination, compute()['image']))
 
         # Return the Hu Moments and the image URL
-        humoments_image_url = f"http://localhost:5001/humoments/{os.path.basename(humoments_image_filename)}"
+        humoments_image_url = f"http://localhost:5001/humoments/{humoments_image_filename}"
         return jsonify({
-            "hu_moments": huMoments.tolist(),
+            "hu_moments": hu_moments,
             "humoments_image_url": humoments_image_url
         })
 
@@ -537,9 +1101,28 @@ def calculate_hu():
 @app.route('/humoments/<path:filename>', methods=['GET'])
 def serve_hu_moments_image(filename):
     try:
-        return send_from_directory(HUMOMENTS_OUTPUT_FOLDER, filename)
+        return serve_artifact(HUMOMENTS_OUTPUT_FOLDER, filename)
     except Exception as e:
         return jsonify({"error": str(e)}), 404
+
+
+# Downscaled dataset images for the results grid; pre-generate with `python artifact_cache.py thumbnails`
+thumbnail_cache = ArtifactCache(THUMBNAIL_FOLDER, max_bytes=int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 1024 * 1024 * 1024)))
+
+@app.route('/thumbnails/<path:image_path>', methods=['GET'])
+def serve_thumbnail(image_path):
+    size = request.args.get('size', 256, type=int)
+    if size not in THUMBNAIL_SIZES:
+        return jsonify({"error": f"size must be one of {list(THUMBNAIL_SIZES)}"}), 400
+    source_path = safe_join(DATASET_FOLDER, image_path)
+    if source_path is None or not os.path.isfile(source_path):
+        return jsonify({"error": "Image not found"}), 404
+    try:
+        filename, key = thumbnail(thumbnail_cache, source_path, size)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 500
+    # The URL names the source image, not its content, so clients revalidate with the ETag once a day
+    return send_from_directory(THUMBNAIL_FOLDER, filename, etag=key, max_age=86400)
     
 
 # Endpoint to serve images
@@ -552,4 +1135,5 @@ def serve_image(filename):
 
 
 if __name__ == "__main__":
-    app.run(debug=True, port=5001)
+    # Development server; production runs pre-forked workers: `gunicorn -c gunicorn.conf.py` (see wsgi.py)
+    create_app().run(debug=True, port=5001)
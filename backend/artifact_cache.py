@@ -0,0 +1,214 @@
+"""
+Content-addressed cache of images and values derived from a source image.
+
+An artifact is identified by (source hash, operation, parameters): the same image filtered
+with the same parameters always maps to the same file, whatever its name or path, so a
+visualization endpoint computes it once and every later call (or browser, via the ETag) reuses
+it. Each cache directory has a byte budget and evicts the least recently used files.
+
+    python artifact_cache.py thumbnails --size 256
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+from query_cache import content_hash
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+THUMBNAIL_FOLDER = os.path.join(BASE_DIR, 'thumbnails')
+THUMBNAIL_SIZES = (128, 256, 512)
+DATASET_FOLDER = os.path.join(BASE_DIR, 'static', 'dataset')
+
+# Format of the keys returned by artifact_key()
+ARTIFACT_KEY_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+_source_hashes = {}
+_source_hashes_lock = threading.Lock()
+
+
+def source_hash(path):
+    """Content hash of a file, re-read only when its mtime or size changes."""
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _source_hashes_lock:
+        cached = _source_hashes.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = content_hash(f.read())
+    with _source_hashes_lock:
+        _source_hashes[path] = (stamp, digest)
+    return digest
+
+
+def artifact_key(source, operation, params=None):
+    """Stable key of (source hash, operation, parameters)."""
+    payload = json.dumps([source, operation, params or {}], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def is_artifact_key(key):
+    """True if key has the format of an artifact_key() (files written before the cache have other names)."""
+    return bool(ARTIFACT_KEY_PATTERN.fullmatch(key))
+
+
+class ArtifactCache:
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, prefix=''):
+        """
+        Directory of derived files named by artifact key, bounded in total size
+
+        :param directory: Where the files are written (created if missing)
+        :param max_bytes: Total size above which the least recently used files are deleted
+        :param prefix: Prepended to every file name, e.g. 'gabor_'
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        # Approximate total size, counted once and then kept up to date by this process
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, key, ext):
+        return f"{self.prefix}{key}{ext}"
+
+    def get_or_create(self, key, ext, build):
+        """
+        File name of the artifact, building it on a miss
+
+        :param ext: File extension including the dot, e.g. '.png'
+        :param build: Called with the destination path; must write the artifact there
+        :return: File name relative to the cache directory
+        """
+        filename = self.filename(key, ext)
+        path = os.path.join(self.directory, filename)
+        if self._touch(path):
+            self.hits += 1
+            return filename
+        self.misses += 1
+        self._write(path, ext, build)
+        return filename
+
+    def get_or_create_json(self, key, compute):
+        """Cached JSON-serializable value: compute() is called only on a miss."""
+        path = os.path.join(self.directory, self.filename(key, '.json'))
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            value = None
+        if value is not None and self._touch(path):
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = compute()
+
+        def write(staging):
+            with open(staging, 'w') as f:
+                json.dump(value, f)
+
+        self._write(path, '.json', write)
+        return value
+
+    def _touch(self, path):
+        # Bump the modification time used for LRU eviction (atime is often not updated by reads)
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _write(self, path, ext, build):
+        # Build under a temporary name, so concurrent readers never see a partial file
+        fd, staging = tempfile.mkstemp(prefix='.tmp-', suffix=ext, dir=self.directory)
+        os.close(fd)
+        try:
+            build(staging)
+            size = os.path.getsize(staging)
+            # mkstemp creates the file 0600 and build() keeps that mode; artifacts are served as static files
+            os.chmod(staging, 0o644)
+            os.replace(staging, path)
+        finally:
+            if os.path.exists(staging):
+                os.remove(staging)
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+        if self._size is None or self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used files until the directory fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            # Evict down to a low-water mark so a full cache does not rescan on every write
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+            self._size = total
+
+    def stats(self):
+        return {'directory': self.directory, 'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+def build_thumbnail(source_path, size, destination):
+    """JPEG whose longest side is at most size pixels (never upscaled)."""
+    import cv2
+
+    img = cv2.imread(source_path)
+    if img is None:
+        raise ValueError(f"Could not read {source_path}")
+    scale = size / max(img.shape[:2])
+    if scale < 1:
+        img = cv2.resize(img, (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale))),
+                         interpolation=cv2.INTER_AREA)
+    if not cv2.imwrite(destination, img, [cv2.IMWRITE_JPEG_QUALITY, 85]):
+        raise ValueError(f"Could not write {destination}")
+
+
+def thumbnail(cache, source_path, size):
+    """(file name, key) of the cached thumbnail of source_path."""
+    key = artifact_key(source_hash(source_path), 'thumbnail', {'size': size})
+    return cache.get_or_create(key, '.jpg', lambda destination: build_thumbnail(source_path, size, destination)), key
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate thumbnails of the dataset images")
+    parser.add_argument('command', choices=['thumbnails'])
+    parser.add_argument('--dataset', default=DATASET_FOLDER)
+    parser.add_argument('--size', type=int, default=256, choices=THUMBNAIL_SIZES)
+    parser.add_argument('--output', default=THUMBNAIL_FOLDER)
+    parser.add_argument('--max-bytes', type=int, default=1024 * 1024 * 1024)
+    args = parser.parse_args()
+
+    cache = ArtifactCache(args.output, max_bytes=args.max_bytes)
+    paths = sorted(glob.glob(os.path.join(args.dataset, '*', '*')))
+    failed = 0
+    for path in paths:
+        try:
+            thumbnail(cache, path, args.size)
+        except ValueError as e:
+            print(e)
+            failed += 1
+    print(f"{len(paths) - failed} thumbnails of {args.size}px in {args.output} ({cache.misses - failed} built)")
+
+
+if __name__ == "__main__":
+    main()
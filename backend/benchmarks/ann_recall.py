@@ -0,0 +1,74 @@
+"""
+Recall@k and latency of the ANN search against the exhaustive DescriptorIndex search.
+
+Runs on synthetic descriptors; each query is evaluated under the default weights and under a
+random re-weighting, since relevance feedback changes the weights between queries.
+
+    python benchmarks/ann_recall.py --images 100000 --queries 50 --n-probe 8 16 32
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from synthetic import StaticIndex, synthetic_index_data, synthetic_queries
+
+from ann_index import ANNIndex, recall_at_k
+from similarity import FEATURES
+from weights_store import DEFAULT_WEIGHTS
+
+
+def mean_latency_ms(search, queries, weights, top_k):
+    start = time.perf_counter()
+    for query in queries:
+        search(query, weights, top_k)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--backend', default='ivf')
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--candidate-factor', type=int, default=20)
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    data = synthetic_index_data(args.images)
+    queries = synthetic_queries(data, args.queries)
+    index = StaticIndex(data)
+    rng = np.random.default_rng(2)
+    reweighted = dict(zip(FEATURES, rng.dirichlet(np.ones(len(FEATURES)))))
+
+    results = {'images': args.images, 'queries': args.queries, 'top_k': args.top_k, 'runs': []}
+    exact_ms = mean_latency_ms(index.search, queries, DEFAULT_WEIGHTS, args.top_k)
+    print(f"exhaustive: {exact_ms:.2f} ms/query")
+    results['exhaustive_ms'] = round(exact_ms, 3)
+
+    for n_probe in args.n_probe:
+        ann = ANNIndex(index, backend=args.backend, path=None, candidate_factor=args.candidate_factor,
+                       **({'n_probe': n_probe} if args.backend == 'ivf' else {}))
+        start = time.perf_counter()
+        ann.ensure_current()
+        build_s = time.perf_counter() - start
+        run = {
+            'n_probe': n_probe,
+            'build_s': round(build_s, 2),
+            'ms_per_query': round(mean_latency_ms(ann.search, queries, DEFAULT_WEIGHTS, args.top_k), 3),
+            'recall_default_weights': recall_at_k(ann, queries, DEFAULT_WEIGHTS, args.top_k),
+            'recall_reweighted': recall_at_k(ann, queries, reweighted, args.top_k),
+        }
+        results['runs'].append(run)
+        print(f"{args.backend} n_probe={n_probe}: build {build_s:.1f}s, {run['ms_per_query']:.2f} ms/query, "
+              f"recall@{args.top_k} {run['recall_default_weights']:.3f} (reweighted {run['recall_reweighted']:.3f})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Agreement and latency of the cascade search against the exhaustive DescriptorIndex search.
+
+For each candidate factor, every query is run under the default weights and under a random
+re-weighting, and the top-k is compared with the exhaustive one: how often it differs at all
+(set or order), the mean recall@k, and how often the cascade could certify its result.
+
+    python benchmarks/cascade_agreement.py --images 100000 --queries 50 --candidate-factor 5 10 20
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from synthetic import StaticIndex, synthetic_index_data, synthetic_queries
+
+from cascade_search import CascadeSearch
+from similarity import FEATURES
+from weights_store import DEFAULT_WEIGHTS
+
+
+def keys(results):
+    return [(r['category'], r['image_name']) for r in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--candidate-factor', type=int, nargs='+', default=[2, 5, 10, 20])
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    data = synthetic_index_data(args.images)
+    queries = synthetic_queries(data, args.queries)
+    index = StaticIndex(data)
+    rng = np.random.default_rng(2)
+    reweighted = dict(zip(FEATURES, rng.dirichlet(np.ones(len(FEATURES)))))
+    cases = [(query, weights) for weights in (DEFAULT_WEIGHTS, reweighted) for query in queries]
+
+    start = time.perf_counter()
+    exhaustive = [index.search(query, weights, args.top_k) for query, weights in cases]
+    exact_ms = (time.perf_counter() - start) / len(cases) * 1000
+    print(f"exhaustive: {exact_ms:.2f} ms/query")
+    results = {'images': args.images, 'queries': len(cases), 'top_k': args.top_k,
+               'exhaustive_ms': round(exact_ms, 3), 'runs': []}
+
+    for factor in args.candidate_factor:
+        cascade = CascadeSearch(index, candidate_factor=factor, min_candidates=0)
+        cascade.terms(data)
+        start = time.perf_counter()
+        outcomes = [cascade.search_certified(query, weights, args.top_k) for query, weights in cases]
+        ms = (time.perf_counter() - start) / len(cases) * 1000
+        differs = [keys(found) != keys(expected) for (found, _), expected in zip(outcomes, exhaustive)]
+        recalls = [len(set(keys(found)) & set(keys(expected))) / max(len(expected), 1)
+                   for (found, _), expected in zip(outcomes, exhaustive)]
+        run = {
+            'candidate_factor': factor,
+            'ms_per_query': round(ms, 3),
+            'speedup': round(exact_ms / ms, 2),
+            'differs_rate': round(float(np.mean(differs)), 4),
+            'recall_at_k': round(float(np.mean(recalls)), 4),
+            'certified_rate': round(float(np.mean([certified for _, certified in outcomes])), 4),
+        }
+        print(f"candidate factor {factor:3d}: {ms:8.2f} ms/query (x{run['speedup']:.2f})  "
+              f"top-{args.top_k} differs {run['differs_rate']:.1%}  recall {run['recall_at_k']:.4f}  "
+              f"certified {run['certified_rate']:.1%}")
+        results['runs'].append(run)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
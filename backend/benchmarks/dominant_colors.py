@@ -0,0 +1,103 @@
+"""
+Compare the fast dominant color modes against exact full-resolution KMeans.
+
+Extracts dominant colors for a seeded sample of dataset images with every mode, ranks the
+sample against each image by dominant_color_distance, and reports per-image extraction time
+and how closely each mode's rankings follow the exact ones (top-k overlap, Spearman rho).
+
+    python benchmarks/dominant_colors.py --sample 200 --size 1600 --output dominant_colors.json
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+from scipy.stats import spearmanr
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from image_utils import DOMINANT_COLORS_MODES, dominant_colors  # noqa: E402
+from similarity import dominant_color_distance_batch  # noqa: E402
+
+
+def load_sample(dataset_dir, sample, size, seed):
+    paths = sorted(glob.glob(os.path.join(dataset_dir, '*', '*.jpg')))
+    paths = random.Random(seed).sample(paths, min(sample, len(paths)))
+    images = []
+    for path in paths:
+        img = cv2.imread(path)
+        if size:
+            # Upscale to mimic the large uploads that land in processed/
+            img = cv2.resize(img, (size, size * img.shape[0] // img.shape[1]), interpolation=cv2.INTER_CUBIC)
+        images.append(img)
+    return paths, images
+
+
+def distance_matrix(colors):
+    counts = np.array([len(c) for c in colors])
+    padded = np.zeros((len(colors), counts.max(), 3))
+    for row, c in enumerate(colors):
+        padded[row, :len(c)] = c
+    return np.stack([dominant_color_distance_batch(c, padded, counts) for c in colors])
+
+
+def compare_rankings(exact, approx, top_k):
+    overlaps, rhos = [], []
+    top_k = min(top_k, len(exact) - 1)
+    for row in range(len(exact)):
+        # Leave the query itself out of its own ranking
+        mask = np.arange(len(exact)) != row
+        e, a = exact[row][mask], approx[row][mask]
+        top_exact = set(np.argsort(e, kind='stable')[:top_k])
+        top_approx = set(np.argsort(a, kind='stable')[:top_k])
+        overlaps.append(len(top_exact & top_approx) / top_k)
+        rhos.append(spearmanr(e, a).statistic)
+    return float(np.mean(overlaps)), float(np.nanmean(rhos))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default=os.path.join(BACKEND_DIR, 'static', 'dataset'))
+    parser.add_argument('--sample', type=int, default=100, help="Number of dataset images")
+    parser.add_argument('--size', type=int, default=0, help="Resize images to this width first (0 keeps 400px)")
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--modes', nargs='+', default=list(DOMINANT_COLORS_MODES), choices=DOMINANT_COLORS_MODES)
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    paths, images = load_sample(args.dataset, args.sample, args.size, args.seed)
+    print(f"{len(images)} images, {images[0].shape[1]}x{images[0].shape[0]}")
+
+    colors, timings = {}, {}
+    for mode in ['exact'] + [m for m in args.modes if m != 'exact']:
+        start = time.perf_counter()
+        colors[mode] = [dominant_colors(img, mode=mode) for img in images]
+        timings[mode] = (time.perf_counter() - start) / len(images)
+
+    exact_distances = distance_matrix(colors['exact'])
+    results = {'images': len(images), 'size': args.size or None, 'top_k': args.top_k, 'modes': {}}
+    for mode in colors:
+        overlap, rho = compare_rankings(exact_distances, distance_matrix(colors[mode]), args.top_k)
+        results['modes'][mode] = {
+            'ms_per_image': round(timings[mode] * 1000, 2),
+            'speedup': round(timings['exact'] / timings[mode], 2),
+            f'top{args.top_k}_overlap': round(overlap, 4),
+            'spearman': round(rho, 4),
+        }
+        print(f"{mode:>9}: {timings[mode] * 1000:8.1f} ms/image  x{results['modes'][mode]['speedup']:<6} "
+              f"top-{args.top_k} overlap {overlap:.3f}  spearman {rho:.3f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
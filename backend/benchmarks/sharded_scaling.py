@@ -0,0 +1,89 @@
+"""
+Scaling of the sharded exhaustive search with the number of worker processes.
+
+Synthetic descriptors are exported to a temporary descriptor store and searched with
+ShardedSearch at each shard count (1 runs in-process). Every run is checked against the
+single-process DescriptorIndex search: same images in the same order, same scores.
+
+    python benchmarks/sharded_scaling.py --images 200000 --shards 1 2 4 8
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from synthetic import synthetic_index_data, synthetic_queries
+
+import descriptor_store
+from descriptor_index import DescriptorIndex
+from sharded_search import ShardedSearch
+from weights_store import DEFAULT_WEIGHTS
+
+
+def mean_latency_ms(search, queries, weights, top_k):
+    start = time.perf_counter()
+    for query in queries:
+        search(query, weights, top_k)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def same_results(expected, actual, tolerance=1e-9):
+    return all(
+        [(r['category'], r['image_name']) for r in e] == [(r['category'], r['image_name']) for r in a]
+        and np.allclose([r['similarity_score'] for r in e], [r['similarity_score'] for r in a], rtol=0, atol=tolerance)
+        for e, a in zip(expected, actual)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        data = synthetic_index_data(args.images)
+        version = descriptor_store.version_stamp(('synthetic', args.images))
+        descriptor_store.export_index_data(data, version, store_dir)
+        queries = synthetic_queries(data, args.queries)
+
+        index = DescriptorIndex(collection=None, store_dir=store_dir)
+        index.data = descriptor_store.load_index_data(version, store_dir)
+        index.store_version = version
+        expected = [index.search(query, DEFAULT_WEIGHTS, args.top_k) for query in queries]
+
+        results = {'images': args.images, 'queries': args.queries, 'top_k': args.top_k, 'runs': []}
+        baseline_ms = None
+        for shards in args.shards:
+            searcher = ShardedSearch(index, shards=shards, min_shard_rows=1)
+            try:
+                # Start the workers and open the export in each before timing
+                for _ in range(2):
+                    searcher.search_many(queries[:shards], DEFAULT_WEIGHTS, args.top_k)
+                actual = [searcher.search(query, DEFAULT_WEIGHTS, args.top_k) for query in queries]
+                ms = mean_latency_ms(searcher.search, queries, DEFAULT_WEIGHTS, args.top_k)
+            finally:
+                searcher.close()
+            baseline_ms = baseline_ms or ms
+            run = {
+                'shards': shards,
+                'ms_per_query': round(ms, 3),
+                'speedup': round(baseline_ms / ms, 2),
+                'matches_exhaustive': same_results(expected, actual),
+            }
+            print(f"{shards} shard(s): {ms:8.2f} ms/query  x{run['speedup']:.2f}  "
+                  f"matches exhaustive: {run['matches_exhaustive']}")
+            results['runs'].append(run)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
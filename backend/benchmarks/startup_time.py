@@ -0,0 +1,104 @@
+"""
+Cold-start time of the backend, checked against a budget.
+
+Each run is a fresh interpreter: `python -X importtime -c "import app"` gives the time to import
+app.py and a per-package breakdown of it, and a second interpreter times create_app(), which
+creates the MongoDB client and starts loading the descriptor index in the background (MongoDB
+does not have to be reachable). The median over --runs is compared with the budgets; the exit
+status is 1 when either is exceeded.
+
+    python benchmarks/startup_time.py
+    python benchmarks/startup_time.py --runs 10 --budget-ms 400 --create-budget-ms 600 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CREATE_APP_SCRIPT = (
+    "import time; start = time.perf_counter(); import app; app.create_app(); "
+    "print(round((time.perf_counter() - start) * 1000, 3))"
+)
+
+
+def parse_importtime(stderr, module='app'):
+    """
+    (cumulative microseconds of `import module`, {top-level package: self microseconds}) for the
+    imports made while importing module.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        entries.append((int(self_us), int(cumulative_us), len(name) - len(name.lstrip()), name.strip()))
+    for position, (self_us, cumulative_us, depth, name) in enumerate(entries):
+        if name == module:
+            break
+    else:
+        raise ValueError(f"{module} not found in the -X importtime output")
+
+    # Children are printed before their parent, with a deeper indentation
+    packages = defaultdict(int)
+    packages[module] += self_us
+    for child_self, _, child_depth, child_name in reversed(entries[:position]):
+        if child_depth <= depth:
+            break
+        packages[child_name.split('.')[0]] += child_self
+    return cumulative_us, dict(packages)
+
+
+def run_python(args):
+    result = subprocess.run([sys.executable, *args], cwd=BACKEND_DIR, capture_output=True, text=True,
+                            env={**os.environ, 'LOG_LEVEL': 'WARNING'})
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=400, help="Budget for importing app.py")
+    parser.add_argument('--create-budget-ms', type=float, default=600, help="Budget for import plus create_app()")
+    parser.add_argument('--top', type=int, default=10, help="Packages shown in the breakdown")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    import_ms, create_ms, breakdowns = [], [], []
+    for _ in range(args.runs):
+        cumulative_us, packages = parse_importtime(run_python(['-X', 'importtime', '-c', 'import app']).stderr)
+        import_ms.append(cumulative_us / 1000)
+        breakdowns.append(packages)
+        create_ms.append(float(run_python(['-c', CREATE_APP_SCRIPT]).stdout.strip().splitlines()[-1]))
+
+    median_import = statistics.median(import_ms)
+    median_create = statistics.median(create_ms)
+    packages = {name: statistics.median(b.get(name, 0) for b in breakdowns) / 1000
+                for name in set().union(*breakdowns)}
+    print(f"import app:          {median_import:8.1f} ms  (budget {args.budget_ms:.0f} ms)")
+    print(f"import + create_app: {median_create:8.1f} ms  (budget {args.create_budget_ms:.0f} ms)")
+    for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"    {name:<28} {ms:8.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'import_ms': round(median_import, 3), 'create_app_ms': round(median_create, 3),
+                       'packages_ms': {name: round(ms, 3) for name, ms in packages.items()},
+                       'budget_ms': args.budget_ms, 'create_budget_ms': args.create_budget_ms}, f, indent=4)
+
+    over = [label for label, value, budget in (('import', median_import, args.budget_ms),
+                                               ('create_app', median_create, args.create_budget_ms))
+            if value > budget]
+    if over:
+        print(f"Over budget: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Reproducible, offline performance suite for descriptor extraction and ranking.
+
+Sections (each runs in a fresh process, so peak RSS is measured per section):
+    extract      every image_utils extractor, and extract_descriptors end to end, at several image sizes
+    save_image   POST /save-image through Flask's test client, MongoDB replaced by mongomock
+    ranking      find_similar_images against 1k/10k/100k synthetic descriptors
+
+Images come from static/dataset (resized to each size) or, with --synthetic or when the dataset
+is missing, from generated textures. Every measurement reports p50/p95/mean latency, throughput
+and the section's peak RSS. Results are written as JSON; --compare flags every measurement
+whose p50 regressed by more than --threshold against an earlier run (exit status 1).
+
+    python benchmarks/suite.py --output bench.json
+    python benchmarks/suite.py --sections ranking --ranking-sizes 1000 10000 --compare bench.json
+"""
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from synthetic import BACKEND_DIR, synthetic_index_data, synthetic_queries
+
+SECTIONS = ('extract', 'save_image', 'ranking')
+EXTRACTORS = ('color_histogram', 'dominant_colors', 'gabor_statistics', 'gabor_descriptors',
+              'hu_moments', 'texture_energy', 'circularity', 'extract_descriptors')
+
+
+def load_images(size, count, synthetic, seed=0):
+    """count BGR images whose longest side is size, from the bundled dataset or generated."""
+    paths = sorted(glob.glob(os.path.join(BACKEND_DIR, 'static', 'dataset', '*', '*.jpg')))
+    if synthetic or not paths:
+        return [synthetic_image(size, seed + i) for i in range(count)]
+    images = []
+    for path in random.Random(seed).sample(paths, min(count, len(paths))):
+        img = cv2.imread(path)
+        scale = size / max(img.shape[:2])
+        images.append(cv2.resize(img, (round(img.shape[1] * scale), round(img.shape[0] * scale)),
+                                 interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC))
+    return images
+
+
+def synthetic_image(size, seed):
+    """Smooth coloured noise with a few shapes, so every extractor has structure to work on."""
+    rng = np.random.default_rng(seed)
+    img = cv2.resize(rng.integers(0, 256, (16, 16, 3), dtype=np.uint8), (size, size), interpolation=cv2.INTER_CUBIC)
+    img = cv2.add(img, rng.integers(0, 40, (size, size, 3), dtype=np.uint8))
+    for _ in range(5):
+        center = tuple(int(c) for c in rng.integers(0, size, 2))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(img, center, int(rng.integers(size // 20 + 1, size // 4 + 2)), color, -1)
+    return img
+
+
+def measure(func, inputs, repeat, warmup=1):
+    """Latencies in seconds of func(x), cycling through inputs for repeat calls after warmup calls."""
+    for i in range(warmup):
+        func(inputs[i % len(inputs)])
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(inputs[i % len(inputs)])
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings, items_per_call=1):
+    timings = np.asarray(timings)
+    return {
+        'n': len(timings),
+        'p50_ms': round(float(np.percentile(timings, 50)) * 1000, 3),
+        'p95_ms': round(float(np.percentile(timings, 95)) * 1000, 3),
+        'mean_ms': round(float(timings.mean()) * 1000, 3),
+        'throughput_per_s': round(items_per_call / float(timings.mean()), 2),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the app's per-request prints and debug logging while timing."""
+    import logging
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        logging.disable(logging.INFO)
+        try:
+            yield
+        finally:
+            logging.disable(logging.NOTSET)
+
+
+def bench_extract(args):
+    import image_utils
+
+    results = {}
+    for size in args.sizes:
+        images = load_images(size, args.images, args.synthetic)
+        grays = [cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) for img in images]
+        encoded = [cv2.imencode('.jpg', img)[1].tobytes() for img in images]
+        stats = [image_utils.gabor_statistics(gray) for gray in grays]
+        cases = {
+            'color_histogram': (image_utils.color_histogram, images),
+            'dominant_colors': (image_utils.dominant_colors, images),
+            'gabor_statistics': (image_utils.gabor_statistics, grays),
+            'gabor_descriptors': (lambda pair: image_utils.gabor_descriptors(*pair), list(zip(grays, stats))),
+            'hu_moments': (image_utils.hu_moments, grays),
+            'texture_energy': (lambda pair: image_utils.texture_energy(*pair), list(zip(grays, stats))),
+            'circularity': (image_utils.circularity, grays),
+            'extract_descriptors': (image_utils.extract_descriptors, encoded),
+        }
+        for name in EXTRACTORS:
+            func, inputs = cases[name]
+            results[f"extract/{name}/{size}"] = summarize(measure(func, inputs, args.repeat))
+    return results
+
+
+def descriptor_documents(n):
+    from descriptor_index import row_descriptors
+    data = synthetic_index_data(n)
+    return [dict(category=key[0], image_name=key[1], **row_descriptors(data, row)) for row, key in enumerate(data.keys)]
+
+
+def import_app_with_mongomock(workdir):
+    """Import app.py against an in-memory mongomock client, with every output directory under workdir."""
+    import mongomock
+    import pymongo
+    pymongo.MongoClient = mongomock.MongoClient
+    os.environ['DESCRIPTOR_STORE_DIR'] = os.path.join(workdir, 'descriptor_store')
+    os.environ['QUERY_SPILL_DIR'] = ''
+    os.chdir(workdir)
+    with quiet():
+        import app
+        app.create_app(background=False)
+    return app
+
+
+def bench_save_image(args):
+    import io
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = import_app_with_mongomock(workdir)
+        app.descriptors_collection.insert_many(descriptor_documents(args.save_image_collection))
+        client = app.app.test_client()
+        encoded = [cv2.imencode('.jpg', img)[1].tobytes()
+                   for img in load_images(args.save_image_size, args.images, args.synthetic)]
+
+        def post(data):
+            # Every call extracts and ranks: the descriptor and result caches would otherwise answer repeats
+            app.descriptor_cache.clear()
+            app.result_cache.clear()
+            response = client.post('/save-image', data={'file': (io.BytesIO(data), 'benchmark_upload.jpg')},
+                                   content_type='multipart/form-data')
+            if response.status_code != 200:
+                raise RuntimeError(f"/save-image returned {response.status_code}")
+
+        with quiet():
+            timings = measure(post, encoded, args.repeat)
+        key = f"save_image/{args.save_image_size}/{args.save_image_collection}"
+        return {key: summarize(timings)}
+
+
+def bench_ranking(args, n):
+    from synthetic import StaticIndex
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = import_app_with_mongomock(workdir)
+        data = synthetic_index_data(n)
+        # Serve the synthetic descriptors in place of the (empty) collection-backed index
+        app.descriptor_index = app.searcher = StaticIndex(data)
+        queries = synthetic_queries(data, min(args.repeat, 50))
+        with quiet():
+            timings = measure(lambda query: app.find_similar_images(query), queries, args.repeat)
+        return {f"find_similar_images/{n}": summarize(timings)}
+
+
+def run_section(section, args, *extra):
+    """Run one section in a fresh process and tag its results with that process's peak RSS."""
+    funcs = {'extract': bench_extract, 'save_image': bench_save_image, 'ranking': bench_ranking}
+    results = funcs[section](args, *extra)
+    rss = peak_rss_mb()
+    for result in results.values():
+        result['peak_rss_mb'] = rss
+    return results
+
+
+def run_isolated(section, args, *extra):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(run_section, section, args, *extra).result()
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+    }
+
+
+def compare(results, baseline, threshold):
+    """Measurements whose p50 is more than threshold (a fraction) slower than in baseline."""
+    regressions = []
+    for key, result in sorted(results.items()):
+        before = baseline.get(key)
+        if before is None or not before.get('p50_ms'):
+            continue
+        change = result['p50_ms'] / before['p50_ms'] - 1
+        flag = 'REGRESSION' if change > threshold else ''
+        print(f"{key:<45} {before['p50_ms']:>10.2f} -> {result['p50_ms']:>10.2f} ms  {change:+7.1%}  {flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sections', nargs='+', default=list(SECTIONS), choices=SECTIONS)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 512, 1024],
+                        help="Longest image side for the extract section")
+    parser.add_argument('--images', type=int, default=5, help="Distinct images per size")
+    parser.add_argument('--repeat', type=int, default=20, help="Timed calls per measurement")
+    parser.add_argument('--synthetic', action='store_true', help="Use generated images instead of static/dataset")
+    parser.add_argument('--save-image-size', type=int, default=1024)
+    parser.add_argument('--save-image-collection', type=int, default=1000, help="Descriptor documents in mongomock")
+    parser.add_argument('--ranking-sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--compare', help="Earlier JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.15, help="Relative p50 slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    results = {}
+    for section in args.sections:
+        runs = [(n,) for n in args.ranking_sizes] if section == 'ranking' else [()]
+        for extra in runs:
+            section_results = run_isolated(section, args, *extra)
+            for key, result in section_results.items():
+                print(f"{key:<45} p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+                      f"{result['throughput_per_s']:>9.2f}/s  peak RSS {result['peak_rss_mb']:.0f} MB")
+            results.update(section_results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': metadata(args), 'results': results}, f, indent=4)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
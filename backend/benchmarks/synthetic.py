@@ -0,0 +1,97 @@
+"""Synthetic descriptor sets for benchmarks that need more images than the bundled dataset."""
+import os
+import sys
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from descriptor_index import (  # noqa: E402
+    GABOR_SIZE, HISTOGRAM_BINS, HU_MOMENTS_SIZE, TEXTURE_ENERGY_SIZE, IndexData,
+)
+from similarity import HISTOGRAM_CHANNELS, histogram_terms  # noqa: E402
+
+MAX_DOMINANT_COLORS = 8
+
+
+def synthetic_index_data(n, seed=0, n_clusters=64):
+    """
+    IndexData with n images drawn around n_clusters prototypes, so that nearest-neighbour
+    structure resembles a real dataset (categories) rather than uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    cluster = rng.integers(0, n_clusters, n)
+
+    prototypes = rng.gamma(0.5, 1.0, (n_clusters, len(HISTOGRAM_CHANNELS), HISTOGRAM_BINS))
+    histograms = (prototypes[cluster] * rng.gamma(4.0, 0.25, (n, len(HISTOGRAM_CHANNELS), HISTOGRAM_BINS))).astype(np.float32)
+    # Same L2 normalisation as cv2.normalize in calculate_color_histogram
+    histograms /= np.linalg.norm(histograms, axis=2, keepdims=True)
+
+    counts = rng.integers(1, MAX_DOMINANT_COLORS + 1, n)
+    color_prototypes = rng.random((n_clusters, MAX_DOMINANT_COLORS, 3))
+    colors = np.clip(color_prototypes[cluster] + rng.normal(0, 0.05, (n, MAX_DOMINANT_COLORS, 3)), 0, 1)
+    colors[np.arange(MAX_DOMINANT_COLORS)[None, :] >= counts[:, None]] = 0
+
+    def vectors(size):
+        return np.clip(rng.random((n_clusters, size))[cluster] + rng.normal(0, 0.05, (n, size)), 0, 1)
+
+    histogram_sqrt, histogram_sums = histogram_terms(histograms)
+    return IndexData(
+        keys=[(f"c{c:03d}", f"{i:07d}.jpg") for i, c in enumerate(cluster)],
+        histograms=histograms,
+        histogram_sqrt=histogram_sqrt,
+        histogram_sums=histogram_sums,
+        dominant_colors=colors,
+        dominant_counts=counts,
+        gabor=vectors(GABOR_SIZE),
+        hu_moments=vectors(HU_MOMENTS_SIZE),
+        texture_energy=vectors(TEXTURE_ENERGY_SIZE),
+        circularity=vectors(1)[:, 0],
+    )
+
+
+def synthetic_queries(data, count, seed=1):
+    """Query descriptor dicts made by perturbing random rows of data."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for row in rng.integers(0, len(data.keys), count):
+        hist = np.abs(data.histograms[row] + rng.normal(0, 0.01, data.histograms[row].shape))
+        hist /= np.linalg.norm(hist, axis=1, keepdims=True)
+        colors = data.dominant_colors[row, :data.dominant_counts[row]]
+        queries.append({
+            "histogram": {color: hist[i].tolist() for i, color in enumerate(HISTOGRAM_CHANNELS)},
+            "dominant_colors": np.clip(colors + rng.normal(0, 0.02, colors.shape), 0, 1).tolist(),
+            "gabor_descriptors": np.clip(data.gabor[row] + rng.normal(0, 0.02, GABOR_SIZE), 0, 1).tolist(),
+            "hu_moments": np.clip(data.hu_moments[row] + rng.normal(0, 0.02, HU_MOMENTS_SIZE), 0, 1).tolist(),
+            "texture_energy": np.clip(data.texture_energy[row] + rng.normal(0, 0.02, TEXTURE_ENERGY_SIZE), 0, 1).tolist(),
+            "circularity": float(np.clip(data.circularity[row] + rng.normal(0, 0.02), 0, 1)),
+        })
+    return queries
+
+
+class StaticIndex:
+    """Stand-in for DescriptorIndex that serves a fixed IndexData without a database."""
+
+    def __init__(self, data):
+        from descriptor_index import DescriptorIndex
+        self._index = DescriptorIndex(collection=None)
+        self._index.data = data
+        self.data = data
+        self.version = 1
+        self.refresh_listeners = []
+
+    def __len__(self):
+        return len(self.data.keys)
+
+    def refresh_if_stale(self):
+        pass
+
+    def feature_distances(self, query_descriptors, data=None):
+        return self._index.feature_distances(query_descriptors, self.data if data is None else data)
+
+    def search(self, query_descriptors, weights, top_k=10):
+        return self._index.search(query_descriptors, weights, top_k)
+
+    def rank(self, distances, weights, top_k=10, data=None):
+        return self._index.rank(distances, weights, top_k, self.data if data is None else data)
@@ -0,0 +1,153 @@
+"""
+Cheap-to-expensive cascade over the six descriptors.
+
+Stage one scores every image with the exact Gabor, Hu moment, texture energy and circularity
+distances (24 values per image) plus lower bounds of the two expensive distances:
+    histogram        Bhattacharyya distance of 16-bin coarse histograms (Cauchy-Schwarz)
+    dominant_colors  distance between the means of the padded color sets (Jensen)
+The weighted sum is a lower bound of the full score, so only the candidate pool with the lowest
+bounds is scored exactly (stage two). When the k-th exact score is below every bound outside
+the pool, the result is certified identical to the exhaustive search; otherwise it may differ,
+and audit_rate samples queries against DescriptorIndex.search to measure how often it does.
+"""
+import logging
+import random
+import threading
+
+import numpy as np
+
+from descriptor_index import take_rows, top_k_indices
+from metrics import stage
+from similarity import (
+    bhattacharyya_lower_bound_batch,
+    circularity_distance_batch,
+    coarse_histogram_terms,
+    dominant_color_lower_bound_batch,
+    dominant_color_sums,
+    gabor_distance_batch,
+    hu_moments_distance_batch,
+    texture_energy_distance_batch,
+    weights_vector,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def lower_bound_distances(query_descriptors, data, terms):
+    """
+    Per-feature lower bounds of feature_distances: exact for the four cheap features
+
+    :param terms: (coarse_sqrt, color_sums) computed from data
+    :return: (N, 6) array with columns ordered like similarity.FEATURES
+    """
+    coarse_sqrt, color_sums = terms
+    return np.column_stack([
+        bhattacharyya_lower_bound_batch(query_descriptors["histogram"], coarse_sqrt, data.histogram_sums),
+        dominant_color_lower_bound_batch(query_descriptors["dominant_colors"], color_sums, data.dominant_counts),
+        gabor_distance_batch(query_descriptors["gabor_descriptors"], data.gabor),
+        hu_moments_distance_batch(query_descriptors["hu_moments"], data.hu_moments),
+        texture_energy_distance_batch(query_descriptors["texture_energy"], data.texture_energy),
+        circularity_distance_batch(query_descriptors["circularity"], data.circularity),
+    ])
+
+
+class CascadeSearch:
+    def __init__(self, descriptor_index, candidate_factor=10, min_candidates=100, audit_rate=0.0):
+        """
+        Same search interface as DescriptorIndex: lower-bound pass over every image, exact re-ranking of a pool
+
+        :param descriptor_index: DescriptorIndex providing the descriptors and the exact distances
+        :param candidate_factor: Candidates scored exactly per requested result
+        :param min_candidates: Smallest candidate pool, whatever top_k is
+        :param audit_rate: Fraction of queries also run exhaustively to count top-k disagreements
+        """
+        self.descriptor_index = descriptor_index
+        self.candidate_factor = candidate_factor
+        self.min_candidates = min_candidates
+        self.audit_rate = audit_rate
+        self._terms = (None, None)
+        self._stats_lock = threading.Lock()
+        self.queries = 0
+        self.certified = 0
+        self.audited = 0
+        self.disagreements = 0
+
+    def terms(self, data):
+        """Query-independent terms of the lower bounds, computed once per index generation."""
+        terms_data, terms = self._terms
+        if terms_data is not data:
+            terms = (coarse_histogram_terms(data.histograms), dominant_color_sums(data.dominant_colors))
+            self._terms = (data, terms)
+        return terms
+
+    def search_certified(self, query_descriptors, weights, top_k=10):
+        """
+        Cascade search that also says whether the result is provably the exhaustive one
+
+        :return: (results as returned by DescriptorIndex.search, certified)
+        """
+        data = self.descriptor_index.data
+        count = len(data.keys)
+        if not count:
+            return [], True
+        weight_vector = weights_vector(weights)
+        with stage('cascade_bound'):
+            bounds = lower_bound_distances(query_descriptors, data, self.terms(data)) @ weight_vector
+            pool_size = max(top_k * self.candidate_factor, self.min_candidates, top_k)
+            # Sorted by row, so ties are broken by position exactly like the exhaustive search
+            pool = np.sort(top_k_indices(bounds, pool_size))
+            candidates = take_rows(data, pool)
+        distances = self.descriptor_index.feature_distances(query_descriptors, candidates)
+        with stage('sort'):
+            scores = distances @ weight_vector
+            best = top_k_indices(scores, top_k)
+            results = [{
+                'category': candidates.keys[i][0],
+                'image_name': candidates.keys[i][1],
+                'similarity_score': float(scores[i]),
+            } for i in best]
+            certified = len(pool) == count
+            if not certified and len(best) == top_k:
+                outside = np.ones(count, dtype=bool)
+                outside[pool] = False
+                certified = bool(scores[best[-1]] < bounds[outside].min())
+        return results, certified
+
+    def search(self, query_descriptors, weights, top_k=10):
+        """
+        Rank every indexed image against the query.
+
+        :param query_descriptors: Descriptors of the query image
+        :param weights: Dictionary of feature weights
+        :param top_k: Number of results to return
+        :return: List of {'category', 'image_name', 'similarity_score'} sorted by score
+        """
+        results, certified = self.search_certified(query_descriptors, weights, top_k)
+        audit = not certified and self.audit_rate and random.random() < self.audit_rate
+        if audit:
+            exhaustive = self.descriptor_index.search(query_descriptors, weights, top_k)
+            differs = ([(r['category'], r['image_name']) for r in exhaustive]
+                       != [(r['category'], r['image_name']) for r in results])
+            if differs:
+                logger.info("Cascade top-%d differs from the exhaustive search", top_k)
+        with self._stats_lock:
+            self.queries += 1
+            self.certified += certified
+            if audit:
+                self.audited += 1
+                self.disagreements += differs
+        return results
+
+    def search_many(self, queries, weights, top_k=10):
+        """One search per query; candidate pools differ per query so there is nothing to batch."""
+        return [self.search(query, weights, top_k) for query in queries]
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queries': self.queries,
+                'certified': self.certified,
+                'audited': self.audited,
+                'disagreements': self.disagreements,
+                'candidate_factor': self.candidate_factor,
+            }
@@ -0,0 +1,457 @@
+import heapq
+import itertools
+import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from metrics import stage
+from similarity import (
+    FEATURES,
+    HISTOGRAM_CHANNELS,
+    bhattacharyya_distance_batch,
+    bhattacharyya_distance_many,
+    dominant_color_distance_batch,
+    circularity_distance_batch,
+    euclidean_distance_many,
+    gabor_distance_batch,
+    histogram_terms,
+    hu_moments_distance_batch,
+    texture_energy_distance_batch,
+    weights_vector,
+)
+
+logger = logging.getLogger(__name__)
+
+HISTOGRAM_BINS = 256
+GABOR_SIZE = 8
+HU_MOMENTS_SIZE = 7
+TEXTURE_ENERGY_SIZE = 4
+
+# Documents per cursor batch when scanning the collection (each is ~25 KB of BSON)
+SCAN_BATCH_SIZE = 500
+
+# Fields needed to rebuild a query-style descriptor dict from a collection document
+DESCRIPTOR_PROJECTION = {'_id': 0, 'category': 1, 'image_name': 1, **{feature: 1 for feature in FEATURES}}
+
+# One immutable generation of the index; a reload builds a new one and swaps it in.
+# histogram_sqrt and histogram_sums are the precomputed per-row terms of the Bhattacharyya distance
+IndexData = namedtuple('IndexData', [
+    'keys', 'histograms', 'histogram_sqrt', 'histogram_sums', 'dominant_colors', 'dominant_counts',
+    'gabor', 'hu_moments', 'texture_energy', 'circularity',
+])
+
+
+def top_k_indices(scores, top_k):
+    """
+    Indices of the top_k lowest scores, in the order a stable sort of the scores would give.
+
+    argpartition finds the k-th score, then every row tied with it is kept so that ties are
+    broken by row position exactly like sorted() on the original document order.
+    """
+    if top_k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.intp)
+    if top_k < len(scores):
+        kth = scores[np.argpartition(scores, top_k - 1)[top_k - 1]]
+        candidates = np.flatnonzero(scores <= kth)
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates], kind='stable')][:top_k]
+
+
+def build_index_data(documents):
+    """Parse descriptor documents into an IndexData, skipping documents with missing or malformed descriptors."""
+    keys, histograms, colors, gabor, hu_moments, texture_energy, circularity = [], [], [], [], [], [], []
+    for doc in documents:
+        try:
+            hist = np.array([doc['histogram'][color] for color in HISTOGRAM_CHANNELS], dtype=np.float32)
+            doc_colors = np.array(doc['dominant_colors'], dtype=np.float64).reshape(-1, 3)
+            doc_gabor = np.array(doc['gabor_descriptors'], dtype=np.float64)
+            doc_hu = np.array(doc['hu_moments'], dtype=np.float64)
+            doc_texture = np.array(doc['texture_energy'], dtype=np.float64)
+            doc_circularity = float(np.ravel(doc['circularity'])[0])
+            if (hist.shape != (len(HISTOGRAM_CHANNELS), HISTOGRAM_BINS) or len(doc_colors) == 0
+                    or doc_gabor.shape != (GABOR_SIZE,) or doc_hu.shape != (HU_MOMENTS_SIZE,)
+                    or doc_texture.shape != (TEXTURE_ENERGY_SIZE,)):
+                raise ValueError("unexpected descriptor shape")
+        except (KeyError, TypeError, ValueError, IndexError) as e:
+            logger.warning("Skipping %s in descriptor index: %s", doc.get('image_name'), e)
+            continue
+        keys.append((doc['category'], doc['image_name']))
+        histograms.append(hist)
+        colors.append(doc_colors)
+        gabor.append(doc_gabor)
+        hu_moments.append(doc_hu)
+        texture_energy.append(doc_texture)
+        circularity.append(doc_circularity)
+
+    counts = np.array([len(c) for c in colors], dtype=np.int64)
+    padded_colors = np.zeros((len(colors), counts.max() if len(counts) else 0, 3))
+    for row, c in enumerate(colors):
+        padded_colors[row, :len(c)] = c
+
+    histograms = np.array(histograms, dtype=np.float32).reshape(-1, len(HISTOGRAM_CHANNELS), HISTOGRAM_BINS)
+    histogram_sqrt, histogram_sums = histogram_terms(histograms)
+    return IndexData(
+        keys=keys,
+        histograms=histograms,
+        histogram_sqrt=histogram_sqrt,
+        histogram_sums=histogram_sums,
+        dominant_colors=padded_colors,
+        dominant_counts=counts,
+        gabor=np.array(gabor).reshape(-1, GABOR_SIZE),
+        hu_moments=np.array(hu_moments).reshape(-1, HU_MOMENTS_SIZE),
+        texture_energy=np.array(texture_energy).reshape(-1, TEXTURE_ENERGY_SIZE),
+        circularity=np.array(circularity, dtype=np.float64),
+    )
+
+
+def row_descriptors(data, row):
+    """Descriptor dict of one indexed image, in the same layout as a collection document."""
+    count = int(data.dominant_counts[row])
+    return {
+        "histogram": {color: data.histograms[row, i].tolist() for i, color in enumerate(HISTOGRAM_CHANNELS)},
+        "dominant_colors": data.dominant_colors[row, :count].tolist(),
+        "gabor_descriptors": data.gabor[row].tolist(),
+        "hu_moments": data.hu_moments[row].tolist(),
+        "texture_energy": data.texture_energy[row].tolist(),
+        "circularity": float(data.circularity[row]),
+    }
+
+
+def fetch_descriptors(collection, keys):
+    """
+    Descriptors of several images in one collection query
+
+    :param keys: Iterable of (category, image_name)
+    :return: {(category, image_name): descriptor dict} for the keys that exist
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+    query = {'$or': [{'category': category, 'image_name': image_name} for category, image_name in keys]}
+    found = {}
+    with stage('db_fetch'):
+        for doc in collection.find(query, projection=DESCRIPTOR_PROJECTION):
+            key = (doc['category'], doc['image_name'])
+            found.setdefault(key, {feature: doc.get(feature, []) for feature in FEATURES})
+    return found
+
+
+def _writes_document(collection):
+    return collection.database[f"{collection.name}_writes"]
+
+
+def collection_writes(collection):
+    """Write counter of a descriptor collection, bumped by mark_collection_changed."""
+    doc = _writes_document(collection).find_one({'_id': collection.name})
+    return doc['count'] if doc else 0
+
+
+def mark_collection_changed(collection):
+    """
+    Bump the write counter included in DescriptorIndex signatures. Call it after every write to
+    the descriptor collection: documents updated in place keep their _id and the document count.
+    """
+    _writes_document(collection).update_one({'_id': collection.name}, {'$inc': {'count': 1}}, upsert=True)
+
+
+def scan_collection(collection, batch_size=SCAN_BATCH_SIZE):
+    """Cursor over every descriptor document, fetching only the descriptor fields."""
+    return collection.find({}, projection=DESCRIPTOR_PROJECTION, batch_size=batch_size)
+
+
+def feature_distances(query_descriptors, data):
+    """
+    Distance of the query to every row of an IndexData, one column per feature.
+
+    :return: (N, 6) array with columns ordered like similarity.FEATURES
+    """
+    return np.column_stack([
+        bhattacharyya_distance_batch(query_descriptors["histogram"], data.histograms,
+                                     terms=(data.histogram_sqrt, data.histogram_sums)),
+        dominant_color_distance_batch(query_descriptors["dominant_colors"], data.dominant_colors, data.dominant_counts),
+        gabor_distance_batch(query_descriptors["gabor_descriptors"], data.gabor),
+        hu_moments_distance_batch(query_descriptors["hu_moments"], data.hu_moments),
+        texture_energy_distance_batch(query_descriptors["texture_energy"], data.texture_energy),
+        circularity_distance_batch(query_descriptors["circularity"], data.circularity),
+    ]).reshape(-1, len(FEATURES))
+
+
+def stream_search(collection, query_descriptors, weights, top_k=10, batch_size=SCAN_BATCH_SIZE):
+    """
+    Rank the collection without holding it in memory: each cursor batch is scored as it
+    arrives and only the current top_k survive in a bounded heap. Ties are broken by document
+    order, so the result matches DescriptorIndex.search over the same documents.
+
+    :return: List of {'category', 'image_name', 'similarity_score'} sorted by score
+    """
+    weight_vector = weights_vector(weights)
+    # (-score, -position, key): the root is the worst result kept so far
+    heap = []
+    position = 0
+    cursor = iter(scan_collection(collection, batch_size))
+    while True:
+        with stage('db_fetch'):
+            data = build_index_data(itertools.islice(cursor, batch_size))
+        if not data.keys:
+            break
+        with stage('score'):
+            scores = feature_distances(query_descriptors, data) @ weight_vector
+        with stage('sort'):
+            for row in top_k_indices(scores, top_k):
+                item = (-float(scores[row]), -(position + row), data.keys[row])
+                if len(heap) < top_k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+        position += len(data.keys)
+    return [{
+        'category': key[0],
+        'image_name': key[1],
+        'similarity_score': -neg_score,
+    } for neg_score, _, key in sorted(heap, reverse=True)]
+
+
+class StreamingSearch:
+    def __init__(self, collection, batch_size=SCAN_BATCH_SIZE):
+        """
+        Same search interface as DescriptorIndex, scanning the collection on every query with
+        stream_search instead of keeping descriptor matrices in memory
+
+        :param collection: MongoDB collection holding one descriptor document per image
+        :param batch_size: Documents per cursor batch
+        """
+        self.collection = collection
+        self.batch_size = batch_size
+
+    def search(self, query_descriptors, weights, top_k=10):
+        return stream_search(self.collection, query_descriptors, weights, top_k, self.batch_size)
+
+    def search_many(self, queries, weights, top_k=10):
+        return [self.search(query, weights, top_k) for query in queries]
+
+
+def take_rows(data, rows):
+    """IndexData restricted to the given row positions, in that order."""
+    return IndexData(
+        keys=[data.keys[row] for row in rows],
+        histograms=data.histograms[rows],
+        histogram_sqrt=data.histogram_sqrt[rows],
+        histogram_sums=data.histogram_sums[rows],
+        dominant_colors=data.dominant_colors[rows],
+        dominant_counts=data.dominant_counts[rows],
+        gabor=data.gabor[rows],
+        hu_moments=data.hu_moments[rows],
+        texture_energy=data.texture_energy[rows],
+        circularity=data.circularity[rows],
+    )
+
+
+class DescriptorIndex:
+    def __init__(self, collection, store_dir=None):
+        """
+        In-memory copy of the descriptor collection, stored as contiguous NumPy matrices
+        so that a query is scored against every image with a few array operations.
+
+        :param collection: MongoDB collection holding one descriptor document per image
+        :param store_dir: Binary descriptor store to memory-map from and keep in sync (optional)
+        """
+        self.collection = collection
+        self.store_dir = store_dir
+        self._lock = threading.Lock()
+        self._signature = None
+        self._rows = (None, {})
+        self.version = 0
+        # Descriptor store export the current data is memory-mapped from (None when read from the collection)
+        self.store_version = None
+        self.data = build_index_data([])
+        # Called with the new IndexData after every refresh (e.g. to rebuild an ANN index)
+        self.refresh_listeners = []
+
+    def __len__(self):
+        return len(self.data.keys)
+
+    def _collection_signature(self):
+        """
+        Cheap fingerprint of the collection: document count, newest _id and write counter.
+        The first two catch inserts and deletes, the counter catches documents updated in place.
+        """
+        newest = self.collection.find_one({}, projection={'_id': 1}, sort=[('_id', -1)])
+        return (self.collection.estimated_document_count(), newest['_id'] if newest else None,
+                collection_writes(self.collection))
+
+    def refresh(self, use_store=True):
+        """
+        Reload every descriptor and rebuild the matrices. With a descriptor store, an export made
+        from the same collection state is memory-mapped instead of reading the collection; otherwise
+        the collection is read and a new export is written for the other workers.
+
+        :param use_store: Set to False to always read the collection (the store is still updated)
+        """
+        with self._lock:
+            with stage('db_fetch'):
+                signature = self._collection_signature()
+            self._reload(signature, use_store)
+        self._notify()
+
+    def _reload(self, signature, use_store):
+        # Called with self._lock held
+        with stage('db_fetch'):
+            self.data, self.store_version = self._load(signature, use_store)
+        self._signature = signature
+        self.version += 1
+        logger.info("Descriptor index loaded %d images (version %d)", len(self), self.version)
+
+    def _notify(self):
+        for listener in self.refresh_listeners:
+            listener(self.data)
+
+    def _load(self, signature, use_store):
+        """(IndexData, store export it is memory-mapped from or None)"""
+        if not self.store_dir:
+            return build_index_data(scan_collection(self.collection)), None
+        import descriptor_store
+        stamp = descriptor_store.version_stamp(signature)
+        data = descriptor_store.load_index_data(stamp, self.store_dir) if use_store else None
+        if data is None:
+            built = build_index_data(scan_collection(self.collection))
+            descriptor_store.export_index_data(built, stamp, self.store_dir)
+            data = descriptor_store.load_index_data(stamp, self.store_dir)
+            if data is None:
+                logger.warning("Descriptor store export %s could not be opened, keeping the index in memory", stamp)
+                return built, None
+        return data, stamp
+
+    def refresh_if_stale(self):
+        """
+        Reload only if the collection changed since the last load. Staleness is checked again
+        under the lock, so threads that find the index stale at the same time reload it once.
+        """
+        with stage('db_fetch'):
+            stale = self._signature is None or self._collection_signature() != self._signature
+        if not stale:
+            return
+        with self._lock:
+            with stage('db_fetch'):
+                signature = self._collection_signature()
+            if signature == self._signature:
+                return
+            self._reload(signature, use_store=True)
+        self._notify()
+
+    def invalidate(self):
+        """Force a reload on the next refresh_if_stale call."""
+        self._signature = None
+
+    def row_of(self, data=None):
+        """{(category, image_name): row} for an IndexData generation, built once per generation."""
+        if data is None:
+            data = self.data
+        rows_data, rows = self._rows
+        if rows_data is not data:
+            rows = {key: row for row, key in enumerate(data.keys)}
+            self._rows = (data, rows)
+        return rows
+
+    def lookup(self, keys):
+        """
+        Descriptors of several images: read from the in-memory matrices, with one batched
+        collection query for any key that is not indexed (e.g. added since the last refresh).
+
+        :param keys: Iterable of (category, image_name)
+        :return: {(category, image_name): descriptor dict} for the keys that exist
+        """
+        data = self.data
+        rows = self.row_of(data)
+        found, missing = {}, []
+        for key in keys:
+            key = tuple(key)
+            if key in rows:
+                found[key] = row_descriptors(data, rows[key])
+            else:
+                missing.append(key)
+        if missing and self.collection is not None:
+            found.update(fetch_descriptors(self.collection, missing))
+        return found
+
+    def feature_distances(self, query_descriptors, data=None):
+        """
+        Distance of the query to every indexed image, one column per feature.
+
+        :param data: IndexData generation to score against (defaults to the current one)
+        :return: (N, 6) array with columns ordered like similarity.FEATURES
+        """
+        if data is None:
+            data = self.data
+        with stage('score'):
+            return feature_distances(query_descriptors, data)
+
+    def feature_distances_many(self, queries, data=None):
+        """
+        feature_distances for several queries in one pass.
+
+        :param queries: List of query descriptor dicts
+        :return: (Q, N, 6) array
+        """
+        if data is None:
+            data = self.data
+        return np.stack([
+            bhattacharyya_distance_many([q["histogram"] for q in queries], data.histograms,
+                                        terms=(data.histogram_sqrt, data.histogram_sums)),
+            np.array([dominant_color_distance_batch(q["dominant_colors"], data.dominant_colors, data.dominant_counts)
+                      for q in queries]).reshape(len(queries), -1),
+            euclidean_distance_many([q["gabor_descriptors"] for q in queries], data.gabor),
+            euclidean_distance_many([q["hu_moments"] for q in queries], data.hu_moments),
+            euclidean_distance_many([q["texture_energy"] for q in queries], data.texture_energy),
+            euclidean_distance_many([q["circularity"] for q in queries], data.circularity),
+        ], axis=2)
+
+    def _results(self, data, scores, top_k):
+        with stage('sort'):
+            return [{
+                'category': data.keys[row][0],
+                'image_name': data.keys[row][1],
+                'similarity_score': float(scores[row]),
+            } for row in top_k_indices(scores, top_k)]
+
+    def search_many(self, queries, weights, top_k=10):
+        """
+        Rank every indexed image against each of several queries with one batched distance computation.
+
+        :return: One result list (as returned by search) per query
+        """
+        if not queries:
+            return []
+        data = self.data
+        with stage('score'):
+            scores = self.feature_distances_many(queries, data) @ weights_vector(weights)
+        return [self._results(data, row_scores, top_k) for row_scores in scores]
+
+    def search(self, query_descriptors, weights, top_k=10):
+        """
+        Rank every indexed image against the query.
+
+        :param query_descriptors: Descriptors of the query image
+        :param weights: Dictionary of feature weights
+        :param top_k: Number of results to return
+        :return: List of {'category', 'image_name', 'similarity_score'} sorted by score
+        """
+        data = self.data
+        return self.rank(self.feature_distances(query_descriptors, data), weights, top_k, data)
+
+    def rank(self, distances, weights, top_k=10, data=None):
+        """
+        Rank from a precomputed feature_distances matrix, e.g. to re-weight a query after feedback
+        without recomputing any distance.
+
+        :param distances: (N, 6) matrix returned by feature_distances for the same data
+        :param data: IndexData the matrix was computed against (defaults to the current one)
+        :return: List of {'category', 'image_name', 'similarity_score'} sorted by score
+        """
+        if data is None:
+            data = self.data
+        with stage('score'):
+            scores = distances @ weights_vector(weights)
+        return self._results(data, scores, top_k)
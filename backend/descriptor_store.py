@@ -0,0 +1,165 @@
+"""
+Columnar binary copy of the descriptor collection.
+
+Each export is a directory of float32 .npy arrays (one per descriptor) plus keys.json, the
+(category, image_name) of every row, and manifest.json, which records the collection signature
+the export was made from. Arrays are opened with np.load(mmap_mode='r'), so every worker process
+on the machine shares one page-cached copy instead of deserializing BSON into Python lists.
+
+    store/
+        CURRENT                   name of the live export, replaced atomically
+        <version>/manifest.json
+        <version>/keys.json
+        <version>/histograms.npy  ...
+
+    python descriptor_store.py export
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from descriptor_index import IndexData
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DESCRIPTOR_STORE_DIR = os.path.join(BASE_DIR, 'descriptor_store')
+FORMAT_VERSION = 2
+
+ARRAY_DTYPES = {
+    'histograms': np.float32,
+    'histogram_sqrt': np.float32,
+    'histogram_sums': np.float64,
+    'dominant_colors': np.float32,
+    'dominant_counts': np.int32,
+    'gabor': np.float32,
+    'hu_moments': np.float32,
+    'texture_energy': np.float32,
+    'circularity': np.float32,
+}
+
+
+def version_stamp(signature):
+    """Directory-safe stamp for a DescriptorIndex collection signature."""
+    return hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+
+
+def current_version(store_dir=DESCRIPTOR_STORE_DIR):
+    try:
+        with open(os.path.join(store_dir, 'CURRENT')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_manifest(directory):
+    """Manifest of an export directory, or None if it is missing or unreadable."""
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_current_export(directory, version):
+    """True if directory holds a complete export of version in the current FORMAT_VERSION."""
+    manifest = read_manifest(directory)
+    return manifest is not None and manifest.get('format') == FORMAT_VERSION and manifest.get('version') == version
+
+
+def export_index_data(data, version, store_dir=DESCRIPTOR_STORE_DIR):
+    """
+    Write an IndexData as a new export and make it the current one. An existing export of the
+    same version is reused only if it has the current format; older formats are rebuilt.
+
+    :param data: IndexData to write
+    :param version: Stamp from version_stamp() identifying the collection state
+    :return: Path of the export directory
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    target = os.path.join(store_dir, version)
+    if not is_current_export(target, version):
+        # Build in a private directory and rename it into place, so readers never see a partial export
+        staging = tempfile.mkdtemp(prefix=f".{version}-", dir=store_dir)
+        for name, dtype in ARRAY_DTYPES.items():
+            np.save(os.path.join(staging, f"{name}.npy"), np.ascontiguousarray(getattr(data, name), dtype=dtype))
+        with open(os.path.join(staging, 'keys.json'), 'w') as f:
+            json.dump([list(key) for key in data.keys], f)
+        with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+            json.dump({'format': FORMAT_VERSION, 'version': version, 'count': len(data.keys)}, f)
+        stale = None
+        if os.path.exists(target):
+            # Export of an older format under the same stamp: move it aside (open memory maps stay valid)
+            stale = tempfile.mkdtemp(prefix=f".{version}-stale-", dir=store_dir)
+            try:
+                os.rename(target, os.path.join(stale, version))
+            except OSError:
+                pass  # Another process moved it first
+        try:
+            os.rename(staging, target)
+        except OSError:
+            # Another process exported the same version first
+            shutil.rmtree(staging, ignore_errors=True)
+        if stale is not None:
+            shutil.rmtree(stale, ignore_errors=True)
+
+    previous = current_version(store_dir)
+    pointer = tempfile.NamedTemporaryFile('w', dir=store_dir, prefix='.CURRENT-', delete=False)
+    with pointer:
+        pointer.write(version)
+    os.replace(pointer.name, os.path.join(store_dir, 'CURRENT'))
+    _prune(store_dir, keep={version, previous})
+    return target
+
+
+def _prune(store_dir, keep):
+    # Keep the new and the previous export; open memory maps stay valid after their files are unlinked
+    for entry in os.scandir(store_dir):
+        if entry.is_dir() and not entry.name.startswith('.') and entry.name not in keep:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def load_index_data(version=None, store_dir=DESCRIPTOR_STORE_DIR, mmap_mode='r'):
+    """
+    Open an export as an IndexData backed by read-only memory maps
+
+    :param version: Export to open (defaults to the current one)
+    :return: IndexData, or None if there is no such export
+    """
+    version = version or current_version(store_dir)
+    if version is None:
+        return None
+    directory = os.path.join(store_dir, version)
+    if not is_current_export(directory, version):
+        return None
+    try:
+        with open(os.path.join(directory, 'keys.json')) as f:
+            keys = [tuple(key) for key in json.load(f)]
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAY_DTYPES}
+    except (OSError, ValueError):
+        return None
+    return IndexData(keys=keys, **arrays)
+
+
+def main():
+    from pymongo import MongoClient
+    from descriptor_index import DescriptorIndex
+
+    parser = argparse.ArgumentParser(description="Export the descriptor collection to the binary descriptor store")
+    parser.add_argument('command', choices=['export'])
+    parser.add_argument('--store', default=DESCRIPTOR_STORE_DIR)
+    parser.add_argument('--mongo-uri', default="mongodb://127.0.0.1:27017/")
+    parser.add_argument('--db', default='ImageMatch')
+    parser.add_argument('--collection', default='image_descriptors2')
+    args = parser.parse_args()
+
+    index = DescriptorIndex(MongoClient(args.mongo_uri)[args.db][args.collection], store_dir=args.store)
+    index.refresh(use_store=False)
+    print(f"Exported {len(index)} images to {os.path.join(args.store, current_version(args.store))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Append-only log of relevance feedback rounds, folded periodically into a snapshot.
+
+Every round appends one JSON line: the weights before and after, and the feedback items.
+compact() moves the log aside as an archived segment and folds it into the snapshot (the
+weights history so far), so startup reads the snapshot plus a short log tail instead of
+replaying every round ever made. The snapshot keeps the last max_history weights and only the
+newest max_segments archived segments are kept.
+
+    feedback_log.jsonl                  current tail, one event per line
+    feedback_snapshot.json              {"format", "last_segment", "weights_history"}
+    feedback_log.<time_ns>.jsonl        compacted segments (kept unless archive=False)
+"""
+import glob
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are still serialized within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FEEDBACK_LOG_FILE = os.path.join(BASE_DIR, 'feedback_log.jsonl')
+FEEDBACK_SNAPSHOT_FILE = os.path.join(BASE_DIR, 'feedback_snapshot.json')
+# Written by earlier versions on every round; imported once as the initial history
+LEGACY_HISTORY_FILE = os.path.join(BASE_DIR, 'weights_history.json')
+SNAPSHOT_FORMAT = 1
+
+# Descriptors are looked up again from the index when needed; the log keeps what the user said
+FEEDBACK_ITEM_FIELDS = ('category', 'image_name', 'feedback')
+
+
+def write_json_atomic(path, value, **dump_options):
+    """
+    Write JSON to a temporary file next to path, flush it to disk, then rename it over path.
+    The file keeps the mode of the one it replaces (0644 for a new file; mkstemp would make it 0600).
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o644
+    fd, staging = tempfile.mkstemp(prefix=f".{os.path.basename(path)}-", dir=directory)
+    try:
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f, **dump_options)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(staging, path)
+    except BaseException:
+        if os.path.exists(staging):
+            os.remove(staging)
+        raise
+
+
+def read_events(path):
+    """Events of one log file; a torn last line (crash mid-append) is skipped."""
+    events = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping unreadable feedback log line in %s", path)
+    except FileNotFoundError:
+        pass
+    return events
+
+
+class FeedbackLog:
+    def __init__(self, log_file=FEEDBACK_LOG_FILE, snapshot_file=FEEDBACK_SNAPSHOT_FILE, compact_every=1000,
+                 archive=True, legacy_history_file=LEGACY_HISTORY_FILE, max_history=10000, max_segments=20):
+        """
+        Feedback events in an append-only JSONL file plus a compacted snapshot
+
+        :param log_file: JSONL file new events are appended to
+        :param snapshot_file: JSON snapshot written by compact()
+        :param compact_every: Events in the log after which compact_if_due() compacts
+        :param archive: Keep compacted log segments next to the log (otherwise they are deleted)
+        :param legacy_history_file: weights_history.json to start from when there is no snapshot yet
+        :param max_history: Most recent weights kept in the snapshot (and returned by load())
+        :param max_segments: Archived segments kept; older ones are deleted on compaction
+        """
+        self.log_file = log_file
+        self.snapshot_file = snapshot_file
+        self.compact_every = compact_every
+        self.archive = archive
+        self.legacy_history_file = legacy_history_file
+        self.max_history = max_history
+        self.max_segments = max_segments
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._tail_events = 0
+
+    @contextmanager
+    def locked(self):
+        """
+        Exclusive lock over the log: a thread lock within the process, an advisory file lock across
+        worker processes. Re-entrant, so a caller can hold it around a read-modify-append.
+        """
+        with self._lock:
+            self._lock_depth += 1
+            try:
+                # flock locks are per open file: only the outermost level takes it
+                if fcntl is None or self._lock_depth > 1:
+                    yield
+                    return
+                with open(f"{self.log_file}.lock", 'a') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        yield
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+            finally:
+                self._lock_depth -= 1
+
+    def _segments(self):
+        base, ext = os.path.splitext(self.log_file)
+        return sorted(glob.glob(f"{glob.escape(base)}.*{ext}"))
+
+    def _read_snapshot(self):
+        try:
+            with open(self.snapshot_file) as f:
+                snapshot = json.load(f)
+            if snapshot.get('format') == SNAPSHOT_FORMAT:
+                return snapshot
+            logger.warning("Ignoring feedback snapshot %s with unknown format", self.snapshot_file)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logger.warning("Ignoring unreadable feedback snapshot %s", self.snapshot_file)
+        history = []
+        if self.legacy_history_file:
+            try:
+                with open(self.legacy_history_file) as f:
+                    history = json.load(f)
+            except (OSError, ValueError):
+                history = []
+        return {'format': SNAPSHOT_FORMAT, 'last_segment': None, 'weights_history': history}
+
+    def _pending_segments(self, snapshot):
+        # Segments moved aside by a compaction that stopped before writing its snapshot
+        last = snapshot.get('last_segment')
+        return [path for path in self._segments() if last is None or os.path.basename(path) > last]
+
+    def load(self):
+        """
+        Weights history (weights after each round, oldest first): the snapshot plus the log tail.
+
+        :return: List of weight dictionaries
+        """
+        with self._lock:
+            snapshot = self._read_snapshot()
+            history = list(snapshot['weights_history'])
+            for path in self._pending_segments(snapshot):
+                history.extend(event['weights_after'] for event in read_events(path))
+            tail = read_events(self.log_file)
+            history.extend(event['weights_after'] for event in tail)
+            self._tail_events = len(tail)
+            return history[-self.max_history:] if self.max_history else history
+
+    def events(self):
+        """Events appended since the last compaction."""
+        return read_events(self.log_file)
+
+    def append(self, weights_before, weights_after, feedback_items, query_id=None):
+        """
+        Append one feedback round as a single line
+
+        :param feedback_items: Feedback items as sent by the client (descriptors are not logged)
+        :return: The logged event
+        """
+        event = {
+            'time': time.time(),
+            'query_id': query_id,
+            'weights_before': dict(weights_before),
+            'weights_after': dict(weights_after),
+            'feedback': [{field: item.get(field) for field in FEEDBACK_ITEM_FIELDS} for item in feedback_items],
+        }
+        line = json.dumps(event) + "\n"
+        with self.locked():
+            with open(self.log_file, 'a') as f:
+                f.write(line)
+            self._tail_events += 1
+        return event
+
+    def compact(self):
+        """
+        Fold the log into the snapshot: the log is renamed to a segment, the snapshot rewritten
+        atomically, and appends continue in a new log file.
+
+        :return: Number of events folded in
+        """
+        with self.locked():
+            if not os.path.exists(self.log_file) or os.path.getsize(self.log_file) == 0:
+                self._tail_events = 0
+                return 0
+            base, ext = os.path.splitext(self.log_file)
+            os.replace(self.log_file, f"{base}.{time.time_ns()}{ext}")
+
+            snapshot = self._read_snapshot()
+            segments = self._pending_segments(snapshot)
+            folded = 0
+            for path in segments:
+                events = read_events(path)
+                snapshot['weights_history'].extend(event['weights_after'] for event in events)
+                folded += len(events)
+            if self.max_history:
+                snapshot['weights_history'] = snapshot['weights_history'][-self.max_history:]
+            snapshot['last_segment'] = os.path.basename(segments[-1])
+            write_json_atomic(self.snapshot_file, snapshot)
+            # Segments are folded into the snapshot, so deleting old ones only drops the archive
+            archived = self._segments() if self.archive else []
+            expired = archived[:-self.max_segments] if self.max_segments else []
+            for path in (expired if self.archive else segments):
+                os.remove(path)
+            self._tail_events = 0
+        logger.info("Compacted %d feedback events into %s", folded, self.snapshot_file)
+        return folded
+
+    def compact_if_due(self):
+        """Compact once compact_every events have been appended since the last compaction."""
+        if self.compact_every and self._tail_events >= self.compact_every:
+            return self.compact()
+        return 0
@@ -0,0 +1,51 @@
+"""
+Pre-fork production server (gunicorn, Linux/macOS):
+
+    cd backend && gunicorn -c gunicorn.conf.py
+
+The application is loaded once in the master (preload_app, see wsgi.py): the descriptor index,
+the Gabor filter bank and the heavy imports are then shared copy-on-write by every worker instead
+of being loaded by each of them. Every worker opens its own MongoDB connection and runs one warm-up
+query before serving. Workers are recycled after MAX_REQUESTS requests (with jitter, so they do not
+all restart together); replacements are forked from the same warm master, so recycling never reloads
+the index. A replacement whose index is older than the collection refreshes it on its first search.
+
+GET /healthz answers as soon as a worker runs; GET /readyz answers 503 until its index is loaded.
+
+One worker by default. Queries are shared between workers through QUERY_SPILL_DIR (keep it set),
+but upload jobs (/jobs/<id>) live in the worker that created them and /metrics reports only the
+worker that answers. With WEB_CONCURRENCY > 1, route each client to one worker (sticky sessions
+in the proxy) or keep ASYNC_UPLOADS off, and read the counters as per-worker samples.
+"""
+import os
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = 'wsgi:application'
+bind = os.environ.get('BIND', '127.0.0.1:5001')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Threaded workers, so a /jobs/<id>/events stream does not hold a whole worker
+worker_class = 'gthread'
+threads = int(os.environ.get('WORKER_THREADS', 4))
+preload_app = True
+
+max_requests = int(os.environ.get('MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', max_requests // 10))
+# Seconds a recycled or stopped worker gets to finish its requests in flight
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+timeout = int(os.environ.get('WORKER_TIMEOUT', 120))
+
+
+def pre_fork(server, worker):
+    import app
+    app.before_fork()
+
+
+def post_fork(server, worker):
+    import app
+    app.after_fork()
+    app.warm_up()
+
+
+def worker_exit(server, worker):
+    import app
+    app.worker_shutdown()
@@ -1,15 +1,76 @@
+import os
+from functools import lru_cache
 import cv2
 import numpy as np
-from sklearn.cluster import KMeans
 from collections import Counter
+from metrics import stage
+
+# How dominant colors are extracted:
+#   'exact'    - KMeans over every pixel of the full-resolution image (original behaviour)
+#   'fast'     - MiniBatchKMeans over a downscaled copy, fixed seed and capped iterations
+#   'quantize' - no clustering: 8 levels per channel, most populated bins, mean color per bin
+# Descriptors in the database and query descriptors should use the same mode;
+# compare them with benchmarks/dominant_colors.py before switching.
+DOMINANT_COLORS_MODES = ('exact', 'fast', 'quantize')
+DOMINANT_COLORS_MODE = os.environ.get('DOMINANT_COLORS_MODE', 'exact')
+FAST_MAX_SIDE = 128
+FAST_MAX_ITER = 50
+
+# Gabor filter bank shared by gabor_descriptors (all kernels) and texture_energy (sigma=3 kernels)
+GABOR_KSIZE = (21, 21)
+GABOR_THETAS = (0, np.pi / 4, np.pi / 2, 3 * np.pi / 4)
+GABOR_SIGMAS = (1, 3)
+TEXTURE_SIGMA = 3
+# 'direct' runs cv2.filter2D per kernel, 'fft' shares one forward FFT of the image across the bank
+GABOR_METHOD = os.environ.get('GABOR_METHOD', 'direct')
+# Filter a cv2.pyrDown level of images whose longest side exceeds this many pixels (0 = full resolution)
+GABOR_MAX_SIDE = int(os.environ.get('GABOR_MAX_SIDE', 0))
 
 def normalize(arr):
     """Normalize array to [0, 1] range."""
     arr = np.array(arr)
     return (arr - np.min(arr)) / (np.max(arr) - np.min(arr)) if np.max(arr) != np.min(arr) else arr
 
-def calculate_color_histogram(image_path):
-    img = cv2.imread(image_path)
+def decode_image(image):
+    """Return a BGR image array from encoded image bytes, or the array itself if already decoded."""
+    if isinstance(image, np.ndarray) and image.ndim == 3:
+        return image
+    img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode image data")
+    return img
+
+def extract_descriptors(image, dominant_colors_mode=None):
+    """
+    Compute all six descriptors from a single decode of the image.
+
+    :param image: Decoded BGR array (as returned by cv2.imread) or encoded image bytes
+    :param dominant_colors_mode: One of DOMINANT_COLORS_MODES (defaults to DOMINANT_COLORS_MODE)
+    :return: Descriptor dict in the same layout as the database documents
+    """
+    with stage('decode'):
+        img = decode_image(image)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    descriptors = {}
+    with stage('histogram'):
+        descriptors["histogram"] = color_histogram(img)
+    with stage('dominant_colors'):
+        descriptors["dominant_colors"] = dominant_colors(img, mode=dominant_colors_mode)
+    # One Gabor bank pass serves both gabor_descriptors and texture_energy
+    with stage('gabor'):
+        gabor_stats = gabor_statistics(gray)
+        descriptors["gabor_descriptors"] = gabor_descriptors(gray, gabor_stats).tolist()
+    with stage('hu_moments'):
+        descriptors["hu_moments"] = hu_moments(gray)
+    with stage('texture_energy'):
+        descriptors["texture_energy"] = texture_energy(gray, gabor_stats)
+    with stage('circularity'):
+        descriptors["circularity"] = float(circularity(gray))
+    return descriptors
+
+# Array-level extractors: img is a BGR array, gray a single-channel array
+
+def color_histogram(img):
     chans = cv2.split(img)
     colors = ("b", "g", "r")
     histograms = {}
@@ -19,49 +80,121 @@ def calculate_color_histogram(image_path):
         histograms[color] = hist.tolist()
     return histograms
 
-def find_dominant_colors(image_path, k=8, threshold=0.05):
-    img = cv2.imread(image_path)
+def dominant_colors(img, k=8, threshold=0.05, mode=None):
+    mode = mode or DOMINANT_COLORS_MODE
+    if mode == 'fast':
+        return _dominant_colors_fast(img, k, threshold)
+    if mode == 'quantize':
+        return _dominant_colors_quantize(img, k, threshold)
+    if mode != 'exact':
+        raise ValueError(f"Unknown dominant colors mode: {mode}")
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     img = img.reshape((-1, 3))
+    # Imported on first use: scikit-learn is the slowest import of the backend
+    from sklearn.cluster import KMeans
     kmeans = KMeans(n_clusters=k, random_state=0).fit(img)
     counts = Counter(kmeans.labels_)
     total_pixels = sum(counts.values())
     dominant_colors = [kmeans.cluster_centers_[idx] / 255.0 for idx, count in counts.items() if count / total_pixels > threshold]
     return [color.tolist() for color in dominant_colors]
 
-def calculate_gabor_descriptors(image_path):
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    responses = []
-    for theta in [0, np.pi / 4, np.pi / 2, 3 * np.pi / 4]:  # 4 orientations
-        for sigma in [1, 3]:  # 2 scales
-            kernel = cv2.getGaborKernel((21, 21), sigma, theta, 10, 0.5, 0, ktype=cv2.CV_32F)
-            filtered_img = cv2.filter2D(img, cv2.CV_8UC3, kernel)
-            responses.append(np.mean(filtered_img))
-    responses = np.array(responses)
+def _downscale(img, max_side):
+    scale = max_side / max(img.shape[:2])
+    if scale >= 1:
+        return img
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+def _dominant_colors_fast(img, k, threshold):
+    pixels = cv2.cvtColor(_downscale(img, FAST_MAX_SIDE), cv2.COLOR_BGR2RGB).reshape((-1, 3)).astype(np.float64)
+    from sklearn.cluster import MiniBatchKMeans
+    kmeans = MiniBatchKMeans(n_clusters=k, random_state=0, n_init=3, max_iter=FAST_MAX_ITER,
+                             batch_size=2048).fit(pixels)
+    counts = Counter(kmeans.labels_)
+    total_pixels = sum(counts.values())
+    dominant_colors = [kmeans.cluster_centers_[idx] / 255.0 for idx, count in counts.items() if count / total_pixels > threshold]
+    return [color.tolist() for color in dominant_colors]
+
+def _dominant_colors_quantize(img, k, threshold):
+    pixels = cv2.cvtColor(_downscale(img, FAST_MAX_SIDE), cv2.COLOR_BGR2RGB).reshape((-1, 3))
+    bins = (pixels[:, 0] >> 5).astype(np.int64) * 64 + (pixels[:, 1] >> 5) * 8 + (pixels[:, 2] >> 5)
+    counts = np.bincount(bins, minlength=512)
+    sums = np.stack([np.bincount(bins, weights=pixels[:, c], minlength=512) for c in range(3)], axis=1)
+    top_bins = np.argsort(counts, kind='stable')[::-1][:k]
+    return [(sums[b] / counts[b] / 255.0).tolist() for b in top_bins if counts[b] / len(pixels) > threshold]
+
+@lru_cache(maxsize=None)
+def gabor_kernel(sigma, theta):
+    kernel = cv2.getGaborKernel(GABOR_KSIZE, sigma, theta, 10, 0.5, 0, ktype=cv2.CV_32F)
+    kernel.setflags(write=False)
+    return kernel
+
+@lru_cache(maxsize=32)
+def _gabor_kernel_spectrum(sigma, theta, shape):
+    import scipy.fft
+    # filter2D correlates, so the FFT product needs the flipped kernel
+    return scipy.fft.rfft2(gabor_kernel(sigma, theta)[::-1, ::-1], shape)
+
+def gabor_bank():
+    """(sigma, theta) of every kernel in the bank: 4 orientations x 2 scales, in gabor_descriptors order."""
+    return [(sigma, theta) for theta in GABOR_THETAS for sigma in GABOR_SIGMAS]
+
+def _gabor_responses(gray, method):
+    if method == 'direct':
+        for sigma, theta in gabor_bank():
+            yield (sigma, theta), cv2.filter2D(gray, cv2.CV_32F, gabor_kernel(sigma, theta))
+        return
+    if method != 'fft':
+        raise ValueError(f"Unknown Gabor method: {method}")
+    # Only the 'fft' method needs SciPy, imported on first use to keep worker start-up fast
+    import scipy.fft
+    # Same reflect-101 border as filter2D, and enough zero padding that the circular convolution doesn't wrap
+    r = GABOR_KSIZE[0] // 2
+    padded = cv2.copyMakeBorder(gray, r, r, r, r, cv2.BORDER_REFLECT_101).astype(np.float32)
+    shape = (cv2.getOptimalDFTSize(padded.shape[0] + 2 * r), cv2.getOptimalDFTSize(padded.shape[1] + 2 * r))
+    spectrum = scipy.fft.rfft2(padded, shape)
+    height, width = gray.shape
+    for sigma, theta in gabor_bank():
+        full = scipy.fft.irfft2(spectrum * _gabor_kernel_spectrum(sigma, theta, shape), shape)
+        yield (sigma, theta), full[2 * r:2 * r + height, 2 * r:2 * r + width]
+
+def gabor_statistics(gray, method=None, max_side=None):
+    """
+    Filter the image once with every kernel of the bank and keep only what the descriptors need.
+
+    :param method: 'direct' or 'fft' (defaults to GABOR_METHOD)
+    :param max_side: Filter a pyramid level no larger than this (defaults to GABOR_MAX_SIDE, 0 = full resolution)
+    :return: {(sigma, theta): (mean of the 8-bit saturated response, sum of squared float response)}
+    """
+    max_side = GABOR_MAX_SIDE if max_side is None else max_side
+    while max_side and max(gray.shape) > max_side:
+        gray = cv2.pyrDown(gray)
+    stats = {}
+    for key, response in _gabor_responses(gray, method or GABOR_METHOD):
+        # Saturating the float response reproduces filter2D with an 8-bit destination
+        stats[key] = (np.mean(np.clip(np.rint(response), 0, 255).astype(np.uint8)), np.sum(response ** 2))
+    return stats
+
+def gabor_descriptors(gray, stats=None):
+    stats = stats or gabor_statistics(gray)
+    responses = np.array([stats[key][0] for key in gabor_bank()])
     epsilon = 1e-10
     return (responses - np.min(responses)) / (np.max(responses) - np.min(responses)+epsilon)  # Min-max normalization
 
-def calculate_hu_moments(image_path):
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    moments = cv2.moments(img)
+def hu_moments(gray):
+    moments = cv2.moments(gray)
     hu_moments = cv2.HuMoments(moments).flatten()
     hu_moments = -np.sign(hu_moments) * np.log10(np.abs(hu_moments))  # Log transform for scale invariance
     epsilon = 1e-10
     hu_moments = (hu_moments - np.min(hu_moments)) / (np.max(hu_moments) - np.min(hu_moments) + epsilon)  # Min-max normalization
     return hu_moments.tolist()
 
-def calculate_texture_energy(image_path): 
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    energy = []
-    for angle in [0, np.pi/4, np.pi/2, 3*np.pi/4]:  # Different orientations
-        kernel = cv2.getGaborKernel((21, 21), 3, angle, 10, 0.5, 0, ktype=cv2.CV_32F)
-        filtered_img = cv2.filter2D(img, cv2.CV_32F, kernel)
-        energy.append(np.sum(filtered_img ** 2))
+def texture_energy(gray, stats=None):
+    stats = stats or gabor_statistics(gray)
+    energy = [stats[(TEXTURE_SIGMA, theta)][1] for theta in GABOR_THETAS]  # Different orientations
     return normalize(energy).tolist()
 
-def calculate_circularity(image_path):
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    _, binary = cv2.threshold(img, 127, 255, cv2.THRESH_BINARY)
+def circularity(gray):
+    _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
     contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     largest_contour = max(contours, key=cv2.contourArea) if contours else None
     if largest_contour is not None:
@@ -70,4 +203,24 @@ def calculate_circularity(image_path):
         if perimeter > 0:
             circularity = 4 * np.pi * (area / (perimeter ** 2))
             return normalize([circularity])[0]
-    return 0  # If no contour is found
\ No newline at end of file
+    return 0  # If no contour is found
+
+# Per-path wrappers, kept for callers that only need one descriptor
+
+def calculate_color_histogram(image_path):
+    return color_histogram(cv2.imread(image_path))
+
+def find_dominant_colors(image_path, k=8, threshold=0.05, mode=None):
+    return dominant_colors(cv2.imread(image_path), k, threshold, mode)
+
+def calculate_gabor_descriptors(image_path):
+    return gabor_descriptors(cv2.imread(image_path, cv2.IMREAD_GRAYSCALE))
+
+def calculate_hu_moments(image_path):
+    return hu_moments(cv2.imread(image_path, cv2.IMREAD_GRAYSCALE))
+
+def calculate_texture_energy(image_path):
+    return texture_energy(cv2.imread(image_path, cv2.IMREAD_GRAYSCALE))
+
+def calculate_circularity(image_path):
+    return circularity(cv2.imread(image_path, cv2.IMREAD_GRAYSCALE))
@@ -0,0 +1,162 @@
+"""
+Bulk descriptor ingestion: walk static/dataset/<category>/*.jpg, extract the six descriptors
+across a process pool and write them to the descriptor collection in batches.
+
+    python ingest.py --workers 8 --batch-size 200
+"""
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+from pymongo import DeleteMany, InsertOne, MongoClient
+from threadpoolctl import threadpool_limits
+
+from descriptor_index import mark_collection_changed
+from image_utils import extract_descriptors
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_DIR = os.path.join(BASE_DIR, "static", "dataset")
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def iter_dataset(dataset_dir):
+    """Yield (category, image_name, path) for every image under dataset_dir/<category>/."""
+    for category in sorted(os.listdir(dataset_dir)):
+        category_dir = os.path.join(dataset_dir, category)
+        if not os.path.isdir(category_dir):
+            continue
+        for image_name in sorted(os.listdir(category_dir)):
+            if image_name.lower().endswith(IMAGE_EXTENSIONS):
+                yield category, image_name, os.path.join(category_dir, image_name)
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 of the file contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _init_worker():
+    # One process per core already; keep OpenCV and KMeans from spawning their own thread pools on top
+    cv2.setNumThreads(1)
+    threadpool_limits(1)
+
+
+def extract_document(task):
+    """
+    Compute the descriptor document for one image (runs in a worker process)
+
+    :param task: (category, image_name, path, content_hash)
+    :return: (document, None) on success or (None, error message)
+    """
+    category, image_name, path, content_hash = task
+    try:
+        img = cv2.imread(path)
+        if img is None:
+            raise ValueError("could not read image")
+        return {
+            'category': category,
+            'image_name': image_name,
+            'content_hash': content_hash,
+            **extract_descriptors(img),
+        }, None
+    except Exception as e:
+        return None, f"{category}/{image_name}: {e}"
+
+
+def write_batch(collection, documents):
+    """
+    Write one batch of documents with a single bulk_write. Older documents for the same
+    (category, image_name) are deleted and re-inserted rather than replaced, so the new
+    documents get fresh _ids, and the write counter is bumped so that running
+    DescriptorIndex instances notice the change.
+    """
+    operations = [DeleteMany({'category': doc['category'], 'image_name': doc['image_name']}) for doc in documents]
+    operations += [InsertOne(doc) for doc in documents]
+    collection.bulk_write(operations, ordered=True)
+    mark_collection_changed(collection)
+
+
+def ingest_dataset(collection, dataset_dir=DATASET_DIR, workers=None, batch_size=100, report_every=200):
+    """
+    Index every image under dataset_dir that is not already in the collection under the same
+    (category, image_name) with the same contents: renamed, moved or duplicated files are
+    indexed under their own name, changed files are re-indexed
+
+    :param collection: Descriptor collection (pymongo, or mongomock in tests)
+    :param dataset_dir: Directory laid out as <category>/<image files>
+    :param workers: Number of extraction processes (defaults to all cores)
+    :param batch_size: Documents per bulk write
+    :param report_every: Print progress every this many images
+    :return: Dictionary of counts and throughput
+    """
+    collection.create_index('content_hash')
+    indexed = {(doc.get('category'), doc.get('image_name'), doc.get('content_hash'))
+               for doc in collection.find({}, projection={'_id': 0, 'category': 1, 'image_name': 1, 'content_hash': 1})}
+
+    tasks, skipped = [], 0
+    for category, image_name, path in iter_dataset(dataset_dir):
+        content_hash = file_hash(path)
+        if (category, image_name, content_hash) in indexed:
+            skipped += 1
+            continue
+        tasks.append((category, image_name, path, content_hash))
+    print(f"{len(tasks)} images to index, {skipped} already indexed")
+
+    start = time.perf_counter()
+    indexed, failed, batch = 0, 0, []
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        chunksize = max(1, min(16, len(tasks) // (workers * 4)))
+        for doc, error in pool.map(extract_document, tasks, chunksize=chunksize):
+            if error:
+                failed += 1
+                print(f"Failed to extract descriptors for {error}")
+                continue
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                write_batch(collection, batch)
+                indexed += len(batch)
+                batch = []
+            done = indexed + len(batch) + failed
+            if done % report_every == 0:
+                print(f"{done}/{len(tasks)} images, {done / (time.perf_counter() - start):.1f} images/s")
+        if batch:
+            write_batch(collection, batch)
+            indexed += len(batch)
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        'indexed': indexed,
+        'skipped': skipped,
+        'failed': failed,
+        'seconds': round(elapsed, 2),
+        'images_per_second': round(indexed / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    print(f"Indexed {indexed} images in {elapsed:.1f}s ({stats['images_per_second']} images/s), "
+          f"{skipped} skipped, {failed} failed")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract descriptors for the image dataset and store them in MongoDB")
+    parser.add_argument('--dataset', default=DATASET_DIR, help="Dataset directory laid out as <category>/<images>")
+    parser.add_argument('--mongo-uri', default="mongodb://127.0.0.1:27017/")
+    parser.add_argument('--db', default='ImageMatch')
+    parser.add_argument('--collection', default='image_descriptors2')
+    parser.add_argument('--workers', type=int, default=None, help="Extraction processes (default: all cores)")
+    parser.add_argument('--batch-size', type=int, default=100, help="Documents per bulk write")
+    args = parser.parse_args()
+
+    collection = MongoClient(args.mongo_uri)[args.db][args.collection]
+    ingest_dataset(collection, args.dataset, workers=args.workers, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+FINISHED_STATUSES = ('done', 'failed')
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while max_pending jobs are already in flight."""
+
+
+# Set in pool worker processes: each job a worker starts is reported on it (see JobQueue.pool_options)
+_started_queue = None
+
+
+def init_worker(started_queue, initializer=None):
+    global _started_queue
+    _started_queue = started_queue
+    if initializer is not None:
+        initializer()
+
+
+def timed_call(job_id, func, *args):
+    """Run func in a worker process and report when it started and how long it took."""
+    started = time.time()
+    if _started_queue is not None:
+        _started_queue.put(job_id)
+    start = time.perf_counter()
+    result = func(*args)
+    return result, started, time.perf_counter() - start
+
+
+class Job:
+    def __init__(self, job_id):
+        """
+        State of one queued upload, updated by the queue and read by /jobs/<id>
+
+        :param job_id: Identifier returned to the client
+        """
+        self.id = job_id
+        self.status = 'queued'
+        self.submitted = time.time()
+        self.timings = {}
+        self.result = None
+        self.error = None
+        self.revision = 0
+        self.changed = threading.Condition()
+
+    def set_status(self, status, result=None, error=None):
+        with self.changed:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.revision += 1
+            self.changed.notify_all()
+
+    def start(self):
+        """Mark the job running if it is still queued (a worker and the finishing stage may both report it)."""
+        with self.changed:
+            if self.status == 'queued':
+                self.set_status('running')
+
+    @contextmanager
+    def stage(self, name):
+        """Record the wall time of a pipeline stage in the job's timings."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round(time.perf_counter() - start, 4)
+
+    def to_dict(self):
+        data = {'job_id': self.id, 'status': self.status, 'timings': dict(self.timings)}
+        if self.status == 'done':
+            data['result'] = self.result
+        if self.status == 'failed':
+            data['error'] = self.error
+        return data
+
+    def events(self, keepalive=15):
+        """Server-sent event stream: one 'data:' message per status change until the job finishes."""
+        seen = None
+        while True:
+            with self.changed:
+                if self.revision == seen:
+                    self.changed.wait(keepalive)
+                revision, data = self.revision, self.to_dict()
+            if revision == seen:
+                yield ": keep-alive\n\n"
+                continue
+            seen = revision
+            yield f"data: {json.dumps(data)}\n\n"
+            if data['status'] in FINISHED_STATUSES:
+                return
+
+
+class JobQueue:
+    def __init__(self, get_pool, max_pending=32, max_jobs=1000, finish_workers=2):
+        """
+        Bounded queue of two-stage jobs: a CPU-bound stage in a process pool, then a finishing
+        stage (e.g. ranking) in a small thread pool of the web process
+
+        :param get_pool: Callable returning the process pool for the CPU-bound stage
+        :param max_pending: Unfinished jobs allowed before submit raises QueueFull
+        :param max_jobs: Finished jobs kept for polling before the oldest are forgotten
+        :param finish_workers: Threads running the finishing stage
+        """
+        self.get_pool = get_pool
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self._finish_pool = ThreadPoolExecutor(max_workers=finish_workers, thread_name_prefix='job-finish')
+        self._jobs = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._started = None
+
+    def submit(self, process_stage, process_func, args, finish_func):
+        """
+        Queue a job
+
+        :param process_stage: Timing name of the process-pool stage
+        :param process_func: Picklable function run in the process pool, or None to skip that stage
+        :param args: Arguments for process_func (or the value passed on when it is None)
+        :param finish_func: Called as finish_func(process_result, job) in a thread; its return value is the job result
+        :return: The new Job
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} jobs already pending")
+            self._pending += 1
+            job = Job(uuid.uuid4().hex)
+            self._jobs[job.id] = job
+            self._forget_finished()
+
+        if process_func is None:
+            self._finish_pool.submit(self._finish, job, args, finish_func)
+            return job
+        try:
+            future = self.get_pool().submit(timed_call, job.id, process_func, *args)
+        except Exception as e:
+            self._fail(job, e)
+            raise
+        future.add_done_callback(lambda f: self._finish_pool.submit(self._complete, job, process_stage, f, finish_func))
+        return job
+
+    def _complete(self, job, process_stage, future, finish_func):
+        try:
+            value, started, elapsed = future.result()
+        except Exception as e:
+            self._fail(job, e)
+            return
+        job.timings['queue_wait'] = round(max(started - job.submitted, 0), 4)
+        job.timings[process_stage] = round(elapsed, 4)
+        self._finish(job, value, finish_func)
+
+    def pool_options(self, mp_context, initializer=None):
+        """
+        initializer/initargs for the process pool returned by get_pool, so that a job is reported
+        running as soon as a worker picks it up rather than when its finishing stage starts.
+        The queue is created on first use, in the process that serves the jobs.
+
+        :param initializer: Picklable function each worker also runs once at startup (optional)
+        """
+        with self._lock:
+            if self._started is None:
+                self._started = mp_context.SimpleQueue()
+                threading.Thread(target=self._watch_started, name='job-started', daemon=True).start()
+        return {'initializer': init_worker, 'initargs': (self._started, initializer)}
+
+    def _watch_started(self):
+        while True:
+            job = self._jobs.get(self._started.get())
+            if job is not None:
+                job.start()
+
+    def _finish(self, job, value, finish_func):
+        job.start()
+        try:
+            result = finish_func(value, job)
+        except Exception as e:
+            self._fail(job, e)
+            return
+        self._release()
+        job.set_status('done', result=result)
+
+    def _fail(self, job, error):
+        self._release()
+        job.set_status('failed', error=str(error))
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _forget_finished(self):
+        while len(self._jobs) > self.max_jobs:
+            oldest = next((job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATUSES), None)
+            if oldest is None:
+                return
+            del self._jobs[oldest]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {'pending': self._pending, 'max_pending': self.max_pending, 'jobs': len(self._jobs)}
@@ -0,0 +1,148 @@
+"""
+Per-stage timing of the search pipeline, exported in the Prometheus text format.
+
+    with stage('decode'):
+        img = decode_image(data)
+
+Every stage duration is observed into the imagematch_stage_seconds histogram and, while a
+request is being timed (begin_request/end_request), also added to that request's timings,
+which app.py can send back as a Server-Timing header.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Seconds; stages range from sub-millisecond dot products to multi-second KMeans on large uploads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+        Cumulative-bucket histogram, one series per combination of label values
+
+        :param label_names: Names of the labels passed to observe()
+        :param buckets: Upper bounds in increasing order (+Inf is implicit)
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for label_values, (counts, total) in sorted(series.items()):
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        """Histograms plus gauges/counters read from callbacks at scrape time."""
+        self.histograms = OrderedDict()
+        self.callbacks = OrderedDict()
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, documentation, label_names, buckets)
+        return self.histograms[name]
+
+    def register_callback(self, name, documentation, func, metric_type='gauge', label_name=None):
+        """
+        Metric whose value(s) are read when /metrics is scraped
+
+        :param func: Returns a number, or a {label value: number} dict when label_name is given
+        :param metric_type: 'gauge' or 'counter'
+        """
+        self.callbacks[name] = (documentation, func, metric_type, label_name)
+
+    def render(self):
+        lines = []
+        for histogram in self.histograms.values():
+            lines.extend(histogram.render())
+        for name, (documentation, func, metric_type, label_name) in self.callbacks.items():
+            try:
+                value = func()
+            except Exception:
+                # A failing source (e.g. MongoDB down) must not break the whole scrape
+                continue
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if label_name is None:
+                lines.append(f"{name} {value}")
+            else:
+                for label_value, number in value.items():
+                    lines.append(f"{name}{_format_labels([(label_name, label_value)])} {number}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+stage_seconds = registry.histogram('imagematch_stage_seconds', "Duration of one pipeline stage", ['stage'])
+request_seconds = registry.histogram('imagematch_request_seconds', "Duration of an HTTP request", ['endpoint', 'status'])
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage into the stage histogram and the current request's timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def begin_request():
+    """Start collecting stage timings for the current request (thread/context)."""
+    _request_timings.set(OrderedDict())
+
+
+def end_request():
+    """Stop collecting and return {stage: seconds} for the current request."""
+    timings = _request_timings.get()
+    _request_timings.set(None)
+    return timings or {}
+
+
+def server_timing_header(timings):
+    """Server-Timing header value, durations in milliseconds."""
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
+
+
+def render_latest():
+    return registry.render()
@@ -0,0 +1,30 @@
+import threading
+
+from pymongo import monitoring
+
+
+class RoundTripCounter(monitoring.CommandListener):
+    """
+    Counts the MongoDB commands (round-trips) issued by each thread, so a request handler can
+    report how many it made. Pass it to MongoClient(event_listeners=[...]).
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+    def started(self, event):
+        # Commands of the synchronous driver are started on the calling thread
+        self._local.count = self.count + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
@@ -0,0 +1,68 @@
+import hashlib
+import threading
+
+from cachetools import LRUCache, TTLCache
+
+
+def content_hash(data):
+    """SHA-256 hex digest of the raw image bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class CountingCache:
+    def __init__(self, maxsize, ttl=None):
+        """
+        Thread-safe LRU (or LRU + TTL) cache with hit/miss counters
+
+        :param maxsize: Maximum number of entries
+        :param ttl: Seconds before an entry expires (optional)
+        """
+        self._cache = TTLCache(maxsize, ttl) if ttl else LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def ensure_generation(self, generation):
+        """
+        Drop every entry if the data the cached values were computed from has changed
+
+        :param generation: Any comparable stamp, e.g. (index version, weights version)
+        """
+        with self._lock:
+            if generation != self._generation:
+                self._cache.clear()
+                self._generation = generation
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._cache),
+                'maxsize': self._cache.maxsize,
+            }
+
+
+# Query descriptors keyed by content hash, so re-uploads and feedback rounds skip extraction
+descriptor_cache = CountingCache(maxsize=256, ttl=3600)
+
+# Ranked results keyed by (content hash, weights version, top_k), for the current index and weights only
+result_cache = CountingCache(maxsize=1024, ttl=600)
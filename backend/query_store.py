@@ -0,0 +1,227 @@
+"""
+Per-query state shared between /save-image and the relevance feedback rounds that follow it.
+
+Every upload gets a query id; its descriptors and last result set are kept in an in-memory
+LRU. With a spill_dir, every entry is also written through as JSON on create and update and
+kept there until spill_ttl expires, so a feedback round finds its query after it was evicted,
+after a restart, or in another worker process, without re-extracting anything.
+
+The per-feature distance matrix of a query (N images x 6 features) is kept apart from the entry,
+in an LRU bounded by bytes rather than entries, and is never spilled: a query whose matrix was
+dropped recomputes it on its next feedback round.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+QUERY_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+# Fields written when an entry is spilled to disk
+SPILLED_FIELDS = ('descriptors', 'query_hash', 'results', 'created', 'updated')
+
+
+class QueryStore:
+    def __init__(self, maxsize=256, spill_dir=None, spill_ttl=24 * 3600, max_distance_bytes=256 * 1024 * 1024):
+        """
+        LRU of query entries with optional on-disk spill
+
+        :param maxsize: Entries kept in memory
+        :param spill_dir: Directory every entry is written through to (None keeps them in memory only)
+        :param spill_ttl: Seconds an entry is kept on disk after its last update
+        :param max_distance_bytes: Memory held by the distance matrices of all queries together
+        """
+        self.maxsize = maxsize
+        self.spill_dir = spill_dir
+        self.spill_ttl = spill_ttl
+        self.max_distance_bytes = max_distance_bytes
+        self._entries = OrderedDict()
+        self._distances = OrderedDict()
+        self._distance_bytes = 0
+        # mtime of the spill file this process last wrote or read for each entry in memory
+        self._file_mtimes = {}
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+        self.spilled = 0
+        self.restored = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def create(self, descriptors, query_hash=None, results=None):
+        """
+        Store a new query
+
+        :param descriptors: Descriptor dict of the query image
+        :param query_hash: Content hash of the image bytes (optional)
+        :param results: Result list returned for the query (optional)
+        :return: The new query id
+        """
+        query_id = uuid.uuid4().hex
+        now = time.time()
+        entry = {'descriptors': descriptors, 'query_hash': query_hash, 'results': results, 'created': now, 'updated': now}
+        self._write(query_id, entry)
+        with self._lock:
+            self._entries[query_id] = entry
+            self._evict()
+        self._prune_spill()
+        return query_id
+
+    def get(self, query_id):
+        """
+        Look up a query, reading it from the spill directory if it is not in memory or
+        another process updated it since
+
+        :return: The entry dict, or None for an unknown or expired query id
+        """
+        if not query_id or not QUERY_ID_PATTERN.fullmatch(query_id):
+            return None
+        with self._lock:
+            entry = self._entries.get(query_id)
+            if entry is not None:
+                self._entries.move_to_end(query_id)
+        if entry is not None and not self._written_elsewhere(query_id):
+            return entry
+        restored = self._restore(query_id)
+        if restored is None:
+            return entry
+        with self._lock:
+            current = self._entries.get(query_id)
+            if current is not None and current['updated'] >= restored['updated']:
+                restored = current
+            else:
+                self._entries[query_id] = restored
+            self._entries.move_to_end(query_id)
+            self._evict()
+        return restored
+
+    def update(self, query_id, **fields):
+        """
+        Replace fields of an existing entry, e.g. update(query_id, results=matches)
+
+        :return: False if the query id is unknown
+        """
+        entry = self.get(query_id)
+        if entry is None:
+            return False
+        with self._lock:
+            entry.update(fields)
+            entry['updated'] = time.time()
+        self._write(query_id, entry)
+        return True
+
+    def get_distances(self, query_id, version):
+        """
+        Distance matrix of a query computed against the given index version
+
+        :return: The matrix, or None if it was never stored, was dropped or is of another version
+        """
+        with self._lock:
+            cached = self._distances.get(query_id)
+            if cached is None or cached[0] != version:
+                return None
+            self._distances.move_to_end(query_id)
+            return cached[1]
+
+    def set_distances(self, query_id, version, distances):
+        """Keep a query's distance matrix, dropping the least recently used ones beyond max_distance_bytes."""
+        with self._lock:
+            self._drop_distances(query_id)
+            if query_id not in self._entries or distances.nbytes > self.max_distance_bytes:
+                return
+            self._distances[query_id] = (version, distances)
+            self._distance_bytes += distances.nbytes
+            while self._distance_bytes > self.max_distance_bytes:
+                self._drop_distances(next(iter(self._distances)))
+
+    def _drop_distances(self, query_id):
+        # Called with the lock held
+        cached = self._distances.pop(query_id, None)
+        if cached is not None:
+            self._distance_bytes -= cached[1].nbytes
+
+    def _evict(self):
+        # Called with the lock held; entries are already on disk when there is a spill directory
+        while len(self._entries) > self.maxsize:
+            query_id, _ = self._entries.popitem(last=False)
+            self._drop_distances(query_id)
+            self._file_mtimes.pop(query_id, None)
+
+    def _path(self, query_id):
+        return os.path.join(self.spill_dir, f"{query_id}.json")
+
+    def _write(self, query_id, entry):
+        if not self.spill_dir:
+            return
+        with self._lock:
+            payload = {field: entry.get(field) for field in SPILLED_FIELDS}
+        spilled = tempfile.NamedTemporaryFile('w', dir=self.spill_dir, prefix='.spill-', delete=False)
+        with spilled:
+            json.dump(payload, spilled)
+        os.replace(spilled.name, self._path(query_id))
+        mtime = os.stat(self._path(query_id)).st_mtime_ns
+        with self._lock:
+            self._file_mtimes[query_id] = mtime
+            self.spilled += 1
+
+    def _written_elsewhere(self, query_id):
+        # Another worker process sharing the spill directory rewrote the entry since this process last saw it
+        if not self.spill_dir:
+            return False
+        try:
+            mtime = os.stat(self._path(query_id)).st_mtime_ns
+        except OSError:
+            return False
+        with self._lock:
+            return mtime != self._file_mtimes.get(query_id)
+
+    def _restore(self, query_id):
+        if not self.spill_dir:
+            return None
+        path = self._path(query_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if time.time() - mtime / 1e9 > self.spill_ttl:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._file_mtimes[query_id] = mtime
+            self.restored += 1
+        return entry
+
+    def _prune_spill(self):
+        # Expired files are also removed when read; a full scan at most once a minute is enough
+        if not self.spill_dir or time.time() - self._last_prune < 60:
+            return
+        self._last_prune = time.time()
+        cutoff = time.time() - self.spill_ttl
+        for entry in os.scandir(self.spill_dir):
+            try:
+                if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'distance_matrices': len(self._distances),
+                'distance_bytes': self._distance_bytes,
+                'max_distance_bytes': self.max_distance_bytes,
+                'spilled': self.spilled,
+                'restored': self.restored,
+                'spill_dir': self.spill_dir,
+            }
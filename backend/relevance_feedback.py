@@ -1,57 +1,89 @@
-import json
-import os
+import threading
 import numpy as np
+from feedback_log import FeedbackLog
+from weights_store import DEFAULT_WEIGHTS, WeightsStore, default_weights_store
 
 class RelevanceFeedbackManager:
-    def __init__(self, weights_file='weights_config.json', learning_rate=0.1):
+    def __init__(self, weights_file=None, learning_rate=0.1, weights_store=None, feedback_log=None):
         """
         Initialize the Relevance Feedback Manager
         
-        :param weights_file: Path to store/load feature weights
+        :param weights_file: Path to store/load feature weights (optional, defaults to the shared store's file)
         :param learning_rate: Learning rate for weight updates
+        :param weights_store: WeightsStore to read and publish weights through (optional)
+        :param feedback_log: FeedbackLog recording every round (optional, defaults to feedback_log.jsonl)
         """
-        self.weights_file = weights_file
+        if weights_store is None:
+            weights_store = WeightsStore(weights_file) if weights_file else default_weights_store
+        self.weights_store = weights_store
+        self.weights_file = weights_store.weights_file
         self.learning_rate = learning_rate
+        self.default_weights = DEFAULT_WEIGHTS
         
-        
-        
-        # Load existing weights or use defaults
-        self.current_weights = self.load_weights()
-        
-        # History to track weight changes
-        self.weights_history = []
+        # Every round is appended to the feedback log; the history is its snapshot plus log tail
+        self.feedback_log = feedback_log or FeedbackLog()
+        self.weights_history = self.feedback_log.load()
+        # Rounds read and write the same weights, so they are applied one at a time
+        self._update_lock = threading.Lock()
+
+    @property
+    def current_weights(self):
+        """
+        Copy of the weights in the store's current snapshot
+        """
+        return dict(self.weights_store.snapshot().weights)
 
     def load_weights(self):
         """
-        Load weights from a JSON file or return default weights
+        Reload weights from the JSON file, or the defaults if it is missing
         
         :return: Dictionary of feature weights
         """
-        try:
-            if os.path.exists(self.weights_file):
-                with open(self.weights_file, 'r') as f:
-                    return json.load(f)
-            return self.default_weights.copy()
-        except (FileNotFoundError, json.JSONDecodeError):
-            return self.default_weights.copy()
+        return dict(self.weights_store.reload().weights)
 
     def save_weights(self, weights):
         """
-        Save weights to a JSON file
+        Save weights to the JSON file and publish them to every reader of the store
         
         :param weights: Dictionary of feature weights to save
         """
-        with open(self.weights_file, 'w') as f:
-            json.dump(weights, f, indent=4)
+        self.weights_store.update(weights)
 
-    def update_weights(self, query_descriptors, feedback_data):
+    def update_weights(self, query_descriptors, feedback_data, query_id=None):
         """
         Update feature weights based on user feedback
         
         :param query_descriptors: Descriptors of the query image
         :param feedback_data: List of feedback items with image details and feedback
+        :param query_id: Stored query the feedback is about, recorded in the feedback log (optional)
         :return: Updated weights dictionary
         """
+        # The log's file lock also serializes the rounds of other worker processes, and the weights are
+        # re-read under it, so a round never overwrites weights another worker saved in the meantime
+        with self._update_lock, self.feedback_log.locked():
+            self.weights_store.reload()
+            previous_weights = self.current_weights
+            updated_weights = self.propose_weights(query_descriptors, feedback_data)
+            
+            # Save updated weights, which also makes them the current weights
+            self.save_weights(updated_weights)
+            
+            # Record the round and update history
+            self.feedback_log.append(previous_weights, updated_weights, feedback_data, query_id=query_id)
+            self.weights_history.append(updated_weights.copy())
+            if self.feedback_log.max_history:
+                del self.weights_history[:-self.feedback_log.max_history]
+        
+        return updated_weights
+
+    def propose_weights(self, query_descriptors, feedback_data):
+        """
+        Compute the weights update_weights would apply, without saving them
+        
+        :param query_descriptors: Descriptors of the query image
+        :param feedback_data: List of feedback items with image details and feedback
+        :return: Candidate weights dictionary
+        """
         # Create a copy of current weights to modify
         updated_weights = self.current_weights.copy()
         
@@ -92,13 +124,6 @@ class RelevanceFeedbackManager:
         # Normalize weights to ensure they sum to 1
         self._normalize_weights(updated_weights)
         
-        # Save updated weights
-        self.save_weights(updated_weights)
-        
-        # Update current weights and history
-        self.current_weights = updated_weights
-        self.weights_history.append(updated_weights.copy())
-        
         return updated_weights
 
     def _compute_feature_contribution(self, query_descriptors, image_descriptors, feature):
@@ -145,15 +170,13 @@ class RelevanceFeedbackManager:
 
     def save_feedback_history(self):
         """
-        Save the history of weight updates to a file
+        Compact the feedback log into its snapshot once enough rounds have been appended
+        (each round is already on disk as soon as update_weights returns)
         """
-        history_file = 'weights_history.json'
-        with open(history_file, 'w') as f:
-            json.dump(self.weights_history, f, indent=4)
+        self.feedback_log.compact_if_due()
 
     def reset_weights(self):
         """
         Reset weights to default configuration
         """
-        self.current_weights = self.default_weights.copy()
-        self.save_weights(self.current_weights)
\ No newline at end of file
+        self.save_weights(self.default_weights.copy())
\ No newline at end of file
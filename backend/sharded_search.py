@@ -0,0 +1,154 @@
+"""
+Exhaustive search split across CPU cores.
+
+The rows of the current descriptor store export are cut into contiguous shards. Each shard is
+scored in a worker process of a pool, against the same memory-mapped arrays (np.load with
+mmap_mode='r'), so the workers share the page cache instead of holding copies. A worker returns
+the local top_k of its shard as (score, row) pairs, and the parent merges them into the global
+top_k. Ties are broken by row position, so the result is the one DescriptorIndex.search gives.
+
+    SEARCH_BACKEND=sharded SEARCH_SHARDS=4 python app.py
+"""
+import heapq
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from descriptor_index import feature_distances, top_k_indices
+from metrics import stage
+from similarity import weights_vector
+
+logger = logging.getLogger(__name__)
+
+# Below this many rows per shard, process start-up and pickling cost more than the scoring saved
+MIN_SHARD_ROWS = 20000
+
+# Worker-side cache: (store_dir, version) -> IndexData of the whole export, memory-mapped
+_worker_exports = {}
+
+
+def _worker_export(store_dir, version):
+    import descriptor_store
+    key = (store_dir, version)
+    data = _worker_exports.get(key)
+    if data is None:
+        data = descriptor_store.load_index_data(version, store_dir)
+        if data is None:
+            raise LookupError(f"Descriptor store export {version} not found in {store_dir}")
+        # Only the newest export is kept open; a refresh moves every worker to the next one
+        _worker_exports.clear()
+        _worker_exports[key] = data
+    return data
+
+
+def shard_rows(data, start, stop):
+    """IndexData of rows [start, stop) as views of the (memory-mapped) arrays; keys are left out."""
+    return data._replace(keys=range(start, stop), **{
+        name: getattr(data, name)[start:stop] for name in data._fields if name != 'keys'
+    })
+
+
+def score_shard(store_dir, version, start, stop, queries, weight_vector, top_k):
+    """
+    Local top_k of rows [start, stop) for each query, run in a worker process
+
+    :return: One list of (score, row) per query, rows numbered in the whole export
+    """
+    shard = shard_rows(_worker_export(store_dir, version), start, stop)
+    results = []
+    for query in queries:
+        scores = feature_distances(query, shard) @ weight_vector
+        results.append([(float(scores[row]), start + int(row)) for row in top_k_indices(scores, top_k)])
+    return results
+
+
+def merge_top_k(shard_results, top_k):
+    """Global top_k of per-shard (score, row) lists, each already sorted."""
+    return list(heapq.merge(*shard_results))[:top_k]
+
+
+class ShardedSearch:
+    def __init__(self, descriptor_index, shards=None, min_shard_rows=MIN_SHARD_ROWS):
+        """
+        Same search interface as DescriptorIndex, scoring shards of its descriptor store export in parallel
+
+        :param descriptor_index: DescriptorIndex with a store_dir; it stays in charge of refreshing
+        :param shards: Number of shards and worker processes (defaults to the number of CPUs)
+        :param min_shard_rows: Collections smaller than this per shard use fewer shards
+        """
+        self.descriptor_index = descriptor_index
+        self.shards = max(1, shards or os.cpu_count() or 1)
+        self.min_shard_rows = min_shard_rows
+        self._pool = None
+        self._keys = (None, None)
+
+    def _get_pool(self):
+        # Spawned, like the extraction pool: forking a threaded Flask process is unsafe
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.shards, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _export_keys(self, version):
+        # Keys are read from the export itself, so they always match the rows the workers scored
+        import descriptor_store
+        cached_version, keys = self._keys
+        if cached_version != version:
+            data = descriptor_store.load_index_data(version, self.descriptor_index.store_dir)
+            if data is None:
+                return None
+            keys = data.keys
+            self._keys = (version, keys)
+        return keys
+
+    def shard_bounds(self, count):
+        """[(start, stop)] of the shards used for count rows."""
+        shards = max(1, min(self.shards, math.ceil(count / max(self.min_shard_rows, 1))))
+        step = math.ceil(count / shards) if count else 0
+        return [(start, min(start + step, count)) for start in range(0, count, step or 1)]
+
+    def search_many(self, queries, weights, top_k=10):
+        """
+        Rank every indexed image against each query, one pool task per shard
+
+        :return: One result list (as returned by DescriptorIndex.search) per query
+        """
+        if not queries:
+            return []
+        index = self.descriptor_index
+        version = index.store_version
+        keys = self._export_keys(version) if version is not None else None
+        bounds = self.shard_bounds(len(keys)) if keys is not None else []
+        if len(bounds) <= 1:
+            # Not exported (no store_dir) or too small to be worth the round trip to the workers
+            return index.search_many(queries, weights, top_k)
+
+        weight_vector = weights_vector(weights)
+        with stage('score'):
+            futures = [self._get_pool().submit(score_shard, index.store_dir, version, start, stop,
+                                               queries, weight_vector, top_k)
+                       for start, stop in bounds]
+            per_shard = [future.result() for future in futures]
+        with stage('sort'):
+            return [[{
+                'category': keys[row][0],
+                'image_name': keys[row][1],
+                'similarity_score': score,
+            } for score, row in merge_top_k([shard[q] for shard in per_shard], top_k)] for q in range(len(queries))]
+
+    def search(self, query_descriptors, weights, top_k=10):
+        """
+        Rank every indexed image against the query.
+
+        :param query_descriptors: Descriptors of the query image
+        :param weights: Dictionary of feature weights
+        :param top_k: Number of results to return
+        :return: List of {'category', 'image_name', 'similarity_score'} sorted by score
+        """
+        return self.search_many([query_descriptors], weights, top_k)[0]
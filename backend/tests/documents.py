@@ -0,0 +1,16 @@
+import numpy as np
+
+
+def descriptor_document(category, image_name, seed):
+    """Descriptor document with random values, shaped like the ones ingest stores."""
+    rng = np.random.default_rng(seed)
+    return {
+        'category': category,
+        'image_name': image_name,
+        'histogram': {color: rng.random(256).tolist() for color in ('b', 'g', 'r')},
+        'dominant_colors': rng.random((3, 3)).tolist(),
+        'gabor_descriptors': rng.random(8).tolist(),
+        'hu_moments': rng.random(7).tolist(),
+        'texture_energy': rng.random(4).tolist(),
+        'circularity': float(rng.random()),
+    }
@@ -0,0 +1,29 @@
+import os
+import stat
+
+import cv2
+import numpy as np
+
+from artifact_cache import ArtifactCache, artifact_key, source_hash, thumbnail
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_artifacts_are_written_world_readable(tmp_path):
+    source = str(tmp_path / 'source.png')
+    cv2.imwrite(source, np.random.default_rng(0).integers(0, 256, size=(64, 64, 3), dtype=np.uint8))
+    cache = ArtifactCache(str(tmp_path / 'cache'), prefix='gabor_')
+    key = artifact_key(source_hash(source), 'copy')
+
+    filename = cache.get_or_create(key, '.png', lambda destination: cv2.imwrite(destination, cv2.imread(source)))
+    assert mode(tmp_path / 'cache' / filename) == 0o644
+
+    assert cache.get_or_create_json(key, lambda: {'value': 1}) == {'value': 1}
+    assert mode(tmp_path / 'cache' / cache.filename(key, '.json')) == 0o644
+
+    thumbnails = ArtifactCache(str(tmp_path / 'thumbnails'))
+    filename, _ = thumbnail(thumbnails, source, 32)
+    assert mode(tmp_path / 'thumbnails' / filename) == 0o644
+    assert not [name for name in os.listdir(tmp_path / 'cache') if name.startswith('.tmp-')]
@@ -0,0 +1,93 @@
+import threading
+
+import mongomock
+import numpy as np
+import pytest
+
+from descriptor_index import DescriptorIndex, mark_collection_changed, top_k_indices
+from documents import descriptor_document
+from similarity import compute_similarity_score
+from weights_store import DEFAULT_WEIGHTS
+
+
+def baseline_search(documents, query, weights, top_k):
+    """The per-document loop DescriptorIndex.search replaces: score each document, stable sort."""
+    scored = [(compute_similarity_score(query, doc, weights), doc['category'], doc['image_name'])
+              for doc in documents]
+    return sorted(scored, key=lambda result: result[0])[:top_k]
+
+
+@pytest.fixture
+def documents():
+    docs = [descriptor_document(('aGrass', 'bField')[i % 2], f"{i:03d}.jpg", i) for i in range(40)]
+    # Same descriptors as 003.jpg under other names: tied scores, ranked in collection order
+    docs += [descriptor_document('cIndustry', f"dup{i}.jpg", 3) for i in range(3)]
+    return docs
+
+
+@pytest.mark.parametrize('top_k', [1, 5, 12, 100])
+@pytest.mark.parametrize('weights', [DEFAULT_WEIGHTS, {feature: 1.0 for feature in DEFAULT_WEIGHTS}])
+def test_search_matches_baseline_loop(documents, top_k, weights):
+    collection = mongomock.MongoClient()['ImageMatch']['image_descriptors2']
+    collection.insert_many([dict(doc) for doc in documents])
+    index = DescriptorIndex(collection)
+    index.refresh()
+
+    for query in (descriptor_document('query', 'q.jpg', 1000), documents[3]):
+        expected = baseline_search(documents, query, weights, top_k)
+        results = index.search(query, weights, top_k=top_k)
+
+        assert [(r['category'], r['image_name']) for r in results] == [(c, n) for _, c, n in expected]
+        # Tolerance of bhattacharyya_distance_batch, reached when the query is itself indexed
+        np.testing.assert_allclose([r['similarity_score'] for r in results], [s for s, _, _ in expected],
+                                   rtol=1e-6, atol=2e-4 * weights['histogram'])
+
+
+def test_top_k_indices_breaks_ties_by_position():
+    scores = np.array([3.0, 1.0, 2.0, 1.0, 2.0, 0.5, 2.0])
+    for top_k in range(len(scores) + 2):
+        expected = sorted(range(len(scores)), key=lambda row: scores[row])[:top_k]
+        assert top_k_indices(scores, top_k).tolist() == expected
+
+
+def test_refresh_if_stale_sees_documents_updated_in_place(documents):
+    collection = mongomock.MongoClient()['ImageMatch']['image_descriptors2']
+    collection.insert_many([dict(doc) for doc in documents])
+    index = DescriptorIndex(collection)
+    index.refresh_if_stale()
+    version = index.version
+
+    index.refresh_if_stale()
+    assert index.version == version
+
+    query = descriptor_document('query', 'q.jpg', 1000)
+    collection.update_one({'image_name': '010.jpg'}, {'$set': {key: value for key, value in query.items()
+                                                               if key not in ('category', 'image_name')}})
+    mark_collection_changed(collection)
+    index.refresh_if_stale()
+
+    assert index.version == version + 1
+    assert index.search(query, DEFAULT_WEIGHTS, top_k=1)[0]['image_name'] == '010.jpg'
+
+
+def test_concurrent_refresh_if_stale_reloads_once(documents):
+    collection = mongomock.MongoClient()['ImageMatch']['image_descriptors2']
+    collection.insert_many([dict(doc) for doc in documents])
+    index = DescriptorIndex(collection)
+    reloads = []
+    index.refresh_listeners.append(reloads.append)
+
+    barrier = threading.Barrier(4)
+
+    def search():
+        barrier.wait()
+        index.refresh_if_stale()
+
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(reloads) == 1
+    assert index.version == 1
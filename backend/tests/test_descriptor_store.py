@@ -0,0 +1,30 @@
+import json
+import os
+
+import mongomock
+
+import descriptor_store
+from descriptor_index import DescriptorIndex
+from documents import descriptor_document
+from weights_store import DEFAULT_WEIGHTS
+
+
+def test_refresh_rebuilds_export_of_older_format(tmp_path):
+    collection = mongomock.MongoClient()['ImageMatch']['image_descriptors2']
+    collection.insert_many([descriptor_document('aGrass', f"a{i:03d}.jpg", i) for i in range(5)])
+    index = DescriptorIndex(collection, store_dir=str(tmp_path))
+
+    # Format-1 export left on disk under the stamp of the current collection state
+    stamp = descriptor_store.version_stamp(index._collection_signature())
+    os.makedirs(tmp_path / stamp)
+    with open(tmp_path / stamp / 'manifest.json', 'w') as f:
+        json.dump({'format': 1, 'version': stamp, 'count': 5}, f)
+
+    index.refresh()
+
+    assert index.data is not None
+    assert len(index) == 5
+    assert index.store_version == stamp
+    assert descriptor_store.read_manifest(tmp_path / stamp)['format'] == descriptor_store.FORMAT_VERSION
+    assert index.search(descriptor_document('aGrass', 'query.jpg', 0), DEFAULT_WEIGHTS,
+                        top_k=1)[0]['image_name'] == 'a000.jpg'
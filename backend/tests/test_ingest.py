@@ -0,0 +1,39 @@
+import os
+import shutil
+
+import cv2
+import mongomock
+import numpy as np
+
+from ingest import ingest_dataset
+
+
+def write_image(path, seed):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cv2.imwrite(str(path), np.random.default_rng(seed).integers(0, 256, size=(32, 32, 3), dtype=np.uint8))
+
+
+def indexed_keys(collection):
+    return sorted((doc['category'], doc['image_name']) for doc in collection.find())
+
+
+def test_ingest_skips_only_unchanged_images_under_the_same_name(tmp_path):
+    collection = mongomock.MongoClient()['ImageMatch']['image_descriptors2']
+    write_image(tmp_path / 'aGrass' / 'a001.png', 0)
+    write_image(tmp_path / 'aGrass' / 'a002.png', 1)
+
+    stats = ingest_dataset(collection, str(tmp_path), workers=1)
+    assert stats['indexed'] == 2
+    assert ingest_dataset(collection, str(tmp_path), workers=1)['skipped'] == 2
+
+    # Same bytes under another name and in another category, and a file whose contents changed
+    shutil.copy(tmp_path / 'aGrass' / 'a001.png', tmp_path / 'aGrass' / 'a003.png')
+    shutil.copytree(tmp_path / 'aGrass', tmp_path / 'bField')
+    write_image(tmp_path / 'aGrass' / 'a002.png', 2)
+
+    stats = ingest_dataset(collection, str(tmp_path), workers=1)
+    assert (stats['indexed'], stats['skipped']) == (5, 1)
+    assert indexed_keys(collection) == [('aGrass', 'a001.png'), ('aGrass', 'a002.png'), ('aGrass', 'a003.png'),
+                                        ('bField', 'a001.png'), ('bField', 'a002.png'), ('bField', 'a003.png')]
+    changed = collection.find_one({'category': 'aGrass', 'image_name': 'a002.png'})
+    assert changed['content_hash'] != collection.find_one({'category': 'bField', 'image_name': 'a002.png'})['content_hash']
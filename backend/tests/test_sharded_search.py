@@ -0,0 +1,53 @@
+import mongomock
+import pytest
+
+from descriptor_index import DescriptorIndex
+from documents import descriptor_document
+from sharded_search import ShardedSearch
+from weights_store import DEFAULT_WEIGHTS
+
+
+def assert_same_ranking(results, expected):
+    # The batched many-query path may differ from the per-query one in the last bits of a score
+    assert [(r['category'], r['image_name']) for r in results] == [(r['category'], r['image_name']) for r in expected]
+    assert [r['similarity_score'] for r in results] == pytest.approx([r['similarity_score'] for r in expected])
+
+
+@pytest.fixture
+def descriptor_index(tmp_path):
+    collection = mongomock.MongoClient()['ImageMatch']['image_descriptors2']
+    collection.insert_many([descriptor_document(('aGrass', 'bField')[i % 2], f"{i:03d}.jpg", i) for i in range(30)])
+    # Same descriptors as 004.jpg in the other shards: ties must still be ranked by row position
+    collection.insert_many([descriptor_document('cIndustry', f"dup{i}.jpg", 4) for i in range(3)])
+    index = DescriptorIndex(collection, store_dir=str(tmp_path))
+    index.refresh()
+    return index
+
+
+@pytest.mark.parametrize('shards', [2, 3])
+def test_sharded_search_matches_exhaustive_search(descriptor_index, shards):
+    sharded = ShardedSearch(descriptor_index, shards=shards, min_shard_rows=1)
+    queries = [descriptor_document('query', 'q.jpg', 1000), descriptor_document('aGrass', '004.jpg', 4)]
+    try:
+        assert len(sharded.shard_bounds(len(descriptor_index))) == shards
+        for top_k in (1, 6, 50):
+            for results, query in zip(sharded.search_many(queries, DEFAULT_WEIGHTS, top_k), queries):
+                assert_same_ranking(results, descriptor_index.search(query, DEFAULT_WEIGHTS, top_k))
+    finally:
+        sharded.close()
+
+
+def test_small_collection_is_searched_in_process(descriptor_index):
+    sharded = ShardedSearch(descriptor_index, shards=4)
+    query = descriptor_document('query', 'q.jpg', 1000)
+
+    assert_same_ranking(sharded.search(query, DEFAULT_WEIGHTS, 5), descriptor_index.search(query, DEFAULT_WEIGHTS, 5))
+    assert sharded._pool is None
+
+
+def test_shard_bounds_cover_every_row():
+    sharded = ShardedSearch(None, shards=4, min_shard_rows=10)
+    for count in (0, 1, 9, 10, 35, 1001):
+        bounds = sharded.shard_bounds(count)
+        assert [row for start, stop in bounds for row in range(start, stop)] == list(range(count))
+        assert len(bounds) <= 4
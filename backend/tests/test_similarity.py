@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from similarity import (
+    HISTOGRAM_CHANNELS, bhattacharyya_distance, bhattacharyya_distance_batch, bhattacharyya_distance_many,
+    bhattacharyya_lower_bound_batch, coarse_histogram_terms, dominant_color_distance,
+    dominant_color_distance_batch, dominant_color_lower_bound_batch, dominant_color_sums, histogram_terms,
+)
+
+
+def random_histograms(rng, n):
+    """(N, 3, 256) pixel-count histograms, sparse like the ones of real images."""
+    hists = rng.integers(0, 500, size=(n, 3, 256)).astype(np.float32)
+    hists[rng.random(hists.shape) < 0.4] = 0
+    return hists
+
+
+def as_document(hist):
+    return {color: hist[c].tolist() for c, color in enumerate(HISTOGRAM_CHANNELS)}
+
+
+@pytest.fixture
+def hists():
+    return random_histograms(np.random.default_rng(0), 64)
+
+
+def test_bhattacharyya_batch_matches_compare_hist(hists):
+    query = random_histograms(np.random.default_rng(1), 1)[0]
+    expected = np.array([bhattacharyya_distance(as_document(query), as_document(h)) for h in hists])
+
+    batch = bhattacharyya_distance_batch(as_document(query), hists, chunk_size=10)
+
+    # Documented bound: 1e-8 / d per channel, within 1e-6 for d > 0.01
+    assert expected.min() > 3 * 0.01
+    np.testing.assert_allclose(batch, expected, rtol=0, atol=1e-6)
+    np.testing.assert_allclose(bhattacharyya_distance_many([as_document(query)], hists)[0], expected,
+                               rtol=0, atol=1e-6)
+
+
+def test_bhattacharyya_batch_of_identical_histograms(hists):
+    batch = bhattacharyya_distance_batch(as_document(hists[5]), hists, terms=histogram_terms(hists))
+
+    assert bhattacharyya_distance(as_document(hists[5]), as_document(hists[5])) < 2e-4
+    assert batch[5] < 2e-4
+    assert np.argmin(batch) == 5
+
+
+def test_bhattacharyya_lower_bound(hists):
+    query = as_document(random_histograms(np.random.default_rng(2), 1)[0])
+    _, sums = histogram_terms(hists)
+
+    bound = bhattacharyya_lower_bound_batch(query, coarse_histogram_terms(hists), sums)
+
+    assert np.all(bound <= bhattacharyya_distance_batch(query, hists) + 1e-6)
+
+
+def test_dominant_color_batch_matches_scalar():
+    rng = np.random.default_rng(3)
+    counts = rng.integers(1, 6, size=32)
+    rows = [rng.random((count, 3)) * 255 for count in counts]
+    colors = np.zeros((len(rows), counts.max(), 3))
+    for row, row_colors in enumerate(rows):
+        colors[row, :len(row_colors)] = row_colors
+
+    for query in (rng.random((3, 3)) * 255, rng.random((7, 3)) * 255):
+        expected = [dominant_color_distance(query, row_colors) for row_colors in rows]
+
+        np.testing.assert_allclose(dominant_color_distance_batch(query, colors, counts, chunk_size=5), expected,
+                                   rtol=1e-9)
+        assert np.all(dominant_color_lower_bound_batch(query, dominant_color_sums(colors), counts)
+                      <= np.array(expected) + 1e-9)
@@ -0,0 +1,40 @@
+import os
+import stat
+import threading
+
+from upload_store import UploadStore
+
+
+def test_saved_upload_is_readable_once_waited_for(tmp_path):
+    store = UploadStore(str(tmp_path))
+    release = threading.Event()
+    store._executor.submit(release.wait)
+
+    name, future = store.save('query image.png', b'png bytes')
+    assert not future.done()
+    release.set()
+    store.wait(name)
+
+    path = tmp_path / name
+    assert path.read_bytes() == b'png bytes'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    assert store.stats()['pending'] == 0
+
+
+def test_save_waits_when_the_queue_is_full(tmp_path):
+    store = UploadStore(str(tmp_path), max_pending=2)
+    release = threading.Event()
+    store._executor.submit(release.wait)
+    futures = [store.save(f"{i}.png", b'x')[1] for i in range(2)]
+    assert store.stats()['pending'] == 2
+
+    saved = []
+    third = threading.Thread(target=lambda: saved.append(store.save('2.png', b'x')))
+    third.start()
+    third.join(0.2)
+    assert third.is_alive() and not saved
+
+    release.set()
+    third.join()
+    assert saved[0][1].done() and all(future.done() for future in futures)
+    assert sorted(os.listdir(tmp_path)) == ['0.png', '1.png', '2.png']
@@ -0,0 +1,136 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+
+class UploadStore:
+    def __init__(self, directory, max_bytes=None, max_files=None, max_age=None, max_pending=32):
+        """
+        Uploaded images kept on disk for display, written off the request path and pruned by a retention policy
+
+        :param directory: Folder the uploads are written to (processed/)
+        :param max_bytes: Total size above which the oldest uploads are deleted (None for no limit)
+        :param max_files: Number of uploads above which the oldest are deleted (None for no limit)
+        :param max_age: Seconds after which an upload is deleted (None for no limit)
+        :param max_pending: Queued writes above which save() waits for its own write (bounds the queued bytes)
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_age = max_age
+        self.max_pending = max_pending
+        self.saved = 0
+        self.pruned = 0
+        self._lock = threading.Lock()
+        # name -> future of its newest queued write, so readers can wait for a file that is not on disk yet
+        self._pending = {}
+        self._queued = 0
+        # One writer thread: saves are serialized, and retention never runs concurrently with itself
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-store')
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, filename, data):
+        """
+        Queue encoded image bytes to be written as filename, and return right away unless
+        max_pending writes are already queued: the write is then waited for, like a synchronous one.
+        Until the write is done the file may not exist yet; readers call wait(name) first.
+
+        :return: (name the file will have, future of the write)
+        """
+        name = secure_filename(filename) or 'upload'
+        with self._lock:
+            backlog = self._queued >= self.max_pending
+            future = self._executor.submit(self._write, name, data)
+            self._pending[name] = future
+            self._queued += 1
+        future.add_done_callback(lambda done: self._written(name, done))
+        if backlog:
+            future.result()
+        return name, future
+
+    def _written(self, name, future):
+        with self._lock:
+            self._queued -= 1
+            if self._pending.get(name) is future:
+                del self._pending[name]
+
+    def wait(self, name, timeout=None):
+        """Block until the queued write of name (if any) is done, e.g. before serving the file."""
+        with self._lock:
+            future = self._pending.get(name)
+        if future is not None:
+            future.result(timeout)
+
+    def _write(self, name, data):
+        # Written under a temporary name, so /processed never serves a partial file
+        fd, staging = tempfile.mkstemp(prefix='.tmp-', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # mkstemp creates the file 0600; uploads are served like any other static file
+            os.chmod(staging, 0o644)
+            os.replace(staging, os.path.join(self.directory, name))
+        except OSError:
+            logger.exception("Could not save upload %s", name)
+            if os.path.exists(staging):
+                os.remove(staging)
+            return
+        with self._lock:
+            self.saved += 1
+        self.enforce_retention()
+
+    def enforce_retention(self):
+        """Delete uploads older than max_age, then the oldest ones until max_files and max_bytes hold."""
+        if self.max_age is None and self.max_files is None and self.max_bytes is None:
+            return 0
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort(reverse=True)
+
+        cutoff = time.time() - self.max_age if self.max_age is not None else None
+        kept, total, full, expired = 0, 0, False, []
+        for mtime, size, path in entries:
+            # Newest first: once a limit is reached, every older upload goes too
+            full = (full or (self.max_files is not None and kept >= self.max_files)
+                    or (self.max_bytes is not None and total + size > self.max_bytes))
+            if full or (cutoff is not None and mtime < cutoff):
+                expired.append(path)
+            else:
+                kept += 1
+                total += size
+        for path in expired:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+        if expired:
+            with self._lock:
+                self.pruned += len(expired)
+            logger.info("Upload retention removed %d file(s) from %s", len(expired), self.directory)
+        return len(expired)
+
+    def flush(self):
+        """Wait for every queued write (and its retention pass) to finish."""
+        self._executor.submit(lambda: None).result()
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'saved': self.saved,
+            'pending': self._queued,
+            'max_pending': self.max_pending,
+            'pruned': self.pruned,
+            'max_bytes': self.max_bytes,
+            'max_files': self.max_files,
+            'max_age': self.max_age,
+        }
@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+from feedback_log import write_json_atomic
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WEIGHTS_FILE = os.path.join(BASE_DIR, 'weights_config.json')
+
+DEFAULT_WEIGHTS = {
+    "histogram": 0.3,
+    "dominant_colors": 0.1,
+    "gabor_descriptors": 0.2,
+    "hu_moments": 0.1,
+    "texture_energy": 0.395,
+    "circularity": 0.005
+}
+
+# Read-only view of the weights plus a counter that changes whenever the weights do
+WeightsSnapshot = namedtuple('WeightsSnapshot', ['version', 'weights'])
+
+
+class WeightsStore:
+    def __init__(self, weights_file=WEIGHTS_FILE, defaults=DEFAULT_WEIGHTS):
+        """
+        Keeps the current feature weights in memory and reloads them only when the file changes
+
+        :param weights_file: Path of the JSON weights file
+        :param defaults: Weights used when the file is missing
+        """
+        self.weights_file = weights_file
+        self.defaults = dict(defaults)
+        self._lock = threading.Lock()
+        self._file_stamp = None
+        self._snapshot = WeightsSnapshot(0, MappingProxyType(dict(self.defaults)))
+        self.reload()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.weights_file)
+            return (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _publish(self, weights, file_stamp):
+        self._snapshot = WeightsSnapshot(self._snapshot.version + 1, MappingProxyType(dict(weights)))
+        self._file_stamp = file_stamp
+
+    def reload(self):
+        """
+        Re-read the weights file. A missing file falls back to the defaults; an unreadable
+        (e.g. half-written) file keeps the previous snapshot until the next change.
+
+        :return: The current WeightsSnapshot
+        """
+        with self._lock:
+            file_stamp = self._stat()
+            if file_stamp is None:
+                if self._file_stamp is not None or self._snapshot.version == 0:
+                    self._publish(self.defaults, None)
+                return self._snapshot
+            try:
+                with open(self.weights_file, 'r') as f:
+                    weights = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                return self._snapshot
+            self._publish(weights, file_stamp)
+            return self._snapshot
+
+    def snapshot(self):
+        """
+        Current weights, reloaded first if the file's mtime or size changed.
+        Take one snapshot per ranking pass; it never changes underneath the caller.
+
+        :return: WeightsSnapshot(version, weights)
+        """
+        if self._stat() != self._file_stamp:
+            return self.reload()
+        return self._snapshot
+
+    def update(self, weights):
+        """
+        Save new weights to the file and publish them as a new snapshot. The file is replaced
+        atomically, so other workers never read a half-written file.
+
+        :param weights: Dictionary of feature weights
+        :return: The new WeightsSnapshot
+        """
+        with self._lock:
+            write_json_atomic(self.weights_file, weights, indent=4)
+            self._publish(weights, self._stat())
+            return self._snapshot
+
+
+# Shared by the similarity scorer and the relevance feedback manager
+default_weights_store = WeightsStore()
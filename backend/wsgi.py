@@ -0,0 +1,14 @@
+"""
+WSGI entry point for production servers.
+
+Importing this module loads the descriptor index (synchronously, so a pre-fork server forks its
+workers with the index already in memory) and warms up the process: Gabor filter bank and the
+lazily imported packages. With gunicorn, see gunicorn.conf.py:
+
+    cd backend && gunicorn -c gunicorn.conf.py
+"""
+from app import create_app, warm_up
+
+application = create_app(background=False, prefork=True)
+# The warm-up query runs in each worker after fork (post_fork), not here
+warm_up(query=False)
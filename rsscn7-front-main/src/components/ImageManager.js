@@ -145,6 +145,11 @@ const ImageManager = () => {
         localStorage.setItem("uploadedImage", uploadResponse.data.filePath);
       }
   
+      // Store the query id used by the feedback rounds
+      if (uploadResponse.data.query_id) {
+        localStorage.setItem("queryId", uploadResponse.data.query_id);
+      }
+
       // Store similar images in localStorage
       if (uploadResponse.data.similar_images) {
         localStorage.setItem(
@@ -209,6 +214,11 @@ const ImageManager = () => {
       // Successfully uploaded
       toast.success("Image uploaded successfully!");
 
+      // Store the query id used by the feedback rounds
+      if (uploadResponse.data.query_id) {
+        localStorage.setItem("queryId", uploadResponse.data.query_id);
+      }
+
       // Store similar images in localStorage
       if (uploadResponse.data.similar_images) {
         localStorage.setItem(
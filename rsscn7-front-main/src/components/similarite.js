@@ -15,6 +15,7 @@ const Similarite = () => {
   const [uploadedImage, setUploadedImage] = useState(null);
   const [similarImages, setSimilarImages] = useState([]);
   const [queryDescriptors, setQueryDescriptors] = useState({});
+  const [queryId, setQueryId] = useState(null);
   const [feedbackItems, setFeedbackItems] = useState([]);
   const [selectedAnalysis, setSelectedAnalysis] = useState(null);
   const [userName, setUserName] = useState(""); // For storing the user's name
@@ -36,6 +37,7 @@ const Similarite = () => {
     const uploadedImageData = localStorage.getItem("uploadedImage");
     const similarImagesData = localStorage.getItem("similarImages");
     const queryDescriptorsData = localStorage.getItem("queryDescriptors");
+    const queryIdData = localStorage.getItem("queryId");
 
     if (uploadedImageData) {
       setUploadedImage(uploadedImageData);
@@ -48,6 +50,10 @@ const Similarite = () => {
     if (queryDescriptorsData) {
       setQueryDescriptors(JSON.parse(queryDescriptorsData));
     }
+
+    if (queryIdData) {
+      setQueryId(queryIdData);
+    }
   }, []);
 
   const handleFeedbackChange = (index, event) => {
@@ -85,6 +91,7 @@ const Similarite = () => {
           "Content-Type": "application/json",
         },
         body: JSON.stringify({
+          query_id: queryId,
           query_descriptors: queryDescriptors,
           feedback_items: validFeedbackItems,
         }),
@@ -259,7 +266,7 @@ const Similarite = () => {
                 }}
               >
                 <img
-                  src={`http://localhost:5001/static/dataset/${image.category}/${image.image_name}`}
+                  src={`http://localhost:5001/thumbnails/${image.category}/${image.image_name}?size=256`}
                   alt={image.image_name}
                   style={{
                     maxWidth: "100%",